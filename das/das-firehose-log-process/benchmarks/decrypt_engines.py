@@ -0,0 +1,70 @@
+"""
+Benchmark of the payload decryption engines.
+
+Times the Encryption SDK and `decryption` on DAS-like payloads; the tests in
+``tests/test_decryption.py`` check that both agree. Runs fully offline:
+
+    poetry run python benchmarks/decrypt_engines.py [records]
+"""
+
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("kms_key_arn", "arn:aws:kms:us-east-1:000000000000:key/local")
+os.environ.setdefault("rds_resource_id", "cluster-LOCAL")
+
+from selectstar_das_processor import handler  # noqa: E402
+from workload import HEARTBEAT, TEMPLATES, encrypt_record_set, make_event  # noqa: E402
+
+
+def measure(label, fn, payloads, repeat=5):
+    """
+    Return the best per-record time of ``fn`` over ``repeat`` runs.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for payload, data_key in payloads:
+            for _chunk in fn(payload, data_key):
+                pass
+        best = min(best, (time.perf_counter() - start) / len(payloads))
+    print(f"{label:<32} {best * 1e6:10.1f} us/record")
+    return best
+
+
+if __name__ == "__main__":
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rnd = random.Random(0)
+    for size, events in [("small", 20), ("small", 1000), ("large", 200)]:
+        data_key = os.urandom(32)
+        # As if unwrapped with KMS, for both engines to reuse their objects.
+        handler.data_key_cache.put(data_key, {}, data_key)
+        payloads = [
+            (
+                encrypt_record_set(
+                    [
+                        (
+                            HEARTBEAT
+                            if rnd.random() < 0.5
+                            else make_event(rnd, rnd.choice(list(TEMPLATES)), size)
+                        )
+                        for _ in range(events)
+                    ],
+                    data_key,
+                ),
+                data_key,
+            )
+            for _ in range(records)
+        ]
+        average = sum(len(payload) for payload, _ in payloads) // records
+        print(f"{events} {size} events per record, {average} bytes:")
+        timings = {}
+        for engine in ("sdk", "direct"):
+            handler.DECRYPT_ENGINE = engine
+            timings[engine] = measure(
+                f"  decrypt_stream ({engine})", handler.decrypt_stream, payloads
+            )
+        print(f"  speedup: {timings['sdk'] / timings['direct']:.2f}x")
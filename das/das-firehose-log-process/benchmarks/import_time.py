@@ -0,0 +1,112 @@
+"""
+Import-time report of the Lambda handler, the largest part of a cold start.
+
+Imports the handler module in a fresh interpreter with ``python -X importtime``
+and reports the total time, the modules with the highest self time and the
+time per top-level package:
+
+    poetry run python benchmarks/import_time.py
+    poetry run python benchmarks/import_time.py --path package --no-bytecode
+    poetry run python benchmarks/import_time.py --path ../../redshift --module provision
+
+``--path package`` profiles the deployment package built by ``deploy.sh``, and
+``--no-bytecode`` ignores cached bytecode, as in a package shipped without it.
+``--call`` times an expression run after the import, such as the creation of
+the KMS client, which is deferred to the first invocation.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+MARKER = "-- import_time --"
+
+# Settings the handler reads at import.
+ENVIRONMENT = {
+    "AWS_REGION": "us-east-1",
+    "kms_key_arn": "arn:aws:kms:us-east-1:123456789012:key/import-time",
+    "rds_resource_id": "db-IMPORTTIME",
+}
+
+SCRIPT = """
+import sys, time, json
+print({marker!r}, file=sys.stderr, flush=True)
+started = time.perf_counter()
+import {module} as module
+imported = time.perf_counter()
+{call}
+print(json.dumps({{"import": imported - started, "call": time.perf_counter() - imported}}))
+"""
+
+
+def profile(module, paths=(), call=None, bytecode=True):
+    """
+    Import ``module`` in a fresh interpreter and return its import time, the
+    time of ``call`` and the ``(module, depth, self_us, cumulative_us)`` entries
+    of ``-X importtime`` in import order.
+    """
+    env = dict(ENVIRONMENT, **os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([*paths, env.get("PYTHONPATH", ".")])
+    with tempfile.TemporaryDirectory() as prefix:
+        if not bytecode:
+            # An empty cache directory makes every module compile again.
+            env["PYTHONPYCACHEPREFIX"] = prefix
+            env["PYTHONDONTWRITEBYTECODE"] = "1"
+        script = SCRIPT.format(
+            marker=MARKER, module=module, call=f"module.{call}" if call else ""
+        )
+        done = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if done.returncode != 0:
+        sys.exit(done.stderr)
+    lines = done.stderr.split(MARKER, 1)[1].splitlines()
+    entries = []
+    for line in lines:
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return json.loads(done.stdout.splitlines()[-1]), entries
+
+
+def by_package(entries):
+    packages = defaultdict(int)
+    for name, _depth, self_us, _cumulative_us in entries:
+        packages[name.split(".")[0]] += self_us
+    return sorted(packages.items(), key=lambda item: -item[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="selectstar_das_processor.handler")
+    parser.add_argument(
+        "--path", action="append", default=[], help="directory to import from"
+    )
+    parser.add_argument("--call", help="expression on the module to time")
+    parser.add_argument("--no-bytecode", action="store_true")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    timings, entries = profile(
+        args.module, args.path, args.call, bytecode=not args.no_bytecode
+    )
+    print(f"Import of {args.module}: {timings['import'] * 1000:.1f} ms")
+    if args.call:
+        print(f"{args.call}: {timings['call'] * 1000:.1f} ms")
+    print(f"\n{'self ms':>9} {'total ms':>9}  module")
+    for name, _depth, self_us, cumulative_us in sorted(
+        entries, key=lambda entry: -entry[2]
+    )[: args.top]:
+        print(f"{self_us / 1000:>9.1f} {cumulative_us / 1000:>9.1f}  {name}")
+    print(f"\n{'self ms':>9}  package")
+    for package, self_us in by_package(entries)[: args.top]:
+        print(f"{self_us / 1000:>9.1f}  {package}")
@@ -0,0 +1,69 @@
+"""
+Micro-benchmark for the per-record cost of building key providers and crypto
+materials managers, with and without keeping them in the data key cache.
+
+Runs fully offline with a locally generated raw data key:
+
+    poetry run python benchmarks/materials_manager.py [records]
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("kms_key_arn", "arn:aws:kms:us-east-1:000000000000:key/local")
+os.environ.setdefault("rds_resource_id", "cluster-LOCAL")
+
+from selectstar_das_processor import handler  # noqa: E402
+from workload import HEARTBEAT, encrypt_record_set  # noqa: E402
+
+
+def measure(label, fn, records, repeat=5):
+    """
+    Return the best per-record time of ``fn`` over ``repeat`` runs.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(records):
+            fn()
+        best = min(best, (time.perf_counter() - start) / records)
+    print(f"{label:<32} {best * 1e6:10.1f} us/record")
+    return best
+
+
+if __name__ == "__main__":
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    data_key = os.urandom(32)
+    payload = encrypt_record_set([HEARTBEAT] * 20, data_key)
+    build_manager = handler.build_materials_manager
+
+    # As if unwrapped with KMS, for the managers to be kept with the key.
+    handler.data_key_cache.clear()
+    handler.data_key_cache.put(data_key, {}, data_key)
+    uncached_setup = measure(
+        "materials manager (uncached)", lambda: build_manager(data_key), records
+    )
+    cached_setup = measure(
+        "materials manager (cached)",
+        lambda: handler.get_materials_manager(data_key),
+        records,
+    )
+
+    def decrypt_uncached():
+        handler.enc_client.decrypt(
+            source=payload, materials_manager=build_manager(data_key)
+        )
+
+    def decrypt_cached():
+        handler.enc_client.decrypt(
+            source=payload, materials_manager=handler.get_materials_manager(data_key)
+        )
+
+    uncached = measure("decrypt record (uncached)", decrypt_uncached, records)
+    cached = measure("decrypt record (cached)", decrypt_cached, records)
+    print(
+        f"setup overhead saved: {(uncached_setup - cached_setup) * 1e6:.1f} us/record, "
+        f"decrypt speedup: {uncached / cached:.2f}x"
+    )
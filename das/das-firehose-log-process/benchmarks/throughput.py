@@ -0,0 +1,184 @@
+"""
+Throughput benchmark of `lambda_handler` over synthetic DAS workloads.
+
+Runs the handler offline against batches from `workload.py` across batch
+sizes, heartbeat ratios and event sizes, and reports records/s, events/s,
+input bytes/s and peak RSS per case. Results are written to ``--output`` or
+the git-ignored ``benchmarks/results/`` as JSON, tagged with the git commit and
+the handler settings, and can be compared with an earlier run:
+
+    poetry run python benchmarks/throughput.py
+    poetry run python benchmarks/throughput.py --quick --compare results/<file>.json
+
+Handler settings such as ``worker_threads`` or ``output_format`` are read from
+the environment, as in Lambda.
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import workload  # noqa: E402
+
+from selectstar_das_processor import handler  # noqa: E402
+from selectstar_das_processor.pipeline import peak_rss  # noqa: E402
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+SETTINGS = (
+    "worker_threads",
+    "worker_processes",
+    "output_format",
+    "command_dedup",
+    "event_filter_rules",
+    "metrics",
+)
+
+MATRIX = {
+    "records": [1, 50, 200],
+    "heartbeat_ratio": [0.0, 0.5, 0.9],
+    "size": ["small", "large"],
+}
+QUICK_MATRIX = {
+    "records": [50],
+    "heartbeat_ratio": [0.0, 0.9],
+    "size": ["small", "large"],
+}
+
+
+def run_case(kms, records, heartbeat_ratio, size, events_per_record, repeat):
+    """
+    Return the best of ``repeat`` timed handler runs over one batch.
+    """
+    event = workload.make_batch(
+        kms,
+        records=records,
+        events_per_record=events_per_record,
+        heartbeat_ratio=heartbeat_ratio,
+        size=size,
+    )
+    bytes_in = sum(len(record["data"]) for record in event["records"])
+    best = float("inf")
+    peak = 0
+    output = None
+    # Without the keys of earlier cases. The first run is not timed: it warms up
+    # the key cache and materials managers, as in a warm Lambda container.
+    handler.data_key_cache.clear()
+    for run in range(repeat + 1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            output = handler.lambda_handler(event, None)
+            elapsed = time.perf_counter() - start
+        if run:
+            best = min(best, elapsed)
+        peak = max(peak, peak_rss())
+    bytes_out = sum(len(record.get("data", "")) for record in output["records"])
+    events = records * events_per_record
+    return {
+        "records": records,
+        "heartbeat_ratio": heartbeat_ratio,
+        "size": size,
+        "events_per_record": events_per_record,
+        "seconds": best,
+        "records_per_second": records / best,
+        "events_per_second": events / best,
+        "bytes_per_second": bytes_in / best,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "peak_rss": peak,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def case_key(case):
+    return (case["records"], case["heartbeat_ratio"], case["size"])
+
+
+def compare(cases, path):
+    """
+    Print the change in records/s and peak RSS against an earlier result file.
+    """
+    with open(path) as f:
+        baseline = {case_key(case): case for case in json.load(f)["cases"]}
+    print(f"\nCompared to {path}:")
+    for case in cases:
+        before = baseline.get(case_key(case))
+        if before is None:
+            continue
+        speedup = case["records_per_second"] / before["records_per_second"]
+        memory = (case["peak_rss"] - before["peak_rss"]) / 2**20
+        print(
+            f"{case['records']:>7} {case['heartbeat_ratio']:>9.1f} "
+            f"{case['size']:>6} {speedup:>8.2f}x {memory:+9.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help="run fewer cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--events-per-record", type=int, default=100)
+    parser.add_argument("--output", help="result file, by default in results/")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    args = parser.parse_args()
+
+    kms = workload.StubKMS()
+    handler.kms = kms
+    matrix = QUICK_MATRIX if args.quick else MATRIX
+    cases = []
+    print(
+        f"{'records':>7} {'heartbeat':>9} {'size':>6} {'records/s':>10} "
+        f"{'events/s':>10} {'MB/s':>7} {'peak MiB':>9}"
+    )
+    for records, heartbeat_ratio, size in itertools.product(*matrix.values()):
+        case = run_case(
+            kms, records, heartbeat_ratio, size, args.events_per_record, args.repeat
+        )
+        cases.append(case)
+        print(
+            f"{records:>7} {heartbeat_ratio:>9.1f} {size:>6} "
+            f"{case['records_per_second']:>10.1f} {case['events_per_second']:>10.0f} "
+            f"{case['bytes_per_second'] / 1e6:>7.2f} {case['peak_rss'] / 2**20:>9.1f}"
+        )
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings": {name: os.environ.get(name) for name in SETTINGS},
+        "cases": cases,
+    }
+    path = args.output
+    if path is None:
+        os.makedirs(RESULTS, exist_ok=True)
+        path = os.path.join(
+            RESULTS, f"throughput-{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json"
+        )
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        compare(cases, args.compare)
@@ -0,0 +1,387 @@
+"""
+Synthetic DAS workload generator.
+
+Builds Firehose transformation events the way Database Activity Streams and
+the Kinesis-to-Firehose hop produce them: gzip-compressed record sets encrypted
+with the AWS Encryption SDK under a raw data key, whose KMS-wrapped copy
+travels alongside. `StubKMS` stands in for the KMS client and unwraps data keys
+locally, so the whole pipeline runs offline; the tests use them too. Event templates follow the
+samples in `samples.txt` and the DAS documentation for each engine.
+
+Write a batch to a file for use with other tools:
+
+    poetry run python benchmarks/workload.py --records 100 > event.json
+"""
+
+import argparse
+import base64
+import copy
+import json
+import os
+import random
+import sys
+import zlib
+
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("kms_key_arn", "arn:aws:kms:us-east-1:000000000000:key/local")
+os.environ.setdefault("rds_resource_id", "cluster-LOCAL")
+
+from aws_encryption_sdk.identifiers import Algorithm  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: E402
+
+from selectstar_das_processor import handler  # noqa: E402
+
+ORACLE = {
+    "clientApplication": "RDS Activity Streams",
+    "command": "EXECUTE",
+    "commandText": "BEGIN DBMS_AUDIT_MGMT.CLEAN_AUDIT_TRAIL("
+    "DBMS_AUDIT_MGMT.AUDIT_TRAIL_UNIFIED, true, DBMS_AUDIT_MGMT.CONTAINER_ALL); END;",
+    "databaseName": "ORCL",
+    "dbProtocol": None,
+    "dbUserName": "RDSSEC",
+    "endTime": None,
+    "errorMessage": None,
+    "exitCode": 0,
+    "logTime": "2024-08-15 00:15:22.818828+00",
+    "netProtocol": "tcp",
+    "objectName": "DBMS_AUDIT_MGMT",
+    "objectType": "AUDSYS",
+    "paramList": [],
+    "pid": 32482,
+    "remoteHost": "127.0.0.1",
+    "remotePort": "19928",
+    "rowCount": None,
+    "serverHost": "172.31.38.140",
+    "serverType": "ORACLE",
+    "serverVersion": "19.0.0.0.ru-2024-04.rur-2024-04.r1.SE2.3",
+    "serviceName": "oracle-se2",
+    "sessionId": 364318586,
+    "startTime": None,
+    "statementId": 17969,
+    "substatementId": None,
+    "transactionId": None,
+    "class": "Standard",
+    "type": "record",
+}
+
+SQLSERVER = {
+    "class": "TABLE",
+    "clientApplication": "sqsh-2.5.16.1",
+    "command": "SELECT",
+    "commandText": "select * from products",
+    "databaseName": "olist",
+    "dbProtocol": "SQLSERVER",
+    "dbUserName": "root",
+    "endTime": None,
+    "errorMessage": None,
+    "exitCode": 1,
+    "logTime": "2024-08-15 00:22:34.2930211+00",
+    "netProtocol": None,
+    "objectName": "products",
+    "objectType": "TABLE",
+    "paramList": None,
+    "pid": None,
+    "remoteHost": "207.102.233.169",
+    "remotePort": None,
+    "rowCount": 0,
+    "serverHost": "172.31.41.46",
+    "serverType": "SQLSERVER",
+    "serverVersion": "16.00.4125.3.v1.R1",
+    "serviceName": "sqlserver-se",
+    "sessionId": 63,
+    "startTime": None,
+    "statementId": "0xc46afdf8a6193a4dac66e64c9642c5e3",
+    "substatementId": 1,
+    "transactionId": "26025305",
+    "type": "record",
+    "engineNativeAuditFields": {
+        "target_database_principal_id": 0,
+        "target_database_principal_name": "",
+        "user_defined_information": "",
+        "session_context": "",
+        "is_column_permission": True,
+        "client_tls_version": 0,
+        "duration_milliseconds": 0,
+        "database_transaction_id": 0,
+        "permission_bitmask": "0x00000000000000000000000000000001",
+        "session_server_principal_name": "root",
+        "audit_schema_version": 1,
+        "database_principal_id": 5,
+        "obo_middle_tier_app_id": "",
+        "client_tls_version_name": "",
+        "ledger_start_sequence_number": 0,
+        "is_local_secondary_replica": False,
+        "target_server_principal_id": 0,
+        "server_principal_id": 268,
+        "response_rows": 0,
+        "database_principal_name": "root",
+        "target_server_principal_name": "",
+        "schema_name": "dbo",
+        "object_id": 1490104349,
+        "server_instance_name": "EC2AMAZ-ODHB0PM",
+        "target_server_principal_sid": None,
+        "additional_information": "",
+        "data_sensitivity_information": "",
+        "connection_id": "2D5EAA50-1C1D-429E-8655-2E1F34D356C7",
+        "external_policy_permissions_checked": "",
+        "server_principal_sid": "0x95cc96c1ee625549a996d392c3b84e41",
+        "user_defined_event_id": 0,
+        "host_name": "selectstar",
+    },
+}
+
+POSTGRESQL = {
+    "type": "record",
+    "clientApplication": "psql",
+    "pid": 31127,
+    "dbUserName": "app",
+    "databaseName": "orders",
+    "remoteHost": "10.0.12.57",
+    "remotePort": "49816",
+    "command": "QUERY",
+    "commandText": "select * from orders where customer_id = 42",
+    "paramList": [],
+    "objectType": "TABLE",
+    "objectName": "orders",
+    "statementId": 3,
+    "substatementId": 1,
+    "exitCode": None,
+    "sessionId": "66bd4a2e.7997",
+    "rowCount": None,
+    "serverHost": "10.0.3.11",
+    "serverType": "PostgreSQL",
+    "serviceName": "Amazon Aurora PostgreSQL-Compatible edition",
+    "serverVersion": "16.2.1",
+    "startTime": "2024-08-15 00:31:02.104328+00",
+    "endTime": None,
+    "transactionId": None,
+    "dbProtocol": "Postgres 3.0",
+    "netProtocol": "TCP",
+    "errorMessage": None,
+    "class": "READ",
+    "logTime": "2024-08-15 00:31:02.104455+00",
+}
+
+MYSQL = {
+    "logTime": "2024-08-15 00:35:41.012345+00",
+    "type": "record",
+    "clientApplication": None,
+    "pid": 2830,
+    "dbUserName": "app",
+    "databaseName": "shop",
+    "remoteHost": "10.0.14.22",
+    "remotePort": "53512",
+    "command": "QUERY",
+    "commandText": "SELECT id, total FROM carts WHERE user_id = 17",
+    "paramList": None,
+    "objectType": "TABLE",
+    "objectName": "carts",
+    "statementId": 0,
+    "substatementId": 1,
+    "exitCode": "0",
+    "sessionId": "725121",
+    "rowCount": 1,
+    "serverHost": "shop-instance-1",
+    "serverType": "MySQL",
+    "serviceName": "Amazon Aurora MySQL",
+    "serverVersion": "MySQL 8.0.32",
+    "startTime": "2024-08-15 00:35:41.012300+00",
+    "endTime": "2024-08-15 00:35:41.012345+00",
+    "transactionId": "0",
+    "dbProtocol": "MySQL",
+    "netProtocol": "TCP",
+    "errorMessage": None,
+    "class": "MAIN",
+}
+
+HEARTBEAT = {"type": "heartbeat"}
+
+TEMPLATES = {
+    "oracle": ORACLE,
+    "sqlserver": SQLSERVER,
+    "postgresql": POSTGRESQL,
+    "mysql": MYSQL,
+}
+
+# Statements of "large" events: long statements, IN-lists and parameters.
+_TABLES = ["orders", "order_items", "customers", "products", "payments"]
+
+
+def _large_statement(rnd):
+    table = rnd.choice(_TABLES)
+    ids = ", ".join(str(rnd.randrange(10**6)) for _ in range(rnd.randrange(20, 200)))
+    columns = ", ".join(f"c{i}" for i in range(rnd.randrange(10, 40)))
+    return (
+        f"SELECT {columns} FROM {table} t JOIN customers c ON c.id = t.customer_id "
+        f"WHERE t.id IN ({ids}) AND t.status = 'shipped' ORDER BY t.created_at DESC"
+    )
+
+
+def make_event(rnd, engine, size="small"):
+    """
+    Return an activity event of ``engine`` with randomized per-event fields.
+    """
+    event = copy.deepcopy(TEMPLATES[engine])
+    if event.get("pid") is not None:
+        event["pid"] = rnd.randrange(1000, 65000)
+    event["logTime"] = (
+        f"2024-08-15 {rnd.randrange(24):02}:{rnd.randrange(60):02}:"
+        f"{rnd.randrange(60):02}.{rnd.randrange(10**6):06}+00"
+    )
+    if size == "large":
+        event["commandText"] = _large_statement(rnd)
+        if engine in ("postgresql", "oracle"):
+            event["paramList"] = [str(rnd.randrange(10**6)) for _ in range(32)]
+    elif engine in ("postgresql", "mysql"):
+        event["commandText"] = event["commandText"].rsplit(" ", 1)[0] + (
+            f" {rnd.randrange(10**4)}"
+        )
+    return event
+
+
+def client_error(code, operation):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class StubKMS:
+    """
+    Stands in for the KMS client of the handler: data keys are wrapped with a
+    local AES-GCM key, bound to their encryption context. The key is fixed, so
+    batches written to a file can be unwrapped by another process. Decrypting
+    a wrapped key listed in ``throttled`` fails that many more times with
+    throttling.
+    """
+
+    def __init__(self, key=bytes(32)):
+        self._key = AESGCM(key)
+        self.calls = 0
+        self.throttled = {}
+
+    @staticmethod
+    def _aad(encryption_context):
+        return json.dumps(encryption_context, sort_keys=True).encode("utf-8")
+
+    def wrap(self, plaintext, encryption_context):
+        nonce = os.urandom(12)
+        return nonce + self._key.encrypt(
+            nonce, plaintext, self._aad(encryption_context)
+        )
+
+    def decrypt(self, CiphertextBlob, EncryptionContext):
+        self.calls += 1
+        if self.throttled.get(CiphertextBlob):
+            self.throttled[CiphertextBlob] -= 1
+            raise client_error("ThrottlingException", "Decrypt")
+        try:
+            plaintext = self._key.decrypt(
+                CiphertextBlob[:12], CiphertextBlob[12:], self._aad(EncryptionContext)
+            )
+        except Exception:
+            raise client_error("InvalidCiphertextException", "Decrypt")
+        return {"Plaintext": plaintext}
+
+
+def encryption_context():
+    return handler.source_resolver.default.encryption_context
+
+
+def encrypt_record_set(events, data_key):
+    """
+    Return the encrypted payload of a record set holding ``events``.
+    """
+    record_set = {
+        "type": handler.DAS_EVENT_TYPE,
+        "clusterId": "cluster-LOCAL",
+        "instanceId": "db-LOCAL",
+        "databaseActivityEventList": events,
+    }
+    compressed = zlib.compress(
+        json.dumps(record_set).encode("utf-8"), wbits=zlib.MAX_WBITS + 16
+    )
+    key_provider = handler.MyRawMasterKeyProvider(data_key)
+    key_provider.add_master_key("DataKey")
+    payload, _header = handler.enc_client.encrypt(
+        source=compressed,
+        key_provider=key_provider,
+        algorithm=Algorithm.AES_256_GCM_HKDF_SHA512_COMMIT_KEY,
+        frame_length=4096,
+    )
+    return payload
+
+
+def make_batch(
+    kms,
+    records=100,
+    events_per_record=100,
+    heartbeat_ratio=0.5,
+    size="small",
+    engines=tuple(TEMPLATES),
+    data_keys=2,
+    seed=0,
+):
+    """
+    Return a Firehose transformation event of ``records`` records. Records use
+    one of ``data_keys`` data keys wrapped by ``kms``, consecutive records
+    sharing a key as DAS does.
+    """
+    rnd = random.Random(seed)
+    context = encryption_context()
+    keys = [os.urandom(32) for _ in range(data_keys)]
+    wrapped = [kms.wrap(key, context) for key in keys]
+    output = []
+    for index in range(records):
+        key_index = index * data_keys // records
+        events = [
+            (
+                HEARTBEAT
+                if rnd.random() < heartbeat_ratio
+                else make_event(rnd, rnd.choice(engines), size)
+            )
+            for _ in range(events_per_record)
+        ]
+        data = {
+            "type": "DatabaseActivityMonitoringRecords",
+            "version": "1.2",
+            "databaseActivityEvents": base64.b64encode(
+                encrypt_record_set(events, keys[key_index])
+            ).decode("ascii"),
+            "key": base64.b64encode(wrapped[key_index]).decode("ascii"),
+        }
+        output.append(
+            {
+                "recordId": f"{index:08}",
+                "approximateArrivalTimestamp": 1723680000000 + index,
+                "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode(
+                    "ascii"
+                ),
+            }
+        )
+    return {
+        "invocationId": "00000000-0000-0000-0000-000000000000",
+        "deliveryStreamArn": "arn:aws:firehose:us-east-1:000000000000:"
+        "deliverystream/local",
+        "region": os.environ["AWS_REGION"],
+        "records": output,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--events-per-record", type=int, default=100)
+    parser.add_argument("--heartbeat-ratio", type=float, default=0.5)
+    parser.add_argument("--size", choices=["small", "large"], default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    json.dump(
+        make_batch(
+            StubKMS(),
+            records=args.records,
+            events_per_record=args.events_per_record,
+            heartbeat_ratio=args.heartbeat_ratio,
+            size=args.size,
+            seed=args.seed,
+        ),
+        sys.stdout,
+    )
@@ -0,0 +1,303 @@
+"""
+Direct decryption of the AWS Encryption SDK messages of DAS record sets.
+
+`aws_encryption_sdk` decrypts every message through a materials manager, a key
+provider and a stream of small reads, in Python. DAS messages are all built
+the same way, with the data key wrapped by the key from KMS as the raw AES key
+``DataKey`` of provider ``BC``, so this module parses the message format in a
+single pass over the payload and calls the AES-GCM of `cryptography` directly,
+one frame at a time.
+
+It checks what the SDK checks when decrypting with the DAS key provider: the
+wrapped data key, the header authentication, the key commitment of committing
+algorithm suites, the order of the frames and the signature of signing suites.
+It supports message formats 1 and 2 with all AES-GCM algorithm suites, framed
+and non-framed. ``tests/test_decryption.py`` checks it against the SDK.
+"""
+
+import base64
+import hmac
+import struct
+from collections import namedtuple
+
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+PROVIDER_ID = b"BC"
+IV_LENGTH = 12
+TAG_LENGTH = 16
+# Key info of raw AES keys: the key ID, the tag length in bits and the IV
+# length, followed by the IV.
+KEY_INFO_PREFIX = b"DataKey" + struct.pack(">II", TAG_LENGTH * 8, IV_LENGTH)
+PUBLIC_KEY = "aws-crypto-public-key"
+COMMITMENT_LENGTH = 32
+MAX_FRAME_LENGTH = 2**31 - 1
+
+NON_FRAMED = 1
+FRAMED = 2
+FINAL_FRAME = 0xFFFFFFFF
+FRAME_AAD = b"AWSKMSEncryptionClient Frame"
+FINAL_FRAME_AAD = b"AWSKMSEncryptionClient Final Frame"
+NON_FRAMED_AAD = b"AWSKMSEncryptionClient Single Block"
+
+Suite = namedtuple("Suite", ["key_length", "kdf_hash", "curve", "committing"])
+
+# AES-GCM algorithm suites by ID, with the hash of their HKDF, the curve and
+# hash of their ECDSA signature, and whether they commit to the data key.
+SUITES = {
+    0x0014: Suite(16, None, None, False),
+    0x0046: Suite(24, None, None, False),
+    0x0078: Suite(32, None, None, False),
+    0x0114: Suite(16, hashes.SHA256, None, False),
+    0x0146: Suite(24, hashes.SHA256, None, False),
+    0x0178: Suite(32, hashes.SHA256, None, False),
+    0x0214: Suite(16, hashes.SHA256, (ec.SECP256R1, hashes.SHA256), False),
+    0x0346: Suite(24, hashes.SHA384, (ec.SECP384R1, hashes.SHA384), False),
+    0x0378: Suite(32, hashes.SHA384, (ec.SECP384R1, hashes.SHA384), False),
+    0x0478: Suite(32, hashes.SHA512, None, True),
+    0x0578: Suite(32, hashes.SHA512, (ec.SECP384R1, hashes.SHA384), True),
+}
+
+_SHORT = struct.Struct(">H")
+_INT = struct.Struct(">I")
+
+
+class DecryptionError(Exception):
+    """
+    A message is malformed, unsupported or fails authentication.
+    """
+
+
+class _Reader:
+    """
+    Reads the fields of a message from a buffer.
+    """
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read(self, length):
+        end = self.pos + length
+        if end > len(self.data):
+            raise DecryptionError("Message is truncated")
+        value = self.data[self.pos : end]
+        self.pos = end
+        return value
+
+    def byte(self):
+        return self.read(1)[0]
+
+    def short(self):
+        return _SHORT.unpack(self.read(2))[0]
+
+    def int(self):
+        return _INT.unpack(self.read(4))[0]
+
+
+def _encryption_context(data):
+    """
+    Parse a serialized encryption context and return it as a dict along with
+    its canonical serialization, which is sorted by key.
+    """
+    if not data:
+        return {}, b""
+    reader = _Reader(data)
+    entries = {}
+    for _ in range(reader.short()):
+        key = bytes(reader.read(reader.short()))
+        value = bytes(reader.read(reader.short()))
+        if key in entries:
+            raise DecryptionError("Duplicate key in encryption context")
+        entries[key] = value
+    if reader.pos != len(data):
+        raise DecryptionError("Extra data in encryption context")
+    try:
+        context = {key.decode(): value.decode() for key, value in entries.items()}
+    except UnicodeDecodeError as e:
+        raise DecryptionError("Encryption context is not UTF-8") from e
+    serialized = _SHORT.pack(len(entries)) + b"".join(
+        _SHORT.pack(len(key)) + key + _SHORT.pack(len(value)) + value
+        for key, value in sorted(entries.items())
+    )
+    return context, serialized
+
+
+def _data_key(reader, wrapping_cipher, suite, serialized_context):
+    """
+    Read the encrypted data keys of a message and unwrap the first one of the
+    DAS key provider that unwraps. DAS messages have a single one; the SDK
+    keeps them in a set and fails on the first of them it tries that does not
+    unwrap.
+    """
+    encrypted_keys = [
+        (
+            reader.read(reader.short()),
+            reader.read(reader.short()),
+            reader.read(reader.short()),
+        )
+        for _ in range(reader.short())
+    ]
+    for provider_id, key_info, encrypted in encrypted_keys:
+        if (
+            provider_id != PROVIDER_ID
+            or len(key_info) != len(KEY_INFO_PREFIX) + IV_LENGTH
+            or key_info[: len(KEY_INFO_PREFIX)] != KEY_INFO_PREFIX
+            or len(encrypted) <= TAG_LENGTH
+        ):
+            continue
+        try:
+            data_key = wrapping_cipher.decrypt(
+                key_info[len(KEY_INFO_PREFIX) :], encrypted, serialized_context
+            )
+        except InvalidTag:
+            continue
+        if len(data_key) == suite.key_length:
+            return data_key
+    raise DecryptionError("Unable to decrypt any data key")
+
+
+def _derive_key(data_key, suite_id, suite, message_id):
+    if suite.kdf_hash is None:
+        return data_key
+    if suite.committing:
+        salt, info = message_id, _SHORT.pack(suite_id) + b"DERIVEKEY"
+    else:
+        salt, info = None, _SHORT.pack(suite_id) + message_id
+    return HKDF(suite.kdf_hash(), suite.key_length, salt, info).derive(data_key)
+
+
+def _verify_signature(data, signature, curve, context):
+    curve, hash_type = curve
+    try:
+        public_key = ec.EllipticCurvePublicKey.from_encoded_point(
+            curve(), base64.b64decode(context[PUBLIC_KEY])
+        )
+        digest = hashes.Hash(hash_type())
+        digest.update(data)
+        public_key.verify(
+            bytes(signature), digest.finalize(), ec.ECDSA(Prehashed(hash_type()))
+        )
+    except (InvalidSignature, ValueError) as e:
+        raise DecryptionError("Signature verification failed") from e
+
+
+def decrypt_stream(payload, wrapping_key, chunk_size=2**16, wrapping_cipher=None):
+    """
+    Decrypt a message with the plaintext key from KMS, yielding its plaintext
+    in chunks of about ``chunk_size`` bytes as the frames are decrypted. Raises
+    `DecryptionError` if the message cannot be decrypted; the signature of
+    signing suites is verified before the last chunk is yielded. Callers that
+    keep the plaintext key may pass its ``AESGCM`` as ``wrapping_cipher``.
+    """
+    reader = _Reader(payload)
+    version = reader.byte()
+    if version == 1:
+        if reader.byte() != 0x80:
+            raise DecryptionError("Unknown message type")
+        suite_id = reader.short()
+        message_id = bytes(reader.read(16))
+    elif version == 2:
+        suite_id = reader.short()
+        message_id = bytes(reader.read(32))
+    else:
+        raise DecryptionError(f"Unknown message format version {version}")
+    suite = SUITES.get(suite_id)
+    if suite is None:
+        raise DecryptionError(f"Unsupported algorithm suite {suite_id:#06x}")
+    context, serialized_context = _encryption_context(reader.read(reader.short()))
+    if (suite.curve is None) == (PUBLIC_KEY in context):
+        raise DecryptionError("Signature key does not match the algorithm suite")
+    try:
+        if wrapping_cipher is None:
+            wrapping_cipher = AESGCM(wrapping_key)
+        data_key = _data_key(reader, wrapping_cipher, suite, serialized_context)
+    except ValueError as e:
+        # An invalid length of the key from KMS.
+        raise DecryptionError(str(e)) from e
+    content_type = reader.byte()
+    if content_type not in (NON_FRAMED, FRAMED):
+        raise DecryptionError(f"Unknown content type {content_type}")
+    if version == 1:
+        if reader.int() != 0:
+            raise DecryptionError("Content AAD length must be 0")
+        if reader.byte() != IV_LENGTH:
+            raise DecryptionError("IV length does not match the algorithm suite")
+    frame_length = reader.int()
+    if content_type == FRAMED and frame_length > MAX_FRAME_LENGTH:
+        raise DecryptionError("Frame length larger than allowed")
+    if content_type == NON_FRAMED and frame_length != 0:
+        raise DecryptionError("Non-zero frame length of a non-framed message")
+    if version == 2:
+        commitment = reader.read(COMMITMENT_LENGTH)
+    header = reader.data[: reader.pos]
+
+    if version == 1:
+        header_iv = reader.read(IV_LENGTH)
+    else:
+        header_iv = bytes(IV_LENGTH)
+    header_tag = reader.read(TAG_LENGTH)
+    if suite.committing:
+        expected = HKDF(hashes.SHA512(), COMMITMENT_LENGTH, message_id, b"COMMITKEY")
+        if not hmac.compare_digest(expected.derive(data_key), commitment):
+            raise DecryptionError("Key commitment validation failed")
+    cipher = AESGCM(_derive_key(data_key, suite_id, suite, message_id))
+    try:
+        cipher.decrypt(header_iv, header_tag, header)
+    except InvalidTag as e:
+        raise DecryptionError("Header authentication failed") from e
+
+    try:
+        if content_type == NON_FRAMED:
+            iv = reader.read(IV_LENGTH)
+            (length,) = struct.unpack(">Q", reader.read(8))
+            aad = message_id + NON_FRAMED_AAD + struct.pack(">IQ", 1, length)
+            pending = [cipher.decrypt(iv, reader.read(length + TAG_LENGTH), aad)]
+        else:
+            pending = []
+            pending_size = 0
+            sequence_number = 1
+            while True:
+                number = reader.int()
+                final = number == FINAL_FRAME
+                if final:
+                    number = reader.int()
+                if number != sequence_number:
+                    raise DecryptionError("Frames out of order")
+                iv = reader.read(IV_LENGTH)
+                length = reader.int() if final else frame_length
+                if length > frame_length:
+                    raise DecryptionError("Final frame longer than the frame length")
+                aad = (
+                    message_id
+                    + (FINAL_FRAME_AAD if final else FRAME_AAD)
+                    + struct.pack(">IQ", number, length)
+                )
+                plaintext = cipher.decrypt(iv, reader.read(length + TAG_LENGTH), aad)
+                if final:
+                    pending.append(plaintext)
+                    break
+                sequence_number += 1
+                pending.append(plaintext)
+                pending_size += len(plaintext)
+                if pending_size >= chunk_size:
+                    yield b"".join(pending)
+                    pending = []
+                    pending_size = 0
+    except InvalidTag as e:
+        raise DecryptionError("Body authentication failed") from e
+
+    if suite.curve is not None:
+        signed = reader.pos
+        try:
+            signature = reader.read(reader.short())
+        except DecryptionError as e:
+            raise DecryptionError("No signature found in message") from e
+        _verify_signature(reader.data[:signed], signature, suite.curve, context)
+    plaintext = b"".join(pending)
+    if plaintext:
+        yield plaintext
@@ -0,0 +1,135 @@
+"""
+Output formats for filtered DAS record sets.
+
+Each encoder receives the top-level fields and the kept events of a record set
+as raw JSON text (events also as decoded dicts), and `finish` returns the data
+of the Firehose output record.
+"""
+
+import base64
+import json
+
+from .pipeline import EVENT_LIST, RecordSetEncoder
+
+
+class PackedRecordSetEncoder(RecordSetEncoder):
+    """
+    The original output format: the gzip-compressed record set, base64 encoded
+    into a ``{"databaseActivityEvents": ...}`` document.
+    """
+
+    def finish(self):
+        return (
+            b'{"databaseActivityEvents": "' + base64.b64encode(super().finish()) + b'"}'
+        )
+
+
+class NdjsonEncoder:
+    """
+    Newline-delimited JSON with one line per event. The record-set fields other
+    than ``type`` that precede the event list (eg. ``clusterId`` and
+    ``instanceId``) are folded into every line. Compression is left to the
+    Firehose delivery stream.
+    """
+
+    def __init__(self):
+        self._prefix = ""
+        self._lines = []
+        self.bytes_in = 0
+
+    def field(self, key, raw_value):
+        if key != "type":
+            self._prefix += f"{json.dumps(key)}: {raw_value}, "
+
+    def event(self, raw_event, event=None):
+        body = raw_event[1:].lstrip()
+        prefix = self._prefix[:-2] if body[:1] == "}" else self._prefix
+        line = f"{{{prefix}{body}".encode("utf-8")
+        self.bytes_in += len(line) + 1
+        self._lines.append(line)
+
+    def finish(self):
+        return b"\n".join(self._lines)
+
+
+class ColumnarEncoder:
+    """
+    A dictionary-encoded columnar block per record set. Every event field
+    becomes a column holding the distinct values of the field and, per event,
+    the index of its value (-1 where the event lacks the field). Fields such as
+    ``serverHost`` or ``dbUserName`` that repeat in nearly every event are
+    stored once per record set. Use `read_columnar` to rebuild the events.
+    """
+
+    FORMAT = "das-columnar-1"
+
+    def __init__(self):
+        self._fields = []
+        self._columns = {}
+        self._count = 0
+        self.bytes_in = 0
+
+    def field(self, key, raw_value):
+        self._fields.append(f"{json.dumps(key)}:{raw_value}")
+
+    def event(self, raw_event, event=None):
+        if event is None:
+            event = json.loads(raw_event)
+        self.bytes_in += len(raw_event)
+        count = self._count
+        for name, value in event.items():
+            column = self._columns.get(name)
+            if column is None:
+                column = self._columns[name] = ([], {}, [-1] * count)
+            values, lookup, indices = column
+            if isinstance(value, (dict, list)):
+                key = (list, json.dumps(value, sort_keys=True))
+            else:
+                # Keyed by type as well, so that eg. 1 and True stay distinct.
+                key = (value.__class__, value)
+            index = lookup.get(key)
+            if index is None:
+                index = lookup[key] = len(values)
+                values.append(value)
+            indices.append(index)
+        self._count = count = count + 1
+        if len(event) < len(self._columns):
+            for _values, _lookup, indices in self._columns.values():
+                if len(indices) < count:
+                    indices.append(-1)
+
+    def finish(self):
+        columns = {
+            name: {"values": values, "indices": indices}
+            for name, (values, _lookup, indices) in self._columns.items()
+        }
+        return (
+            f'{{"format":"{self.FORMAT}","fields":{{{",".join(self._fields)}}},'
+            f'"count":{self._count},"columns":'
+            + json.dumps(columns, separators=(",", ":"))
+            + "}"
+        ).encode("utf-8")
+
+
+def read_columnar(data):
+    """
+    Rebuild the record set from a block written by `ColumnarEncoder`. Events
+    share the decoded object and list values of their columns.
+    """
+    block = json.loads(data)
+    if block.get("format") != ColumnarEncoder.FORMAT:
+        raise ValueError(f"Unsupported columnar block format: {block.get('format')}")
+    events = [{} for _ in range(block["count"])]
+    for name, column in block["columns"].items():
+        values = column["values"]
+        for event, index in zip(events, column["indices"]):
+            if index >= 0:
+                event[name] = values[index]
+    return dict(block["fields"], **{EVENT_LIST: events})
+
+
+OUTPUT_FORMATS = {
+    "packed": PackedRecordSetEncoder,
+    "ndjson": NdjsonEncoder,
+    "columnar": ColumnarEncoder,
+}
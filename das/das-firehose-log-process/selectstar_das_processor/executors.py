@@ -0,0 +1,162 @@
+"""
+A minimal process pool built on multiprocessing pipes.
+
+AWS Lambda does not provide /dev/shm, which the semaphores behind
+`multiprocessing.Pool` and `multiprocessing.Queue` rely on. Pipes work without
+it, so this pool gives every worker its own duplex pipe and keeps at most one
+chunk of work in flight per worker.
+"""
+
+import multiprocessing
+import time
+from itertools import islice
+from multiprocessing.connection import wait
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _worker(conn, fn):
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        index, items = task
+        started = time.monotonic()
+        try:
+            results = [fn(*args) for args in items]
+            conn.send((index, True, results, time.monotonic() - started))
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            try:
+                conn.send((index, False, e, elapsed))
+            except Exception:
+                conn.send((index, False, WorkerError(repr(e)), elapsed))
+
+
+class PipePool:
+    """
+    A pool of forked worker processes that apply ``fn`` to argument tuples.
+    """
+
+    def __init__(self, fn, processes):
+        context = multiprocessing.get_context("fork")
+        self._workers = []
+        for _ in range(processes):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(child, fn), daemon=True)
+            process.start()
+            child.close()
+            self._workers.append((process, parent))
+        self.closed = False
+
+    @property
+    def processes(self):
+        return len(self._workers)
+
+    def starmap(self, items, chunksize=None, deadline=None):
+        """
+        Apply ``fn`` to every argument tuple in ``items`` and return the results
+        in input order. Worker exceptions are re-raised once all in-flight work
+        has been collected.
+
+        ``items`` is consumed lazily, one chunk whenever a worker is free, so
+        that producing the items overlaps with the work on earlier ones. Without
+        a ``chunksize``, items without a length are sent one at a time.
+
+        With a `scheduling.Deadline`, no more items are taken once the deadline
+        does not allow another one, and the pool is stopped if workers are still
+        busy when it passes. Items that were taken but not processed get None
+        as result; the results end with the last item taken.
+        """
+        if self.closed:
+            raise WorkerError("Pool is closed")
+        if chunksize is None:
+            try:
+                chunksize = max(1, -(-len(items) // (self.processes * 4)))
+            except TypeError:
+                chunksize = 1
+        items = iter(items)
+        sizes = []
+        results = {}
+        error = None
+        busy = {}
+        exhausted = False
+
+        def send(conn):
+            nonlocal exhausted
+            if exhausted or error is not None:
+                return False
+            if deadline is not None and not deadline.allows(
+                deadline.slowest * (chunksize - 1)
+            ):
+                exhausted = True
+                return False
+            # Time taken to produce the items counts towards their estimate.
+            started = time.monotonic()
+            chunk = list(islice(items, chunksize))
+            if not chunk:
+                exhausted = True
+                return False
+            index = len(sizes)
+            sizes.append(len(chunk))
+            conn.send((index, chunk))
+            busy[conn] = time.monotonic() - started
+            return True
+
+        for _process, conn in self._workers:
+            if not send(conn):
+                break
+
+        while busy:
+            timeout = None if deadline is None else deadline.remaining()
+            ready = wait(list(busy), timeout)
+            if not ready:
+                print(f"Stopping {len(busy)} busy workers at the deadline")
+                self.close(timeout=0)
+                break
+            for conn in ready:
+                try:
+                    index, ok, value, elapsed = conn.recv()
+                except EOFError:
+                    self.close()
+                    raise WorkerError("Worker process exited unexpectedly")
+                produced = busy.pop(conn)
+                if deadline is not None:
+                    deadline.record((produced + elapsed) / sizes[index])
+                if ok:
+                    results[index] = value
+                elif error is None:
+                    error = value
+                send(conn)
+
+        if error is not None:
+            raise error
+        return [
+            result
+            for index, size in enumerate(sizes)
+            for result in results.get(index, [None] * size)
+        ]
+
+    def close(self, timeout=1):
+        """
+        Stop all worker processes, terminating those that have not exited after
+        ``timeout`` seconds.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process, conn in self._workers:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
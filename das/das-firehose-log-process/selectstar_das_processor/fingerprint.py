@@ -0,0 +1,204 @@
+"""
+Query fingerprinting and deduplication of repeated ``commandText`` values.
+
+OLTP workloads send the same statements over and over, so most of an activity
+stream is copies of a few hundred query texts. `fingerprint` maps statements
+that only differ in their literals to the same identifier, and
+`CommandTextDeduplicator` replaces texts it has recently emitted by a short
+reference to the earlier copy.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_COMMENTS = re.compile(r"--[^\n]*+|/\*.*?\*/", re.DOTALL)
+_LITERALS = re.compile(
+    r"""
+    [nNeEbBxX]?'(?:[^'\\]|''|\\.)*+'    # quoted strings
+    | \$(?P<tag>\w*+)\$.*?\$(?P=tag)\$  # PostgreSQL dollar-quoted strings
+    | (?<![\w$.]) [-+]?
+      (?: 0x[0-9a-fA-F]++ | (?:\d++\.?\d*+|\.\d++)(?:[eE][-+]?\d++)? )
+      (?![\w.])                         # numbers, not parts of identifiers
+    | \$\d++ | (?<![\w:]) :\w++ | (?<!\w) @\w++  # bind parameters
+    | (?i: \b(?:true|false|null)\b )
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+_WHITESPACE = re.compile(r"\s++")
+_PUNCTUATION = re.compile(r"\s*+([^\w\s?]++)\s*+")
+_IN_LIST = re.compile(r"\bin\(\?(?:,\?)*+\)")
+_VALUES_LIST = re.compile(r"(\(\?(?:,\?)*+\))(?:,\1)++")
+
+
+def normalize(sql):
+    """
+    Reduce a statement to its shape: comments are removed, literals and bind
+    parameters become ``?``, IN-lists and multi-row VALUES collapse to a single
+    entry, and whitespace and letter case are normalized.
+    """
+    sql = _COMMENTS.sub(" ", sql)
+    sql = _LITERALS.sub("?", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip().lower()
+    sql = _PUNCTUATION.sub(r"\1", sql)
+    sql = _IN_LIST.sub("in(?+)", sql)
+    return _VALUES_LIST.sub(r"\1", sql)
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def fingerprint(sql):
+    """
+    Return a stable identifier for the shape of a statement, see `normalize`.
+    """
+    return _digest(normalize(sql))
+
+
+class FingerprintCache:
+    """
+    Remembers the `fingerprint` of up to ``max_size`` texts by their digest, as
+    normalizing is the expensive part. Plain dict operations need no lock.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._fingerprints = {}
+
+    def get(self, text, text_id=None):
+        """
+        Return the fingerprint of a text, given along with its `_digest` if
+        known.
+        """
+        if text_id is None:
+            text_id = _digest(text)
+        entry = self._fingerprints.get(text_id)
+        if entry is None:
+            entry = fingerprint(text)
+            if len(self._fingerprints) >= self.max_size:
+                self._fingerprints.clear()
+            self._fingerprints[text_id] = entry
+        return entry
+
+
+class CommandTextDeduplicator:
+    """
+    Tracks recently emitted ``commandText`` values in an LRU of ``max_size``
+    entries. The first occurrence of a text keeps it in full; repeats drop it
+    and only carry ``commandTextId``, which downstream resolves from the last
+    event that had the full text. Texts are emitted in full again after
+    ``refresh_count`` repeats or ``refresh_seconds``, so that every delivery
+    window of the stream contains them.
+
+    Records of a batch may be processed in any order, by threads, worker
+    processes or retries, so a repeat only drops its text if the text was
+    emitted earlier in the same record, or in an earlier batch that was
+    delivered in full. Texts count as emitted once their record is committed.
+
+    The deduplicator is safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        max_size=4096,
+        refresh_count=1000,
+        refresh_seconds=300.0,
+        min_length=32,
+        clock=time.monotonic,
+    ):
+        self.max_size = max_size
+        self.refresh_count = refresh_count
+        self.refresh_seconds = refresh_seconds
+        self.min_length = min_length
+        self._clock = clock
+        self._emitted = OrderedDict()
+        self._fingerprints = FingerprintCache(max_size)
+        self._lock = threading.Lock()
+        # Texts emitted in batches from valid_from to before batch can be
+        # dropped.
+        self.batch = 0
+        self.valid_from = 0
+        self.emitted = 0
+        self.deduplicated = 0
+        self.bytes_saved = 0
+
+    def start_batch(self):
+        self.batch += 1
+
+    def join_batch(self, batch):
+        """
+        Follow the ``(batch, valid_from)`` of the deduplicator of the parent
+        process, in a worker process.
+        """
+        self.batch, self.valid_from = batch
+
+    def invalidate(self):
+        """
+        Stop dropping the texts emitted so far, after a batch of which some
+        records may have been committed but were not delivered.
+        """
+        self.valid_from = self.batch + 1
+
+    def apply(self, event, emitted):
+        """
+        Add ``commandFingerprint`` to an event and, for texts of at least
+        ``min_length`` characters, ``commandTextId``, removing its
+        ``commandText`` if it was emitted recently. ``emitted`` collects the
+        texts emitted in full by the record, to `commit` along with it. Returns
+        True if the event was changed.
+        """
+        text = event.get("commandText")
+        if not isinstance(text, str):
+            return False
+        text_id = _digest(text)
+        event["commandFingerprint"] = self._fingerprints.get(text, text_id)
+        if len(text) < self.min_length:
+            # Not worth replacing by a reference.
+            return True
+        event["commandTextId"] = text_id
+        if text_id not in emitted:
+            now = self._clock()
+            with self._lock:
+                entry = self._emitted.get(text_id)
+                if (
+                    entry is None
+                    or not self.valid_from <= entry[2] < self.batch
+                    or entry[0] >= self.refresh_count
+                    or now - entry[1] >= self.refresh_seconds
+                ):
+                    emitted.add(text_id)
+                    return True
+                entry[0] += 1
+                self._emitted.move_to_end(text_id)
+        del event["commandText"]
+        with self._lock:
+            self.deduplicated += 1
+            self.bytes_saved += len(text)
+        return True
+
+    def commit(self, emitted):
+        """
+        Remember the texts a record emitted in full, once it is complete.
+        """
+        now = self._clock()
+        with self._lock:
+            for text_id in emitted:
+                self._emitted[text_id] = [0, now, self.batch]
+                self._emitted.move_to_end(text_id)
+            while len(self._emitted) > self.max_size:
+                self._emitted.popitem(last=False)
+            self.emitted += len(emitted)
+
+    def stats(self):
+        """
+        Return the emitted/deduplicated counters.
+        """
+        return {
+            "size": len(self._emitted),
+            "emitted": self.emitted,
+            "deduplicated": self.deduplicated,
+            "bytes_saved": self.bytes_saved,
+        }
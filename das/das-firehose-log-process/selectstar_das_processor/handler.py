@@ -10,47 +10,220 @@ from __future__ import print_function
 import os
 import json
 import base64
+import functools
+import threading
+import time
 import zlib
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import aws_encryption_sdk
 from aws_encryption_sdk import CommitmentPolicy
+from aws_encryption_sdk.exceptions import AWSEncryptionSDKClientError
 from aws_encryption_sdk.internal.crypto import WrappingKey
 from aws_encryption_sdk.key_providers.raw import RawMasterKeyProvider
 from aws_encryption_sdk.identifiers import WrappingAlgorithm, EncryptionKeyType
+from . import decryption
+from .decryption import DecryptionError
+from .encoders import OUTPUT_FORMATS
+from .fingerprint import CommandTextDeduplicator
+from .keycache import DataKeyCache
+from .metrics import BatchMetrics, RecordStats
+from .partitioning import MULTIPLE, partition_keys
+from .projection import dumps, load_projection
+from .profiling import load_profiler
+from .outcomes import (
+    DECOMPRESSION_FAILED,
+    DEADLINE_EXCEEDED,
+    DECRYPTION_FAILED,
+    DROPPED,
+    INTERNAL_ERROR,
+    KMS_ERROR,
+    KMS_THROTTLED,
+    KMS_UNAVAILABLE,
+    MALFORMED_RECORD,
+    MALFORMED_RECORD_SET,
+    OK,
+    PROCESSING_FAILED,
+    RESPONSE_TOO_LARGE,
+    RETRYABLE,
+    UNKNOWN_SOURCE,
+    WORKER_FAILED,
+    BatchSummary,
+    RecordError,
+    failed_record,
+)
+from .rules import load_event_filter
+from .sampling import load_event_sampler
+from .scheduling import Deadline, map_before
+from .sources import Source, load_source_resolver
+from .sizing import MAX_RESPONSE_BYTES, fit_response, record_size, trim_event
+from .pipeline import (
+    CHUNK_SIZE,
+    EVENT_LIST,
+    ParseError,
+    RecordSetEncoder,
+    RecordSetReader,
+    inflate,
+    peak_rss,
+    reset_peak_rss,
+)
 
 DAS_EVENT_TYPE = "DatabaseActivityMonitoringRecord"
 
-REGION_NAME = os.environ["AWS_REGION"]
-KMS_KEY_ARN = os.environ["kms_key_arn"]
-RDS_RESOURCE_ID = os.environ["rds_resource_id"]
+# Set by Lambda. Elsewhere, eg. for `replay`, KMS clients without a region of
+# their own fall back to the region configured for boto3.
+REGION_NAME = os.environ.get("AWS_REGION")
+# Optional: the database of batches whose stream cannot be resolved from
+# `das_sources` or its name, see `sources`.
+KMS_KEY_ARN = os.environ.get("kms_key_arn")
+RDS_RESOURCE_ID = os.environ.get("rds_resource_id")
 
 enc_client = aws_encryption_sdk.EncryptionSDKClient(
     commitment_policy=CommitmentPolicy.REQUIRE_ENCRYPT_ALLOW_DECRYPT
 )
-kms_region = KMS_KEY_ARN.split(":")[3]
-kms = boto3.client("kms", region_name=kms_region)
-
-disallowed_events = {
-    "oracle": {
-        "command": {},
-    },
-    "sqlserver": {"class": {"LOGIN"}},
+# Records of a batch are processed by this many threads; 1 processes them
+# sequentially.
+WORKER_THREADS = max(1, int(os.environ.get("worker_threads", "1")))
+# Decryption and filtering run in this many processes when above 1, to use
+# all vCPUs of larger Lambda memory sizes.
+WORKER_PROCESSES = max(1, int(os.environ.get("worker_processes", "1")))
+
+# Layout of the output records, see `encoders.OUTPUT_FORMATS`.
+OUTPUT_FORMAT = os.environ.get("output_format", "packed")
+if OUTPUT_FORMAT not in OUTPUT_FORMATS:
+    raise ValueError(
+        f"Unknown output_format '{OUTPUT_FORMAT}', expected one of: "
+        + ", ".join(OUTPUT_FORMATS)
+    )
+
+kms_region = KMS_KEY_ARN.split(":")[3] if KMS_KEY_ARN else REGION_NAME
+# Created on the first data key cache miss, see `get_kms`. Streams of
+# databases in other regions get a client of their own.
+kms = None
+kms_clients = {}
+_kms_lock = threading.Lock()
+
+# Byte budget of the response to Firehose. Over budget, the largest records
+# are compressed harder, then their long command texts and parameter lists are
+# trimmed to these lengths.
+MAX_RESPONSE = int(os.environ.get("max_response_bytes", MAX_RESPONSE_BYTES))
+TRIM_COMMAND_TEXT = int(os.environ.get("trim_command_text", "4096"))
+TRIM_PARAM_LIST = int(os.environ.get("trim_param_list", "64"))
+
+# Records failing for a transient reason, such as KMS throttling, are processed
+# again this many times, waiting record_retry_delay seconds, doubled on every
+# attempt, in between.
+RECORD_RETRIES = int(os.environ.get("record_retries", "2"))
+RECORD_RETRY_DELAY = float(os.environ.get("record_retry_delay", "0.2"))
+
+KMS_THROTTLING_CODES = {
+    "ThrottlingException",
+    "LimitExceededException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+}
+KMS_UNAVAILABLE_CODES = {
+    "KMSInternalException",
+    "DependencyTimeoutException",
+    "ServiceUnavailableException",
+    "InternalFailure",
 }
 
+# Records are only started while they are expected to finish this many seconds
+# before the function times out. The rest is returned as ProcessingFailed.
+DEADLINE_MARGIN = float(os.environ.get("deadline_margin", "5"))
+
+# Batch metrics are written to stdout in CloudWatch Embedded Metric Format
+# unless metrics is set to "off".
+METRICS = os.environ.get("metrics", "emf").lower() != "off"
+METRICS_NAMESPACE = os.environ.get("metrics_namespace", "SelectStar/DAS")
+METRICS_DIMENSIONS = {
+    "FunctionName": os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+}
+
+DATA_KEY_CACHE_SIZE = int(os.environ.get("data_key_cache_size", "1024"))
+DATA_KEY_CACHE_TTL = float(os.environ.get("data_key_cache_ttl", "300"))
+
+# Payloads are decrypted by the Encryption SDK ("sdk"), or by parsing the
+# message format and calling AES-GCM directly ("direct"), see `decryption`.
+DECRYPT_ENGINE = os.environ.get("decrypt_engine", "sdk").lower()
+if DECRYPT_ENGINE not in ("sdk", "direct"):
+    raise ValueError(
+        f"Unknown decrypt_engine '{DECRYPT_ENGINE}', expected one of: sdk, direct"
+    )
+
+# Plaintext data keys are reused across records and warm invocations.
+data_key_cache = DataKeyCache(max_size=DATA_KEY_CACHE_SIZE, ttl=DATA_KEY_CACHE_TTL)
+
+# Repeated command texts are replaced by a reference to their first copy, see
+# `fingerprint.CommandTextDeduplicator`.
+COMMAND_DEDUP = os.environ.get("command_dedup", "false").lower() == "true"
+command_texts = (
+    CommandTextDeduplicator(
+        max_size=int(os.environ.get("command_text_cache_size", "4096")),
+        refresh_count=int(os.environ.get("command_text_refresh_count", "1000")),
+        refresh_seconds=float(os.environ.get("command_text_refresh_seconds", "300")),
+    )
+    if COMMAND_DEDUP
+    else None
+)
+
+# The database each stream belongs to, see `sources`. Streams can be mapped to
+# their database as JSON in das_sources or as a file in das_sources_path.
+source_resolver = load_source_resolver(
+    os.environ.get("das_sources"),
+    os.environ.get("das_sources_path"),
+    Source(RDS_RESOURCE_ID, kms_region) if RDS_RESOURCE_ID else None,
+)
+
+# Rules dropping events of no interest, see `rules`. Given as JSON in
+# event_filter_rules or as a file in event_filter_rules_path.
+event_filter = load_event_filter(
+    os.environ.get("event_filter_rules"), os.environ.get("event_filter_rules_path")
+)
 
-def is_allowed_event(event):
+
+# Ok records carry metadata.partitionKeys for Firehose dynamic partitioning,
+# see `partitioning`.
+PARTITION_KEYS = os.environ.get("partition_keys", "false").lower() == "true"
+
+# Fields removed from or shortened in kept events, see `projection`. Given as
+# JSON in event_projection or as a file in event_projection_path.
+projection = load_projection(
+    os.environ.get("event_projection"), os.environ.get("event_projection_path")
+)
+
+# Samplers limiting the kept events per statement, see `sampling`. Given as
+# JSON in event_sampling or as a file in event_sampling_path.
+event_sampler = load_event_sampler(
+    os.environ.get("event_sampling"), os.environ.get("event_sampling_path")
+)
+
+# On-demand profiling of invocations, see `profiling`. profile lists the modes,
+# cprofile and tracemalloc running on 1 in profile_every invocations.
+profiler = load_profiler(
+    "das-processor",
+    os.environ.get("profile"),
+    every=int(os.environ.get("profile_every", "1")),
+    top=int(os.environ.get("profile_top", "25")),
+    path=os.environ.get("profile_path", "/tmp/profiles"),
+    s3_uri=os.environ.get("profile_s3_uri"),
+)
+
+
+def is_allowed_event(event, count=True):
     if "type" not in event or event["type"] != "record":
         return False
 
     if "command" not in event or "serverType" not in event:
         return False
 
-    disallowed = disallowed_events[event["serverType"].lower()]
-    for field, excluded in disallowed.items():
-        if field in event and event[field] in excluded:
-            return False
-
-    return True
+    return event_filter.allows(event, count)
 
 
 class MyRawMasterKeyProvider(RawMasterKeyProvider):
@@ -76,123 +249,672 @@ class MyRawMasterKeyProvider(RawMasterKeyProvider):
         return self.wrapping_key
 
 
-def decrypt_payload(payload, data_key):
+def decrypt_data_key(data_key, encryption_context, region=None):
     """
-    Decrypt the data portion of a DAS record set.
+    Unwrap the encrypted data key of a DAS record with KMS, reusing keys that
+    were already decrypted by this container.
     """
-    my_key_provider = MyRawMasterKeyProvider(data_key)
-    my_key_provider.add_master_key("DataKey")
-    materials_manager = (
-        aws_encryption_sdk.materials_managers.default.DefaultCryptoMaterialsManager(
-            master_key_provider=my_key_provider
-        )
+    return data_key_cache.get_or_decrypt(
+        data_key,
+        encryption_context,
+        lambda: kms_decrypt(data_key, encryption_context, region),
     )
-    # Decrypt the records using the master key.
-    decrypted_plaintext, _header = enc_client.decrypt(
-        source=payload, materials_manager=materials_manager
+
+
+def get_kms(region=None):
+    """
+    Return the KMS client of a region, by default that of kms_key_arn, creating
+    it on first use. Creating a client loads the KMS service model, which takes
+    over 100 ms, so it is kept out of the import of this module.
+    """
+    global kms
+    if region is not None and region != kms_region:
+        if region not in kms_clients:
+            with _kms_lock:
+                if region not in kms_clients:
+                    kms_clients[region] = create_kms(region)
+        return kms_clients[region]
+    if kms is None:
+        # boto3 sessions are not thread safe to create clients from.
+        with _kms_lock:
+            if kms is None:
+                kms = create_kms(kms_region)
+    return kms
+
+
+def create_kms(region):
+    return boto3.client(
+        "kms",
+        region_name=region,
+        config=Config(max_pool_connections=max(10, WORKER_THREADS)),
     )
-    return decrypted_plaintext
 
 
-def decrypt_decompress(payload, key):
+@profiler.timed
+def kms_decrypt(data_key, encryption_context, region=None):
     """
-    Decrypt and decompress a DAS record set.
+    Unwrap an encrypted data key with KMS, raising a `RecordError` whose reason
+    tells transient failures from permanent ones.
     """
-    decrypted = decrypt_payload(payload, key)
     try:
-        return zlib.decompress(decrypted, zlib.MAX_WBITS + 16)
-    except Exception as e:
-        print("An exception occurred:", e)
+        return get_kms(region).decrypt(
+            CiphertextBlob=data_key, EncryptionContext=encryption_context
+        )["Plaintext"]
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code", "")
+        if code in KMS_THROTTLING_CODES:
+            reason = KMS_THROTTLED
+        elif code in KMS_UNAVAILABLE_CODES:
+            reason = KMS_UNAVAILABLE
+        else:
+            reason = KMS_ERROR
+        raise RecordError(reason, str(e)) from e
+    except BotoCoreError as e:
+        raise RecordError(KMS_UNAVAILABLE, str(e)) from e
+
+
+def build_materials_manager(data_key):
+    """
+    Build a crypto materials manager for the plaintext data key of a record.
+    """
+    my_key_provider = MyRawMasterKeyProvider(data_key)
+    my_key_provider.add_master_key("DataKey")
+    return aws_encryption_sdk.materials_managers.default.DefaultCryptoMaterialsManager(
+        master_key_provider=my_key_provider
+    )
+
+
+def get_materials_manager(data_key):
+    """
+    Return the crypto materials manager of a plaintext data key. Managers are
+    kept in the entry of their key in `data_key_cache`, so records that share a
+    data key only pay for the payload decryption itself, and a manager expires
+    along with its key.
+    """
+    return data_key_cache.derive(data_key, "materials_manager", build_materials_manager)
+
+
+def get_wrapping_cipher(data_key):
+    """
+    Return the cipher of a plaintext data key for `decryption`, kept like the
+    materials managers of `get_materials_manager`.
+    """
+    return data_key_cache.derive(data_key, "wrapping_cipher", AESGCM)
+
+
+def decrypt_stream(payload, data_key):
+    """
+    Decrypt the data portion of a DAS record set, yielding the plaintext in
+    chunks as the encrypted frames are read.
+    """
+    if DECRYPT_ENGINE == "direct":
+        yield from decryption.decrypt_stream(
+            payload, data_key, CHUNK_SIZE, get_wrapping_cipher(data_key)
+        )
+        return
+    decryptor = enc_client.stream(
+        mode="d", source=payload, materials_manager=get_materials_manager(data_key)
+    )
+    yield from iter(lambda: decryptor.read(CHUNK_SIZE), b"")
+    # Not closed on errors, where closing only logs a second error about the
+    # unread footer.
+    decryptor.close()
 
 
-def filter_database_activity_events(das_event):
+def filter_record_set(
+    chunks, encoder=None, trim=None, stats=None, keys=None, suppressed=None
+):
     """
-    Filter out non-conforming DAS records, and remove heartbeat events from
-    valid DAS records to reduce output stream size.
+    Filter a decrypted and inflated DAS record set given as JSON byte chunks,
+    dropping non-conforming record sets and heartbeat events, and return
+    the filtered record set along with the event counts, or None if the record
+    set should be dropped. The record set is written with ``encoder``, which
+    defaults to gzip-compressed JSON. With ``trim`` given as a pair of maximum
+    lengths, long command texts and parameter lists are shortened.
+
+    With a `RecordStats`, the time spent filtering and encoding is added to it
+    along with the kept events by ``serverType`` and ``command``. The time spent
+    reading ``chunks`` is left to the caller, the rest counts as parsing. A dict
+    given as ``keys`` is filled with the partition keys of the record set.
+    Events suppressed by `event_sampler` are replaced by summary events at the
+    end of the event list, and their indices stored in the `RecordStats`.
+    Given those indices of an earlier pass as ``suppressed``, the record set is
+    filtered again alike, without counting drops or sampling events again.
     """
-    if "type" not in das_event:
+    reader = RecordSetReader(chunks)
+    if encoder is None:
+        encoder = RecordSetEncoder()
+    clock = time.perf_counter
+    started = clock()
+    filter_seconds = 0.0
+    encode_seconds = 0.0
+    fields = {}
+    received = 0
+    filtered = 0
+    # Command texts emitted in full by this record.
+    emitted = set()
+    first = None
+    database = None
+    sample = event_sampler.record(suppressed) if event_sampler is not None else None
+    count = suppressed is None
+    for key, value, raw_value in reader:
+        if key != EVENT_LIST:
+            fields[key] = value
+            encoder.field(key, raw_value)
+            continue
+        if received == 0 and fields.get("type", DAS_EVENT_TYPE) != DAS_EVENT_TYPE:
+            break
+        received += 1
+        filter_started = clock()
+        if is_allowed_event(value, count):
+            if stats is not None:
+                stats.events[value["serverType"], value["command"]] += 1
+            if keys is not None:
+                if first is None:
+                    first = value
+                    database = value.get("databaseName")
+                elif database != value.get("databaseName"):
+                    database = MULTIPLE
+            if sample is not None and not sample.keep(value):
+                filter_seconds += clock() - filter_started
+                continue
+            filtered += 1
+            changed = False
+            if projection is not None:
+                saved = projection.apply(value)
+                if saved is not None:
+                    changed = True
+                    if stats is not None:
+                        stats.bytes_projected += saved
+            if command_texts is not None and command_texts.apply(value, emitted):
+                changed = True
+            if trim is not None and trim_event(value, *trim):
+                changed = True
+            if changed:
+                raw_value = dumps(value)
+            encode_started = clock()
+            encoder.event(raw_value, value)
+            encode_seconds += clock() - encode_started
+            filter_seconds += encode_started - filter_started
+        else:
+            filter_seconds += clock() - filter_started
+
+    summaries = sample.summaries() if sample is not None else ()
+    if stats is not None:
+        stats.events_received += received
+        stats.events_kept += filtered
+        stats.events_sampled += sum(s["suppressedCount"] for s in summaries)
+        stats.suppressed = tuple(sample.suppressed) if sample is not None else ()
+        stats.seconds["filter"] += filter_seconds
+        stats.seconds["encode"] += encode_seconds
+        stats.seconds["parse"] += clock() - started - filter_seconds - encode_seconds
+
+    if "type" not in fields:
         print(
             "Unexpected record format in database activity stream."
             "Dropping record. Fields:",
-            das_event.keys(),
+            fields.keys(),
         )
         return None
 
-    if das_event["type"] != DAS_EVENT_TYPE:
-        print("Unexpected record type in database activity stream:", das_event["type"])
+    if fields["type"] != DAS_EVENT_TYPE:
+        print("Unexpected record type in database activity stream:", fields["type"])
         return None
 
-    if "databaseActivityEventList" not in das_event:
-        print(
-            "Dropping record set with non-matching structure. Fields:", das_event.keys()
-        )
+    if not reader.has_event_list:
+        print("Dropping record set with non-matching structure. Fields:", fields.keys())
         return None
-    received = len(das_event["databaseActivityEventList"])
-    das_event["databaseActivityEventList"] = [
-        e for e in das_event["databaseActivityEventList"] if is_allowed_event(e)
-    ]
-    filtered = len(das_event["databaseActivityEventList"])
 
-    if len(das_event["databaseActivityEventList"]) < 1:
+    if filtered < 1 and not summaries:
         print("Dropping record set with no valid events (eg. only hearthbeat).")
         return None
 
-    return das_event, received, filtered
+    finish_started = clock()
+    for summary in summaries:
+        encoder.event(dumps(summary), summary)
+    output_data = encoder.finish()
+    if stats is not None:
+        stats.seconds["encode"] += clock() - finish_started
+    if emitted:
+        command_texts.commit(emitted)
+    if keys is not None:
+        keys.update(partition_keys(fields, first, database, RDS_RESOURCE_ID))
+    return output_data, received, filtered
 
 
-def lambda_handler(event, _context):
+def unwrap_record(record, source=None):
     """
-    Process a batch of DAS events.
+    Decode a Firehose record and unwrap its data key with KMS, in the region of
+    the database ``source`` the record came from. Returns the record ID, the
+    encrypted payload and the plaintext data key.
     """
-    output = []
-    print(f"Received {len(event['records'])} records.")
-    for record in event["records"]:
+    try:
         data = base64.b64decode(record["data"])
         record_data = json.loads(data)
 
         # Decode and decrypt the payload
         payload_decoded = base64.b64decode(record_data["databaseActivityEvents"])
         data_key_decoded = base64.b64decode(record_data["key"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise RecordError(MALFORMED_RECORD, repr(e)) from e
+    del data, record_data
+
+    if source is None:
+        raise RecordError(UNKNOWN_SOURCE, "no rds_resource_id or DAS source")
+    data_key_plaintext = decrypt_data_key(
+        data_key_decoded, source.encryption_context, source.region
+    )
+    return record["recordId"], payload_decoded, data_key_plaintext
 
-        if "db" in RDS_RESOURCE_ID:
-            encryption_context = {"aws:rds:db-id": RDS_RESOURCE_ID}
-        else:
-            encryption_context = {"aws:rds:dbc-id": RDS_RESOURCE_ID}
 
-        data_key_decrypt_result = kms.decrypt(
-            CiphertextBlob=data_key_decoded, EncryptionContext=encryption_context
+def make_encoder(level=None):
+    """
+    Return an encoder for the configured output format, compressing at
+    ``level`` if the format compresses its output.
+    """
+    encoder_class = OUTPUT_FORMATS[OUTPUT_FORMAT]
+    if level is not None and issubclass(encoder_class, RecordSetEncoder):
+        return encoder_class(level)
+    return encoder_class()
+
+
+def transform_record(
+    record_id, payload, data_key, level=None, trim=None, stats=None, suppressed=None
+):
+    """
+    Decrypt, filter and re-encode the payload of a record with its plaintext
+    data key. Returns the output record, or raises a `RecordError`. Needs no
+    KMS access, so it can run in worker processes. Stage timings and counts are
+    added to ``stats`` if given. ``suppressed`` repeats an earlier pass, see
+    `filter_record_set`.
+    """
+    if stats is None:
+        stats = RecordStats()
+    stats.bytes_in += len(payload)
+    # Decrypt, inflate and filter the record set in a single pass.
+    try:
+        decrypted = stats.timed(decrypt_stream(payload, data_key), "decrypt")
+        inflated = stats.timed(inflate(decrypted), "inflate")
+        keys = {} if PARTITION_KEYS else None
+        pruned_event = filter_record_set(
+            inflated, make_encoder(level), trim, stats, keys, suppressed
         )
+        # Inflating includes the decryption it waited for, parsing the
+        # inflating.
+        stats.seconds["parse"] -= stats.seconds["inflate"]
+        stats.seconds["inflate"] -= stats.seconds["decrypt"]
+    except (AWSEncryptionSDKClientError, InvalidTag, DecryptionError) as e:
+        raise RecordError(DECRYPTION_FAILED, repr(e)) from e
+    except zlib.error as e:
+        raise RecordError(DECOMPRESSION_FAILED, str(e)) from e
+    except ParseError as e:
+        raise RecordError(MALFORMED_RECORD_SET, str(e)) from e
+
+    if pruned_event is None:
+        return {"recordId": record_id, "result": DROPPED}
+
+    output_data, received, filtered = pruned_event
+    stats.bytes_out += len(output_data)
+    print(f"Received {received} events, filtered to {filtered} events.")
+    output_record = {
+        "recordId": record_id,
+        "result": OK,
+        "data": base64.b64encode(output_data).decode("utf-8"),
+    }
+    if keys is not None:
+        output_record["metadata"] = {"partitionKeys": keys}
+    return output_record
+
+
+def process_record(
+    record, source=None, level=None, trim=None, stats=None, suppressed=None
+):
+    """
+    Decrypt, filter and re-encode a single Firehose record of ``source``.
+    Returns the output record, or raises a `RecordError`.
+    """
+    started = time.perf_counter()
+    unwrapped = unwrap_record(record, source)
+    if stats is not None:
+        stats.seconds["unwrap"] += time.perf_counter() - started
+    return transform_record(*unwrapped, level, trim, stats, suppressed)
 
-        if (
-            decrypt_decompress(payload_decoded, data_key_decrypt_result["Plaintext"])
-            is None
-        ):
-            continue
 
-        plaintext = decrypt_decompress(
-            payload_decoded, data_key_decrypt_result["Plaintext"]
-        ).decode("utf8")
+def run_isolated(record_id, fn, *args, **kwargs):
+    """
+    Call ``fn`` for a single record and return its result along with None, or
+    the ``ProcessingFailed`` output record of the record along with the reason
+    code if it raised.
+    """
+    try:
+        return fn(*args, **kwargs), None
+    except RecordError as e:
+        print(f"Record {record_id} failed: {e}")
+        return failed_record(record_id), e.reason
+    except Exception as e:
+        print(f"Record {record_id} failed with an unexpected error: {e!r}")
+        return failed_record(record_id), INTERNAL_ERROR
+
 
-        event = json.loads(plaintext)
-        pruned_event = filter_database_activity_events(event)
+# The *_isolated functions return ``(result, reason, stats)`` with the
+# `RecordStats` of the record.
 
-        if pruned_event is None:
-            output_record = {"recordId": record["recordId"], "result": "Dropped"}
-        else:
-            das_event, received, filtered = pruned_event
-            print(f"Received {received} events, filtered to {filtered} events.")
-            plain_event = zlib.compress(
-                json.dumps(das_event).encode("utf-8"), wbits=zlib.MAX_WBITS + 16
+
+def unwrap_isolated(record, source=None):
+    stats = RecordStats()
+    started = time.perf_counter()
+    result = run_isolated(record["recordId"], unwrap_record, record, source)
+    stats.seconds["unwrap"] += time.perf_counter() - started
+    return (*result, stats)
+
+
+def transform_isolated(record_id, payload, data_key, batch=None):
+    # Worker processes do not share the key cache of the parent, so they enter
+    # the plaintext keys they are sent into their own, by the plaintext, for
+    # the objects derived from the keys to be reused and to expire.
+    data_key_cache.get_or_decrypt(data_key, {}, lambda: data_key)
+    if batch is not None:
+        # The batch of command text deduplication in the parent process.
+        command_texts.join_batch(batch)
+    stats = RecordStats()
+    result = run_isolated(
+        record_id, transform_record, record_id, payload, data_key, stats=stats
+    )
+    return (*result, stats)
+
+
+def process_isolated(record, source=None):
+    stats = RecordStats()
+    return (
+        *run_isolated(record["recordId"], process_record, record, source, stats=stats),
+        stats,
+    )
+
+
+@profiler.timed
+def fit_output(records, output, deadline, source=None, suppressed=None):
+    """
+    Shrink the output records, given along with their input records, until the
+    response fits into the byte budget. Returns the number of records that were
+    compressed harder, trimmed and failed. Records are processed again with the
+    events their first pass suppressed, listed in ``suppressed`` by record, for
+    their output to keep the same events.
+    """
+
+    def reprocess(index, **options):
+        if not deadline.allows():
+            return None
+        record = records[index]
+        output_record, reason = run_isolated(
+            record["recordId"],
+            process_record,
+            record,
+            source,
+            suppressed=suppressed[index] if suppressed is not None else (),
+            **options,
+        )
+        return output_record if reason is None else None
+
+    steps = []
+    if issubclass(OUTPUT_FORMATS[OUTPUT_FORMAT], RecordSetEncoder):
+        steps.append(lambda index: reprocess(index, level=9))
+    trim = (TRIM_COMMAND_TEXT, TRIM_PARAM_LIST)
+    steps.append(lambda index: reprocess(index, level=9, trim=trim))
+    changed = fit_response(output, steps, MAX_RESPONSE)
+    if len(changed) == 2:
+        changed.insert(0, 0)
+    return changed
+
+
+_executor = None
+_process_pool = None
+
+
+def get_executor():
+    """
+    Return the thread pool shared by invocations of this container.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=WORKER_THREADS, thread_name_prefix="das-record"
+        )
+    return _executor
+
+
+def get_process_pool():
+    """
+    Return the worker process pool shared by invocations of this container,
+    replacing it if a worker died in a previous invocation. Workers are forked
+    while the thread pool is down: a fork only copies the calling thread, and
+    locks held by other threads, eg. of the KMS client, would stay held in the
+    workers.
+    """
+    from .executors import PipePool
+
+    global _executor, _process_pool
+    if _process_pool is None or _process_pool.closed:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+        _process_pool = PipePool(transform_isolated, WORKER_PROCESSES)
+    return _process_pool
+
+
+def expired_record(record):
+    return failed_record(record["recordId"]), DEADLINE_EXCEEDED, None
+
+
+@profiler.timed
+def process_batch(records, deadline, source=None):
+    """
+    Process Firehose records of ``source``, returning ``(output_record, reason, stats)`` per
+    record in input order, where ``reason`` is None unless the record failed.
+    Records that cannot be finished before the deadline fail with
+    ``DeadlineExceeded``.
+    """
+    pool = None
+    if WORKER_PROCESSES > 1 and len(records) > 1:
+        # Forked before any thread of the executor starts.
+        pool = get_process_pool()
+    executor = get_executor() if WORKER_THREADS > 1 and len(records) > 1 else None
+    if pool is not None:
+        from .executors import WorkerError
+
+        # Unwrap data keys here, where the KMS client and key cache live, and
+        # spread the CPU-bound work over one process per vCPU.
+        results = [expired_record(record) for record in records]
+        unwrapped = []
+        batch = None
+        if command_texts is not None:
+            batch = command_texts.batch, command_texts.valid_from
+        if executor is not None:
+            futures = [
+                executor.submit(unwrap_isolated, record, source) for record in records
+            ]
+
+        def unwrap_all():
+            # Consumed by the pool as workers become free.
+            for index, record in enumerate(records):
+                if executor is None:
+                    result = unwrap_isolated(record, source)
+                else:
+                    try:
+                        result = futures[index].result(timeout=deadline.remaining())
+                    except FutureTimeoutError:
+                        return
+                if result[1] is not None:
+                    results[index] = result
+                    continue
+                results[index] = (None, DEADLINE_EXCEEDED, result[2])
+                unwrapped.append(index)
+                yield (*result[0], batch)
+
+        try:
+            transformed = pool.starmap(unwrap_all(), deadline=deadline)
+        except WorkerError as e:
+            # Records not handed to the pool yet fail with it, to be retried.
+            dispatched = set(unwrapped)
+            pending = [
+                index
+                for index, (_, reason, _stats) in enumerate(results)
+                if reason == DEADLINE_EXCEEDED and index not in dispatched
+            ]
+            for index in pending:
+                output_record, _, stats = results[index]
+                results[index] = (output_record, WORKER_FAILED, stats)
+            print(
+                f"Worker pool failed for {len(unwrapped) + len(pending)} records: {e}"
             )
-            packed_event = {
-                "databaseActivityEvents": base64.b64encode(plain_event).decode("utf-8")
-            }
-            output_record = {
-                "recordId": record["recordId"],
-                "result": "Ok",
-                "data": base64.b64encode(
-                    json.dumps(packed_event).encode("utf-8")
-                ).decode("utf-8"),
-            }
-        output.append(output_record)
+            transformed = [(None, WORKER_FAILED, None)] * len(unwrapped)
+        if executor is not None:
+            for future in futures:
+                future.cancel()
+        transformed += [None] * (len(unwrapped) - len(transformed))
+        for index, result in zip(unwrapped, transformed):
+            _, reason, stats = results[index]
+            if result is not None:
+                _, reason, transform_stats = result
+                if transform_stats is not None:
+                    stats.merge(transform_stats)
+                    stats.suppressed = transform_stats.suppressed
+            output_record = result[0] if result is not None else None
+            if output_record is None:
+                output_record = failed_record(records[index]["recordId"])
+            results[index] = (output_record, reason, stats)
+        return results
+    # With threads, KMS calls overlap with decryption and compression of other
+    # records.
+    return map_before(
+        deadline,
+        functools.partial(process_isolated, source=source),
+        records,
+        expired_record,
+        executor,
+        WORKER_THREADS,
+    )
+
+
+@profiler.timed
+def process_with_retries(records, deadline, summary, source=None):
+    """
+    Process Firehose records like `process_batch`, processing the records that
+    failed for a transient reason again while the deadline allows.
+    """
+    results = process_batch(records, deadline, source)
+    for attempt in range(RECORD_RETRIES):
+        # Only the records that failed for a transient reason are retried, not
+        # the whole batch as Firehose would.
+        retry = [
+            index
+            for index, (_, reason, _stats) in enumerate(results)
+            if reason in RETRYABLE
+        ]
+        delay = RECORD_RETRY_DELAY * 2**attempt
+        if not retry or not deadline.allows(delay):
+            break
+        time.sleep(delay)
+        print(f"Retrying {len(retry)} records.")
+        summary.retried += len(retry)
+        retried = process_batch([records[i] for i in retry], deadline, source)
+        for index, result in zip(retry, retried):
+            results[index] = result
+    return results
+
+
+def counters():
+    """
+    Return the cache counters of this container, to report the difference
+    made by a batch with `report_batch`.
+    """
+    return {
+        "DataKeyCacheHits": data_key_cache.hits,
+        "DataKeyCacheMisses": data_key_cache.misses,
+        "MaterialsManagerHits": data_key_cache.derived_hits,
+        "MaterialsManagerMisses": data_key_cache.derived_misses,
+        "CommandTextsDeduplicated": (
+            command_texts.deduplicated if command_texts is not None else 0
+        ),
+    }
+
+
+@profiler.timed
+def report_batch(count, summary, metrics, deadline, before):
+    """
+    Log the summary of a batch of ``count`` records and emit its metrics, with
+    the cache counters taken by `counters` before the batch.
+    """
+    after = counters()
+    print(
+        f"Processed {count} records: {summary}, "
+        f"peak memory {peak_rss() / 2**20:.1f} MiB, "
+        f"data key cache {after['DataKeyCacheHits'] - before['DataKeyCacheHits']} "
+        f"hits / {after['DataKeyCacheMisses'] - before['DataKeyCacheMisses']} "
+        f"misses, slowest record {deadline.slowest * 1000:.0f} ms."
+    )
+    if projection is not None:
+        print(f"Event projection saved {metrics.stats.bytes_projected} bytes.")
+    if WORKER_PROCESSES == 1:
+        # Worker processes keep their own counters.
+        print("Events dropped by rule:", event_filter.stats())
+        if event_sampler is not None:
+            print("Events suppressed by sampler:", event_sampler.stats())
+        if command_texts is not None:
+            print("Command text deduplication:", command_texts.stats())
+    if METRICS:
+        for result in (OK, DROPPED, PROCESSING_FAILED):
+            metrics.put(f"Records{result}", summary.results[result])
+        metrics.put("RecordsRetried", summary.retried)
+        metrics.put("PeakMemory", peak_rss(), "Bytes")
+        names = ["DataKeyCacheHits", "DataKeyCacheMisses"]
+        if WORKER_PROCESSES == 1:
+            names += ["MaterialsManagerHits", "MaterialsManagerMisses"]
+            if command_texts is not None:
+                names.append("CommandTextsDeduplicated")
+        for name in names:
+            metrics.put(name, after[name] - before[name])
+        metrics.emit()
+
+
+@profiler.profiled
+def lambda_handler(event, context):
+    """
+    Process a batch of DAS events.
+    """
+    deadline = Deadline(context, DEADLINE_MARGIN)
+    records = event["records"]
+    print(f"Received {len(records)} records.")
+    # A delivery stream reads a single Kinesis stream, so of one database.
+    source = source_resolver.resolve(event.get("sourceKinesisStreamArn"))
+    before = counters()
+    reset_peak_rss()
+    summary = BatchSummary()
+    metrics = BatchMetrics(METRICS_NAMESPACE, METRICS_DIMENSIONS)
+    if command_texts is not None:
+        command_texts.start_batch()
+    results = process_with_retries(records, deadline, summary, source)
+    for output_record, reason, stats in results:
+        summary.add(output_record, reason)
+        metrics.add(stats)
+    output = [output_record for output_record, _reason, _stats in results]
+    trimmed = 0
+    if sum(map(record_size, output)) > MAX_RESPONSE:
+        suppressed = [
+            stats.suppressed if stats is not None else ()
+            for _output_record, _reason, stats in results
+        ]
+        recompressed, trimmed, failed = fit_output(
+            records, output, deadline, source, suppressed
+        )
+        summary.fail(RESPONSE_TOO_LARGE, failed)
+        print(
+            f"Response over {MAX_RESPONSE} bytes: recompressed {recompressed}, "
+            f"trimmed {trimmed} and failed {failed} records."
+        )
+    if command_texts is not None and (summary.results[PROCESSING_FAILED] or trimmed):
+        # Failed and trimmed records may have emitted texts that are not
+        # delivered in full.
+        command_texts.invalidate()
+    metrics.put("ResponseBytes", sum(map(record_size, output)), "Bytes")
+    report_batch(len(output), summary, metrics, deadline, before)
     return {"records": output}
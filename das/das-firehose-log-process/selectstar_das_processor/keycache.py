@@ -0,0 +1,168 @@
+"""
+An in-process cache for KMS-decrypted DAS data keys.
+
+Database Activity Streams reuse the same encrypted data key across many
+consecutive records, so a warm Lambda container can skip most KMS round-trips
+by remembering the plaintext keys it has already unwrapped. Objects built from
+a plaintext key, such as the ciphers and materials managers that decrypt with
+it, are kept in its entry so that they are dropped along with the key.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    __slots__ = ("plaintext", "expires", "derived")
+
+    def __init__(self, plaintext, expires):
+        self.plaintext = plaintext
+        self.expires = expires
+        self.derived = {}
+
+
+class DataKeyCache:
+    """
+    A bounded cache of plaintext data keys keyed by the encrypted data key and
+    its encryption context. Entries expire after ``ttl`` seconds and the least
+    recently used entry is evicted once ``max_size`` entries are held.
+
+    The cache is safe to share between threads. Concurrent misses for the same
+    key wait for a single ``decrypt()`` call instead of each calling KMS.
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        # The entries by plaintext key, for `derive`.
+        self._plaintexts = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.derived_hits = 0
+        self.derived_misses = 0
+
+    @staticmethod
+    def _key(ciphertext, encryption_context):
+        return ciphertext, tuple(sorted(encryption_context.items()))
+
+    def _evict(self, entry):
+        if self._plaintexts.get(entry.plaintext) is entry:
+            del self._plaintexts[entry.plaintext]
+        self.evictions += 1
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= self._clock():
+            del self._entries[key]
+            self._evict(entry)
+            return None
+        self._entries.move_to_end(key)
+        return entry.plaintext
+
+    def _store(self, key, plaintext):
+        if self.max_size <= 0:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None and self._plaintexts.get(plaintext) is previous:
+            del self._plaintexts[plaintext]
+        entry = self._entries[key] = _Entry(plaintext, self._clock() + self.ttl)
+        self._plaintexts[plaintext] = entry
+        while len(self._entries) > self.max_size:
+            self._evict(self._entries.popitem(last=False)[1])
+
+    def get(self, ciphertext, encryption_context):
+        """
+        Return the cached plaintext key, or None if it is missing or expired.
+        """
+        with self._lock:
+            plaintext = self._lookup(self._key(ciphertext, encryption_context))
+            if plaintext is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return plaintext
+
+    def put(self, ciphertext, encryption_context, plaintext):
+        """
+        Store a plaintext key, evicting the least recently used entries if the
+        cache is full.
+        """
+        with self._lock:
+            self._store(self._key(ciphertext, encryption_context), plaintext)
+
+    def get_or_decrypt(self, ciphertext, encryption_context, decrypt):
+        """
+        Return the plaintext key from the cache, calling ``decrypt()`` to
+        unwrap it on a miss.
+        """
+        key = self._key(ciphertext, encryption_context)
+        while True:
+            with self._lock:
+                plaintext = self._lookup(key)
+                if plaintext is not None:
+                    self.hits += 1
+                    return plaintext
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+        try:
+            plaintext = decrypt()
+            with self._lock:
+                self._store(key, plaintext)
+            return plaintext
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def derive(self, plaintext, kind, build):
+        """
+        Return the object ``build(plaintext)`` of a ``kind``, built once per
+        cached plaintext key and evicted along with it. Keys that are not
+        cached, or have expired, get a new object on every call.
+        """
+        with self._lock:
+            entry = self._plaintexts.get(plaintext)
+            if entry is not None and entry.expires <= self._clock():
+                entry = None
+            if entry is not None and kind in entry.derived:
+                self.derived_hits += 1
+                return entry.derived[kind]
+            self.derived_misses += 1
+        value = build(plaintext)
+        if entry is not None:
+            with self._lock:
+                value = entry.derived.setdefault(kind, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._plaintexts.clear()
+
+    def stats(self):
+        """
+        Return the hit/miss counters and the current hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,181 @@
+"""
+A lambda function handler that consumes a DAS Kinesis stream directly, through
+an event source mapping, and writes the kept events to S3 without Firehose.
+
+Records go through the same decryption and filtering as in `handler`. The
+output records of a batch are written as one S3 object, with one line per
+record, so the batch size and batching window of the event source mapping set
+the size of the objects.
+
+Failures are reported as ``batchItemFailures``. Lambda then processes the
+batch again from the lowest reported sequence number, so only the records
+before the first transient failure are written, and that record and all later
+ones are reported. Records that failed for a permanent reason would fail again
+and block the shard, so they are written to an error object instead, like
+Firehose does with ``ProcessingFailed`` records.
+"""
+
+from __future__ import print_function
+import base64
+import json
+import os
+import time
+import zlib
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+from . import handler
+from .encoders import OUTPUT_FORMATS
+from .metrics import BatchMetrics
+from .outcomes import DEADLINE_EXCEEDED, OK, RETRYABLE, BatchSummary
+from .pipeline import RecordSetEncoder, reset_peak_rss
+from .scheduling import Deadline
+
+OUTPUT_BUCKET = os.environ.get("output_bucket")
+OUTPUT_PREFIX = os.environ.get("output_prefix", "processed/")
+ERROR_OUTPUT_PREFIX = os.environ.get("error_output_prefix", "processing-failed/")
+
+# The packed format compresses every record set already.
+COMPRESS_OBJECTS = not issubclass(
+    OUTPUT_FORMATS[handler.OUTPUT_FORMAT], RecordSetEncoder
+)
+
+# Records failing for these reasons are handed back to Lambda to be processed
+# again, the others are written to the error output.
+REPORTED = RETRYABLE | {DEADLINE_EXCEEDED}
+
+# Created on first use, see `get_s3`.
+s3 = None
+
+
+def get_s3():
+    global s3
+    if s3 is None:
+        s3 = boto3.client("s3")
+    return s3
+
+
+def firehose_record(record):
+    """
+    Return a Kinesis event source record in the form of a Firehose transform
+    record, which carries the same data.
+    """
+    return {
+        "recordId": record["kinesis"]["sequenceNumber"],
+        "data": record["kinesis"]["data"],
+    }
+
+
+def object_key(prefix, records, compressed):
+    """
+    Return the key of the object holding ``records``, partitioned by the hour
+    the first record arrived. The key only depends on the records, so writing
+    the same records again replaces the object.
+    """
+    first, last = records[0], records[-1]
+    arrived = time.gmtime(first["kinesis"]["approximateArrivalTimestamp"])
+    shard = first["eventID"].split(":")[0]
+    return (
+        f"{prefix}{time.strftime('%Y/%m/%d/%H/', arrived)}{shard}-"
+        f"{first['kinesis']['sequenceNumber']}-{last['kinesis']['sequenceNumber']}"
+        + (".gz" if compressed else "")
+    )
+
+
+@handler.profiler.timed
+def put_object(prefix, records, lines, compressed):
+    body = b"".join(line + b"\n" for line in lines)
+    if compressed:
+        compressor = zlib.compressobj(wbits=31)
+        body = compressor.compress(body) + compressor.flush()
+    key = object_key(prefix, records, compressed)
+    get_s3().put_object(Bucket=OUTPUT_BUCKET, Key=key, Body=body)
+    print(
+        f"Wrote {len(lines)} records, {len(body)} bytes to s3://{OUTPUT_BUCKET}/{key}"
+    )
+    return len(body)
+
+
+def error_line(record, reason):
+    """
+    Return the error output line of a record, in the layout Firehose uses for
+    ``ProcessingFailed`` records.
+    """
+    kinesis = record["kinesis"]
+    return json.dumps(
+        {
+            "errorCode": reason,
+            "rawData": kinesis["data"],
+            "sequenceNumber": kinesis["sequenceNumber"],
+            "partitionKey": kinesis["partitionKey"],
+            "approximateArrivalTimestamp": int(
+                kinesis["approximateArrivalTimestamp"] * 1000
+            ),
+        }
+    ).encode("utf-8")
+
+
+@handler.profiler.profiled
+def lambda_handler(event, context):
+    """
+    Process a batch of a Kinesis event source mapping on a DAS stream.
+    """
+    deadline = Deadline(context, handler.DEADLINE_MARGIN)
+    records = event["Records"]
+    print(f"Received {len(records)} records.")
+    if not records:
+        return {"batchItemFailures": []}
+    before = handler.counters()
+    reset_peak_rss()
+    summary = BatchSummary()
+    metrics = BatchMetrics(handler.METRICS_NAMESPACE, handler.METRICS_DIMENSIONS)
+    # An event source mapping reads a single stream, so of one database.
+    source = handler.source_resolver.resolve(records[0].get("eventSourceARN"))
+    command_texts = handler.command_texts
+    if command_texts is not None:
+        command_texts.start_batch()
+    results = handler.process_with_retries(
+        [firehose_record(record) for record in records], deadline, summary, source
+    )
+    written = len(results)
+    for index, (_output_record, reason, _stats) in enumerate(results):
+        if reason in REPORTED:
+            written = index
+            break
+    lines, errors = [], []
+    for record, (output_record, reason, stats) in zip(records, results[:written]):
+        summary.add(output_record, reason)
+        metrics.add(stats)
+        if output_record["result"] == OK:
+            lines.append(base64.b64decode(output_record["data"]))
+        elif reason is not None:
+            errors.append(error_line(record, reason))
+    reported = records[written:]
+    try:
+        object_bytes = 0
+        if lines:
+            object_bytes = put_object(
+                OUTPUT_PREFIX, records[:written], lines, COMPRESS_OBJECTS
+            )
+        if errors:
+            put_object(ERROR_OUTPUT_PREFIX, records[:written], errors, True)
+    except (BotoCoreError, ClientError) as e:
+        print("Writing to S3 failed:", e)
+        reported = records
+        object_bytes = 0
+    if command_texts is not None and (reported or errors):
+        # Records that are not written may have emitted texts.
+        command_texts.invalidate()
+    if reported:
+        print(
+            f"Reporting {len(reported)} records from sequence number "
+            f"{reported[0]['kinesis']['sequenceNumber']} as failed."
+        )
+    metrics.put("ObjectBytes", object_bytes, "Bytes")
+    metrics.put("BatchItemFailures", len(reported))
+    handler.report_batch(written, summary, metrics, deadline, before)
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": record["kinesis"]["sequenceNumber"]}
+            for record in reported
+        ]
+    }
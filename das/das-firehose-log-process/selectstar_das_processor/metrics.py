@@ -0,0 +1,137 @@
+"""
+Batch metrics in CloudWatch Embedded Metric Format (EMF).
+
+Lambda forwards stdout to CloudWatch Logs, which extracts metrics from log
+lines in EMF, so the metrics need neither an agent nor API calls. Records
+collect their stage timings and counts in a `RecordStats`, which is small
+enough to be returned from worker processes, and `BatchMetrics` merges them
+into EMF documents per batch.
+"""
+
+import json
+import time
+from collections import Counter
+
+# Processing stages of a record, in order.
+STAGES = ("unwrap", "decrypt", "inflate", "parse", "filter", "encode")
+
+_clock = time.perf_counter
+
+
+class RecordStats:
+    """
+    Stage timings in seconds, byte counts and event counts of a record.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.events_received = 0
+        self.events_kept = 0
+        self.bytes_projected = 0
+        self.events_sampled = 0
+        self.events = Counter()
+        # Indices of the events the sampler suppressed, see `RecordSample`.
+        # Only kept per record, so not merged.
+        self.suppressed = ()
+
+    def timed(self, iterable, stage):
+        """
+        Iterate over ``iterable``, adding the time spent producing its items to
+        ``stage``. Nested timed iterables add up to the outer stage as well.
+        """
+        iterator = iter(iterable)
+        seconds = self.seconds
+        while True:
+            started = _clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                seconds[stage] += _clock() - started
+                return
+            seconds[stage] += _clock() - started
+            yield item
+
+    def merge(self, other):
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.events_received += other.events_received
+        self.events_kept += other.events_kept
+        self.bytes_projected += other.bytes_projected
+        self.events_sampled += other.events_sampled
+        self.events.update(other.events)
+
+
+class BatchMetrics:
+    """
+    Collects the metrics of a batch and writes them as EMF documents with
+    ``sink``, which defaults to stdout.
+    """
+
+    def __init__(self, namespace, dimensions, sink=print):
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self.sink = sink
+        self.started = _clock()
+        self.stats = RecordStats()
+        self.values = {}
+
+    def add(self, stats):
+        if stats is not None:
+            self.stats.merge(stats)
+
+    def put(self, name, value, unit="Count"):
+        self.values[name] = (value, unit)
+
+    def _document(self, dimensions, values):
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit}
+                            for name, (_value, unit) in values.items()
+                        ],
+                    }
+                ],
+            },
+        }
+        document.update(dimensions)
+        document.update((name, value) for name, (value, _unit) in values.items())
+        return document
+
+    def documents(self):
+        """
+        Return the EMF documents of the batch: one with the batch totals and
+        one per ``serverType`` and ``command`` of the kept events.
+        """
+        stats = self.stats
+        values = {
+            f"{stage.capitalize()}Time": (seconds * 1000, "Milliseconds")
+            for stage, seconds in stats.seconds.items()
+        }
+        values["BatchTime"] = ((_clock() - self.started) * 1000, "Milliseconds")
+        values["BytesIn"] = (stats.bytes_in, "Bytes")
+        values["BytesOut"] = (stats.bytes_out, "Bytes")
+        values["EventsReceived"] = (stats.events_received, "Count")
+        values["EventsKept"] = (stats.events_kept, "Count")
+        values["ProjectionBytesSaved"] = (stats.bytes_projected, "Bytes")
+        values["EventsSampled"] = (stats.events_sampled, "Count")
+        values.update(self.values)
+        documents = [self._document(self.dimensions, values)]
+        for (server_type, command), count in stats.events.items():
+            dimensions = dict(
+                self.dimensions, ServerType=str(server_type), Command=str(command)
+            )
+            documents.append(self._document(dimensions, {"Events": (count, "Count")}))
+        return documents
+
+    def emit(self):
+        for document in self.documents():
+            self.sink(json.dumps(document))
@@ -0,0 +1,88 @@
+"""
+Per-record outcomes of a Firehose transformation batch.
+
+Firehose expects exactly one output record per input record, with a result of
+``Ok``, ``Dropped`` or ``ProcessingFailed``. An exception escaping the handler
+fails the whole batch and Firehose invokes it again, redoing the KMS calls and
+decryption of every record, so errors are instead caught per record and
+reported as ``ProcessingFailed`` with one of the reason codes below.
+"""
+
+from collections import Counter
+
+OK = "Ok"
+DROPPED = "Dropped"
+PROCESSING_FAILED = "ProcessingFailed"
+
+MALFORMED_RECORD = "MalformedRecord"
+UNKNOWN_SOURCE = "UnknownSource"
+KMS_THROTTLED = "KmsThrottled"
+KMS_UNAVAILABLE = "KmsUnavailable"
+KMS_ERROR = "KmsError"
+DECRYPTION_FAILED = "DecryptionFailed"
+DECOMPRESSION_FAILED = "DecompressionFailed"
+MALFORMED_RECORD_SET = "MalformedRecordSet"
+WORKER_FAILED = "WorkerFailed"
+DEADLINE_EXCEEDED = "DeadlineExceeded"
+RESPONSE_TOO_LARGE = "ResponseTooLarge"
+INTERNAL_ERROR = "InternalError"
+
+# Reasons that may succeed when the record is processed again.
+RETRYABLE = frozenset({KMS_THROTTLED, KMS_UNAVAILABLE, WORKER_FAILED})
+
+
+class RecordError(Exception):
+    """
+    A record could not be processed, for the given reason code.
+    """
+
+    def __init__(self, reason, message=""):
+        super().__init__(f"{reason}: {message}" if message else reason)
+        self.reason = reason
+
+    @property
+    def retryable(self):
+        return self.reason in RETRYABLE
+
+
+def failed_record(record_id):
+    """
+    Return the output record of a record that could not be processed.
+    """
+    return {"recordId": record_id, "result": PROCESSING_FAILED}
+
+
+class BatchSummary:
+    """
+    Counts the results of a batch and the reasons of its failed records.
+    """
+
+    def __init__(self):
+        self.results = Counter()
+        self.reasons = Counter()
+        self.retried = 0
+
+    def add(self, output_record, reason=None):
+        self.results[output_record["result"]] += 1
+        if reason is not None:
+            self.reasons[reason] += 1
+
+    def fail(self, reason, count=1):
+        """
+        Count records that were turned into ``ProcessingFailed`` after having
+        been counted with another result.
+        """
+        if count:
+            self.results[OK] -= count
+            self.results[PROCESSING_FAILED] += count
+            self.reasons[reason] += count
+
+    def __str__(self):
+        results = ", ".join(
+            f"{self.results[result]} {result}"
+            for result in (OK, DROPPED, PROCESSING_FAILED)
+        )
+        if self.reasons:
+            reasons = ", ".join(f"{n} {reason}" for reason, n in self.reasons.items())
+            results += f" ({reasons})"
+        return f"{results}, {self.retried} retried"
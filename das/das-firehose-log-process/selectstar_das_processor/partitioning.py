@@ -0,0 +1,52 @@
+"""
+Partition keys for Firehose dynamic partitioning.
+
+With dynamic partitioning, Firehose delivers every output record to the S3
+prefix built from the ``metadata.partitionKeys`` the transformation returns for
+it, so that queries and ingest jobs can read single resources, databases or
+hours. A record set is one output record, so its keys are taken from the record
+set and its first kept event.
+"""
+
+import re
+import time
+
+# Database key of record sets with events of several databases.
+MULTIPLE = "_multiple"
+UNKNOWN = "_unknown"
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+# Eg. "2024-08-15 00:15:22.818828+00", in UTC.
+_LOG_TIME = re.compile(r"(\d{4}-\d{2}-\d{2})[ T](\d{2})")
+
+
+def partition_value(value):
+    """
+    Return ``value`` as a string that is safe in an S3 prefix.
+    """
+    if value is None or value == "":
+        return UNKNOWN
+    return _UNSAFE.sub("_", str(value))
+
+
+def partition_keys(fields, event, database, resource_id=None):
+    """
+    Return the partition keys of a record set, given its top-level ``fields``,
+    its first kept event and the database name shared by its kept events, or
+    `MULTIPLE`. The resource ID falls back to ``resource_id`` if the record set
+    has none, and the event hour to the current hour.
+    """
+    resource_id = fields.get("clusterId") or fields.get("instanceId") or resource_id
+    log_time = event.get("logTime")
+    match = _LOG_TIME.match(log_time) if isinstance(log_time, str) else None
+    if match is not None:
+        date, hour = match.groups()
+    else:
+        date, hour = time.strftime("%Y-%m-%d %H", time.gmtime()).split()
+    return {
+        "resourceId": partition_value(resource_id),
+        "serverType": partition_value(event.get("serverType")).lower(),
+        "database": database if database == MULTIPLE else partition_value(database),
+        "eventDate": date,
+        "eventHour": hour,
+    }
@@ -0,0 +1,306 @@
+"""
+Streaming helpers for DAS record sets.
+
+A decrypted record set is a gzip-compressed JSON document of the form
+``{"type": ..., "databaseActivityEventList": [...], ...}``. The helpers below
+inflate it incrementally and split the event list into single events as it is
+read, so that only the events in flight and a small read buffer are held in
+memory instead of full copies of the record set at every processing step.
+
+Events are split with the C scanner behind `json.JSONDecoder.raw_decode`,
+which finds the end of an event faster than any pattern matching done in
+Python, and events that are kept are passed on as the raw JSON text they were
+read as instead of being serialized again.
+"""
+
+import codecs
+import json
+import re
+import resource
+import zlib
+
+EVENT_LIST = "databaseActivityEventList"
+
+CHUNK_SIZE = 64 * 1024
+
+_KEY = re.compile(r'\s*+"((?:[^"\\]++|\\.)*+)"\s*+:', re.DOTALL)
+_WHITESPACE = re.compile(r"\s*+")
+_SEPARATOR = re.compile(r"\s*+([,\]])\s*+")
+_DELIMITERS = frozenset(",]} \t\r\n")
+_decoder = json.JSONDecoder()
+
+
+class ParseError(ValueError):
+    """
+    A record set is not valid UTF-8 or not a well-formed JSON object.
+    """
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process, so that the next reading
+    of `peak_rss` only covers work done since. Returns False if the kernel does
+    not support it, in which case `peak_rss` reports the lifetime peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process in bytes.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def inflate(chunks, chunk_size=CHUNK_SIZE):
+    """
+    Incrementally decompress a gzip stream given as an iterable of byte chunks.
+    """
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS + 16)
+    for chunk in chunks:
+        while chunk:
+            inflated = decompressor.decompress(chunk, chunk_size)
+            if inflated:
+                yield inflated
+            chunk = decompressor.unconsumed_tail
+    inflated = decompressor.flush()
+    if inflated:
+        yield inflated
+    if not decompressor.eof:
+        raise zlib.error("incomplete or truncated stream")
+
+
+class RecordSetReader:
+    """
+    Incrementally parse a DAS record set from an iterable of UTF-8 encoded JSON
+    byte chunks, raising `ParseError` if it is malformed. Errors of the chunks
+    are passed on.
+
+    Iterating yields ``(key, value, raw_value)`` for each top-level field,
+    where ``raw_value`` is the JSON text of the value. Entries of the
+    ``databaseActivityEventList`` field are yielded one event at a time as
+    ``(EVENT_LIST, event, raw_event)`` instead of as a single list value.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self.has_event_list = False
+        self.bytes_read = 0
+        self.peak_buffered = 0
+
+    def _fill(self):
+        """
+        Drop consumed text and read at least as much new input as is still
+        buffered, so that values spanning many chunks are re-scanned only a
+        logarithmic number of times. Returns False once the input is exhausted.
+        """
+        if self._eof:
+            return False
+        pending = [self._buffer[self._pos :]]
+        wanted = max(len(pending[0]), 1)
+        read = 0
+        while read < wanted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                pending.append(self._decode(b"", final=True))
+                break
+            self.bytes_read += len(chunk)
+            text = self._decode(chunk)
+            pending.append(text)
+            read += len(text)
+        self._buffer = "".join(pending)
+        self._pos = 0
+        self.peak_buffered = max(self.peak_buffered, len(self._buffer))
+        return read > 0
+
+    def _decode(self, chunk, final=False):
+        try:
+            return self._text.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise ParseError(f"Malformed record set: {e}") from e
+
+    def _peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ParseError("Unexpected end of record set")
+
+    def _expect(self, tokens):
+        """
+        Consume one of the given single-character tokens.
+        """
+        token = self._peek()
+        if token not in tokens:
+            raise ParseError(f"Malformed record set: expected one of {tokens!r}")
+        self._pos += 1
+        return token
+
+    def _key(self):
+        """
+        Consume an object key and the following colon.
+        """
+        self._peek()
+        while True:
+            match = _KEY.match(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.end()
+                key = match.group(1)
+                if "\\" not in key:
+                    return key
+                try:
+                    return json.loads(f'"{key}"')
+                except json.JSONDecodeError as e:
+                    raise ParseError(f"Malformed record set: {e}") from e
+            if not self._fill():
+                raise ParseError("Malformed record set: expected a key")
+
+    def _value(self):
+        """
+        Consume one JSON value and return it along with its raw text.
+        """
+        self._peek()
+        while True:
+            start = self._pos
+            try:
+                value, end = _decoder.raw_decode(self._buffer, start)
+                # A value is always followed by a delimiter; anything else means
+                # a number was cut off at the end of the buffer.
+                if self._eof or self._buffer[end : end + 1] in _DELIMITERS:
+                    self._pos = end
+                    return value, self._buffer[start:end]
+            except json.JSONDecodeError as e:
+                if self._eof:
+                    raise ParseError(f"Malformed record set: {e}") from e
+            self._fill()
+
+    def _events(self):
+        """
+        Consume the entries of the event list, yielding each event along with
+        its raw JSON text.
+        """
+        scan_once = _decoder.scan_once
+        while True:
+            buffer = self._buffer
+            start = self._pos
+            try:
+                event, end = scan_once(buffer, start)
+                match = _SEPARATOR.match(buffer, end)
+            except (StopIteration, json.JSONDecodeError):
+                match = None
+            if match is None or match.end() == len(buffer):
+                # The event may continue in the next chunk.
+                event, raw_event = self._value()
+                yield EVENT_LIST, event, raw_event
+                if self._expect(",]") == "]":
+                    return
+                self._peek()
+                continue
+            self._pos = match.end()
+            yield EVENT_LIST, event, buffer[start:end]
+            if match.group(1) == "]":
+                return
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._key()
+            if key == EVENT_LIST and self._peek() == "[":
+                self.has_event_list = True
+                self._pos += 1
+                if self._peek() != "]":
+                    yield from self._events()
+                else:
+                    self._pos += 1
+            else:
+                value, raw_value = self._value()
+                yield key, value, raw_value
+            if self._expect(",}") == "}":
+                return
+
+
+class RecordSetEncoder:
+    """
+    Incrementally serialize a record set into gzip-compressed JSON, mirroring
+    the layout of `json.dumps`.
+    """
+
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS + 16)
+        self._output = []
+        self._pending = []
+        self._pending_size = 0
+        self._separator = b"{"
+        self._in_list = False
+        self.bytes_in = 0
+
+    def _write(self, data):
+        # Small writes are batched to keep per-event compressor calls down.
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= CHUNK_SIZE:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        self.bytes_in += self._pending_size
+        compressed = self._compressor.compress(b"".join(self._pending))
+        if compressed:
+            self._output.append(compressed)
+        self._pending = []
+        self._pending_size = 0
+
+    def field(self, key, raw_value):
+        """
+        Write a top-level field from its raw JSON text.
+        """
+        if self._in_list:
+            self._write(b"]")
+            self._in_list = False
+        self._write(self._separator + f"{json.dumps(key)}: {raw_value}".encode("utf-8"))
+        self._separator = b", "
+
+    def event(self, raw_event, event=None):
+        """
+        Append an event, given as raw JSON text, to the event list.
+        """
+        if self._in_list:
+            self._write(b", " + raw_event.encode("utf-8"))
+            return
+        self._write(self._separator + f'"{EVENT_LIST}": [{raw_event}'.encode("utf-8"))
+        self._separator = b", "
+        self._in_list = True
+
+    def finish(self):
+        """
+        Close the document and return the compressed bytes.
+        """
+        if self._in_list:
+            self._write(b"]")
+            self._in_list = False
+        self._write(b"}" if self._separator == b", " else b"{}")
+        self._flush_pending()
+        self._output.append(self._compressor.flush())
+        return b"".join(self._output)
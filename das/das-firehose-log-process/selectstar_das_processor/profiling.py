@@ -0,0 +1,241 @@
+"""
+On-demand profiling of Lambda invocations.
+
+Profiling is enabled by a comma-separated list of modes:
+
+* ``cprofile``: `cProfile` of the thread running the handler. Work done by
+  worker threads or processes shows up as the time spent waiting for them.
+* ``tracemalloc``: the peak memory traced during the invocation and the lines
+  that allocated the most of the memory still held at its end.
+* ``stages``: calls and wall-clock time of the functions wrapped by
+  `Profiler.timed`.
+
+``cprofile`` and ``tracemalloc`` slow an invocation down several times, so
+they only run on 1 in ``every`` invocations, chosen at random. Stage timers run
+on every invocation. Compact reports of the ``top`` entries are logged, and
+full reports are written to the directory ``path`` or, with ``s3_uri`` set,
+uploaded below that S3 prefix. Without modes, `Profiler.profiled` and
+`Profiler.timed` return the functions they wrap unchanged, so profiling costs
+nothing when disabled.
+
+The Redshift provisioning function ships this module as well, through the
+``redshift/profiling.py`` link, so it only uses the standard library and must
+run on the Python 3.9 runtime of that function.
+"""
+
+import functools
+import io
+import json
+import os
+import random
+import threading
+import time
+
+MODES = ("cprofile", "tracemalloc", "stages")
+
+
+class Profiler:
+    """
+    Profiles the invocations of a handler and reports the results.
+    """
+
+    def __init__(
+        self, name, modes=(), every=1, top=25, path="/tmp", s3_uri=None, log=print
+    ):
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise ValueError(
+                f"Unknown profile modes {sorted(unknown)}, expected some of: "
+                + ", ".join(MODES)
+            )
+        if every < 1:
+            raise ValueError(f"Invalid profile_every: {every}")
+        self.name = name
+        self.modes = frozenset(modes)
+        self.every = every
+        self.top = top
+        self.path = path
+        self.s3_uri = s3_uri
+        self.log = log
+        self._stages = None
+        self._lock = threading.Lock()
+        self._s3 = None
+
+    def timed(self, fn):
+        """
+        Return ``fn`` timed as a stage of the invocations, or unchanged if
+        stage timers are disabled.
+        """
+        if "stages" not in self.modes:
+            return fn
+        name = fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._add_stage(name, time.perf_counter() - start)
+
+        return wrapper
+
+    def _add_stage(self, name, seconds):
+        stages = self._stages
+        if stages is None:
+            return
+        with self._lock:
+            entry = stages.get(name)
+            if entry is None:
+                stages[name] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+    def profiled(self, handler):
+        """
+        Return the Lambda ``handler`` profiled, or unchanged if profiling is
+        disabled.
+        """
+        if not self.modes:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            return self._invoke(handler, event, context)
+
+        return wrapper
+
+    def _invoke(self, handler, event, context):
+        sampled = random.randrange(self.every) == 0
+        profile = None
+        if sampled and "cprofile" in self.modes:
+            import cProfile
+
+            profile = cProfile.Profile()
+        tracing = False
+        if sampled and "tracemalloc" in self.modes:
+            import tracemalloc
+
+            # Tracing started elsewhere, eg. by PYTHONTRACEMALLOC, is left on.
+            tracing = not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if "stages" in self.modes:
+            self._stages = {}
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            return handler(event, context)
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            stages, self._stages = self._stages, None
+            try:
+                self._report(context, seconds, stages, profile, sampled)
+            except Exception as e:
+                self.log(f"Profiling failed: {e!r}")
+            finally:
+                if tracing:
+                    tracemalloc.stop()
+
+    def _report(self, context, seconds, stages, profile, sampled):
+        request_id = getattr(context, "aws_request_id", None) or str(
+            int(time.time() * 1000)
+        )
+        reports = {}
+        if stages is not None:
+            reports["stages.json"] = self._stage_report(request_id, seconds, stages)
+        # Before the allocations of the other reports.
+        if sampled and "tracemalloc" in self.modes:
+            reports["tracemalloc.txt"] = self._tracemalloc_report()
+        if profile is not None:
+            reports.update(self._cprofile_report(profile))
+        for kind, report in reports.items():
+            if not kind.endswith(".pstats"):
+                self.log(f"Profile {kind} of {self.name} {request_id}: {report}")
+        self.log(f"Profile reports written to {self._write(request_id, reports)}")
+
+    def _stage_report(self, request_id, seconds, stages):
+        return json.dumps(
+            {
+                "name": self.name,
+                "requestId": request_id,
+                "seconds": round(seconds, 6),
+                "stages": {
+                    name: {"calls": calls, "seconds": round(total, 6)}
+                    for name, (calls, total) in sorted(
+                        stages.items(), key=lambda item: -item[1][1]
+                    )
+                },
+            }
+        )
+
+    def _cprofile_report(self, profile):
+        import marshal
+        import pstats
+
+        # The raw stats, as written by dump_stats for pstats, snakeviz and the
+        # like.
+        profile.create_stats()
+        dump = marshal.dumps(profile.stats)
+        text = io.StringIO()
+        stats = pstats.Stats(profile, stream=text).strip_dirs()
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stats.sort_stats("tottime").print_stats(self.top)
+        report = "\n".join(line for line in text.getvalue().splitlines() if line)
+        return {"cprofile.txt": report, "cprofile.pstats": dump}
+
+    def _tracemalloc_report(self):
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            )
+        )
+        lines = [f"peak {peak} bytes, held {current} bytes"]
+        lines += map(str, snapshot.statistics("lineno")[: self.top])
+        return "\n".join(lines)
+
+    def _write(self, request_id, reports):
+        """
+        Write the reports to the profile path or S3 prefix and return where.
+        """
+        prefix = f"{self.name}-{request_id}"
+        if self.s3_uri:
+            bucket, _, key_prefix = self.s3_uri[len("s3://") :].partition("/")
+            if key_prefix and not key_prefix.endswith("/"):
+                key_prefix += "/"
+            if self._s3 is None:
+                import boto3
+
+                self._s3 = boto3.client("s3")
+            for kind, report in reports.items():
+                self._s3.put_object(
+                    Bucket=bucket,
+                    Key=f"{key_prefix}{prefix}.{kind}",
+                    Body=report if isinstance(report, bytes) else report.encode(),
+                )
+            return f"s3://{bucket}/{key_prefix}{prefix}.*"
+        os.makedirs(self.path, exist_ok=True)
+        for kind, report in reports.items():
+            mode = "wb" if isinstance(report, bytes) else "w"
+            with open(os.path.join(self.path, f"{prefix}.{kind}"), mode) as f:
+                f.write(report)
+        return os.path.join(self.path, f"{prefix}.*")
+
+
+def load_profiler(name, modes=None, **options):
+    """
+    Build the profiler of a handler from a comma-separated list of modes, which
+    may be empty or ``off`` to disable profiling.
+    """
+    modes = [mode.strip().lower() for mode in (modes or "").split(",")]
+    return Profiler(name, [mode for mode in modes if mode and mode != "off"], **options)
@@ -0,0 +1,103 @@
+"""
+A configurable projection of the fields of DAS activity events.
+
+Many event fields, such as ``paramList``, ``remotePort`` or ``netProtocol``,
+are of no use downstream, and generated SQL can make a single ``commandText``
+hundreds of KB long. The projection is given as a JSON document::
+
+    {
+        "exclude": ["paramList", "remotePort", "pid", "netProtocol", "dbProtocol"],
+        "maxLengths": {"commandText": 65536},
+        "dropNulls": true
+    }
+
+``include`` lists the only fields to keep, ``exclude`` the fields to remove;
+at most one of them may be given. ``maxLengths`` shortens strings to a number
+of characters and lists to a number of entries, listing the shortened fields in
+``truncatedFields``. With ``dropNulls``, fields whose value is null are removed.
+"""
+
+import json
+
+from .rules import load_document
+from .sizing import TRUNCATED
+
+
+def dumps(value):
+    """
+    Serialize like the JSON of DAS record sets: compact and not ASCII-escaped.
+    """
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _size(value):
+    return len(dumps(value).encode("utf-8"))
+
+
+class Projection:
+    """
+    Applies the projection to events.
+    """
+
+    def __init__(self, include=None, exclude=None, max_lengths=None, drop_nulls=False):
+        if include is not None and exclude is not None:
+            raise ValueError("Only one of include and exclude may be given")
+        self.include = frozenset(include) if include is not None else None
+        self.exclude = frozenset(exclude or ())
+        self.max_lengths = dict(max_lengths or {})
+        for field, length in self.max_lengths.items():
+            if not isinstance(length, int) or length < 0:
+                raise ValueError(f"Invalid max. length of {field}: {length!r}")
+        self.drop_nulls = drop_nulls
+
+    def apply(self, event):
+        """
+        Project an event in place. Returns the number of bytes by which its JSON
+        shrank, or None if the event was not changed.
+        """
+        if self.include is not None:
+            removed = [field for field in event if field not in self.include]
+        else:
+            removed = [field for field in self.exclude if field in event]
+        if self.drop_nulls:
+            removed += [
+                field
+                for field, value in event.items()
+                if value is None and field not in removed
+            ]
+        saved = 0
+        for field in removed:
+            # The field, its value, the quotes, the colon and a comma.
+            saved += len(field.encode("utf-8")) + 4 + _size(event.pop(field))
+        truncated = []
+        for field, length in self.max_lengths.items():
+            value = event.get(field)
+            if isinstance(value, (str, list)) and len(value) > length:
+                event[field] = value[:length]
+                saved += _size(value) - _size(event[field])
+                truncated.append(field)
+        if truncated:
+            event[TRUNCATED] = truncated
+            saved -= len(TRUNCATED) + 4 + _size(truncated)
+        return saved if removed or truncated else None
+
+
+def load_projection(projection=None, path=None):
+    """
+    Build the projection given as a JSON document or read from the JSON file at
+    ``path``, or return None if there is none.
+    """
+    config = load_document(projection, path)
+    if config is None:
+        return None
+    if not isinstance(config, dict):
+        raise ValueError("Event projection must be a JSON object")
+    unknown = set(config) - {"include", "exclude", "maxLengths", "dropNulls"}
+    if unknown:
+        raise ValueError(f"Unknown event projection settings: {sorted(unknown)}")
+    return Projection(
+        include=config.get("include"),
+        exclude=config.get("exclude"),
+        max_lengths=config.get("maxLengths"),
+        drop_nulls=bool(config.get("dropNulls", False)),
+    )
@@ -0,0 +1,421 @@
+"""
+Replay archived DAS records through the processor, e.g. to backfill after
+changing the filter rules, the projection or the output format.
+
+Reads raw DAS records from local files or S3 objects, in the layouts they are
+archived in: the record data as Kinesis delivers it, as written by a Firehose
+source record backup, or the ``ProcessingFailed`` lines of Firehose and of
+`kinesis`, which carry it in ``rawData``. Objects may be gzip-compressed::
+
+    python -m selectstar_das_processor.replay \\
+        s3://das-archive/source-backup/2024/08/ \\
+        --output s3://das-archive/replayed/ \\
+        --checkpoint replay.checkpoint --processes 8
+
+Records go through the same decryption, filtering and encoding as in the
+Lambda function, configured by the same environment variables, and every
+input object is processed by one worker process, which keeps its own data key
+cache. The output records of an object are written as one object per
+partition, keyed by the partition keys of `partitioning`, and its failed
+records to ``processing-failed/``. Output names only depend on the input
+object, so replaying an object again replaces its output.
+
+Objects are listed in the checkpoint file once their output is written, and
+skipped when the replay is run again. Objects with records that failed for a
+transient reason, such as KMS throttling, are not listed, so that running the
+replay again retries them.
+"""
+
+from __future__ import print_function
+import argparse
+import base64
+import codecs
+import contextlib
+import functools
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import boto3
+from . import handler
+from .encoders import OUTPUT_FORMATS
+from .metrics import RecordStats
+from .outcomes import MALFORMED_RECORD, OK, RETRYABLE, BatchSummary, failed_record
+from .partitioning import partition_value
+from .pipeline import RecordSetEncoder, inflate
+from .sources import Source
+
+CHUNK_SIZE = 2**20
+ERROR_PREFIX = "processing-failed/"
+# The packed format compresses every record set already.
+COMPRESS_OBJECTS = not issubclass(
+    OUTPUT_FORMATS[handler.OUTPUT_FORMAT], RecordSetEncoder
+)
+
+_WHITESPACE = re.compile(r"\s*")
+
+# Created on first use in every process, see `get_s3`.
+s3 = None
+
+
+def get_s3():
+    global s3
+    if s3 is None:
+        s3 = boto3.client("s3")
+    return s3
+
+
+def split_s3_url(url):
+    bucket, _, key = url[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def list_inputs(locations):
+    """
+    Yield the input objects under the given local paths and ``s3://`` URLs, in
+    lexicographic order per location.
+    """
+    for location in locations:
+        if location.startswith("s3://"):
+            bucket, prefix = split_s3_url(location)
+            paginator = get_s3().get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                for entry in page.get("Contents", []):
+                    if not entry["Key"].endswith("/"):
+                        yield f"s3://{bucket}/{entry['Key']}"
+        elif os.path.isdir(location):
+            for directory, subdirectories, files in os.walk(location):
+                subdirectories.sort()
+                for name in sorted(files):
+                    yield os.path.join(directory, name)
+        else:
+            yield location
+
+
+def read_chunks(url):
+    """
+    Yield the content of an input object in chunks, decompressed if gzipped.
+    """
+    if url.startswith("s3://"):
+        bucket, key = split_s3_url(url)
+        chunks = (
+            get_s3().get_object(Bucket=bucket, Key=key)["Body"].iter_chunks(CHUNK_SIZE)
+        )
+    else:
+        chunks = _read_file(url)
+    first = next(chunks, b"")
+    if first[:2] == b"\x1f\x8b":
+        yield from inflate(_prepend(first, chunks), CHUNK_SIZE)
+    else:
+        yield from _prepend(first, chunks)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _prepend(first, chunks):
+    if first:
+        yield first
+    yield from chunks
+
+
+def iter_documents(chunks):
+    """
+    Yield the JSON documents of a stream of concatenated or newline-delimited
+    documents, given as byte chunks.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            try:
+                document, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The document may continue in the next chunk.
+                break
+            yield document
+        buffer = buffer[pos:]
+    buffer += text.decode(b"", final=True)
+    if buffer.strip():
+        raise ValueError(f"Malformed input after {buffer[:40]!r}")
+
+
+def iter_records(chunks):
+    """
+    Yield the data of the archived DAS records in an input object, base64
+    encoded like the data of Firehose records.
+    """
+    for document in iter_documents(chunks):
+        if "rawData" in document:
+            yield document["rawData"]
+        else:
+            yield base64.b64encode(
+                json.dumps(document, separators=(",", ":")).encode("utf-8")
+            ).decode("utf-8")
+
+
+def output_name(url):
+    """
+    Return the name of the output objects of an input object.
+    """
+    name = url[len("s3://") :] if url.startswith("s3://") else os.path.abspath(url)
+    name = partition_value(name.strip("/").removesuffix(".gz").replace("/", "_"))
+    return name + (".gz" if COMPRESS_OBJECTS else "")
+
+
+def partition_path(keys):
+    return (
+        f"resource_id={keys['resourceId']}/server_type={keys['serverType']}/"
+        f"database={keys['database']}/date={keys['eventDate']}/"
+        f"hour={keys['eventHour']}/"
+    )
+
+
+def write_object(output, key, lines, compressed):
+    """
+    Write ``lines`` as the object ``key`` under the output location, replacing
+    it if it exists. Returns the location of the object.
+    """
+    body = b"".join(line + b"\n" for line in lines)
+    if compressed:
+        compressor = zlib.compressobj(wbits=31)
+        body = compressor.compress(body) + compressor.flush()
+    if output.startswith("s3://"):
+        bucket, prefix = split_s3_url(output)
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        get_s3().put_object(Bucket=bucket, Key=prefix + key, Body=body)
+        return f"s3://{bucket}/{prefix}{key}"
+    path = os.path.join(output, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written under a temporary name so that an interrupted replay never
+    # leaves a partial object behind.
+    with open(path + ".partial", "wb") as f:
+        f.write(body)
+    os.replace(path + ".partial", path)
+    return path
+
+
+def replay_record(record, source, summary, stats):
+    """
+    Process a record like the Lambda function does, retrying transient
+    failures. Returns the output record and the reason it failed, if it did.
+    """
+    for attempt in range(handler.RECORD_RETRIES + 1):
+        if attempt:
+            summary.retried += 1
+            time.sleep(handler.RECORD_RETRY_DELAY * 2 ** (attempt - 1))
+        output_record, reason = handler.run_isolated(
+            record["recordId"], handler.process_record, record, source, stats=stats
+        )
+        if reason not in RETRYABLE:
+            break
+    return output_record, reason
+
+
+def replay_object(url, output, source, quiet=True):
+    """
+    Replay the records of an input object and write their output. Returns the
+    input, the written objects, the `BatchSummary` and the `RecordStats` of
+    its records. The written objects are None if a record failed for a
+    transient reason, in which case nothing is written.
+    """
+    if handler.command_texts is not None:
+        # Objects are replayed in any order, so texts are only dropped when
+        # emitted earlier in the same record.
+        handler.command_texts.invalidate()
+        handler.command_texts.start_batch()
+    summary = BatchSummary()
+    stats = RecordStats()
+    partitions = defaultdict(list)
+    errors = []
+    index = -1
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            devnull = stack.enter_context(open(os.devnull, "w"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        records = iter_records(read_chunks(url))
+        try:
+            for index, data in enumerate(records):
+                record = {"recordId": f"{url}#{index}", "data": data}
+                output_record, reason = replay_record(record, source, summary, stats)
+                summary.add(output_record, reason)
+                if reason in RETRYABLE:
+                    return url, None, summary, stats
+                if output_record["result"] == OK:
+                    keys = output_record["metadata"]["partitionKeys"]
+                    data = base64.b64decode(output_record["data"])
+                    partitions[partition_path(keys)].append(data)
+                elif reason is not None:
+                    errors.append(error_line(index, reason, data))
+        except (ValueError, zlib.error) as e:
+            # The rest of the object cannot be read.
+            summary.add(failed_record(f"{url}#{index + 1}"), MALFORMED_RECORD)
+            errors.append(error_line(index + 1, MALFORMED_RECORD, None, str(e)))
+    name = output_name(url)
+    written = [
+        write_object(output, path + name, lines, COMPRESS_OBJECTS)
+        for path, lines in sorted(partitions.items())
+    ]
+    if errors:
+        written.append(write_object(output, ERROR_PREFIX + name, errors, True))
+    return url, written, summary, stats
+
+
+def error_line(index, reason, data, message=None):
+    """
+    Return the error output line of a record, in the layout Firehose uses for
+    ``ProcessingFailed`` records, along with its index in the input object.
+    """
+    line = {"errorCode": reason, "recordIndex": index, "rawData": data}
+    if message:
+        line["errorMessage"] = message
+    return json.dumps(line).encode("utf-8")
+
+
+def load_checkpoint(path):
+    """
+    Return the inputs listed as done in the checkpoint file at ``path``.
+    """
+    done = set()
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["input"])
+                except (ValueError, KeyError):
+                    # The last line of an interrupted replay may be cut off.
+                    continue
+    return done
+
+
+def open_checkpoint(path):
+    """
+    Open the checkpoint file at ``path`` for appending, ending the line cut off
+    by an interrupted replay so that it does not swallow the next one.
+    """
+    with open(path, "ab+") as f:
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    return open(path, "a")
+
+
+def start_worker():
+    # Replayed output is always partitioned.
+    handler.PARTITION_KEYS = True
+
+
+def replay(inputs, output, source, checkpoint=None, processes=1, quiet=True):
+    """
+    Replay the given input objects, skipping those listed in the checkpoint
+    file. Returns the number of objects that failed or are to be retried.
+    """
+    done = load_checkpoint(checkpoint)
+    pending = [url for url in inputs if url not in done]
+    print(f"Replaying {len(pending)} objects, {len(inputs) - len(pending)} done.")
+    started = time.perf_counter()
+    summary = BatchSummary()
+    stats = RecordStats()
+    incomplete = 0
+    start_worker()
+    with contextlib.ExitStack() as stack:
+        log = open_checkpoint(checkpoint) if checkpoint else None
+        if log is not None:
+            stack.enter_context(log)
+        if processes > 1:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(processes, initializer=start_worker)
+            )
+            futures = {
+                executor.submit(replay_object, url, output, source, quiet): url
+                for url in pending
+            }
+            results = ((futures[f], f.result) for f in as_completed(futures))
+        else:
+            results = (
+                (url, functools.partial(replay_object, url, output, source, quiet))
+                for url in pending
+            )
+        for url, result in results:
+            try:
+                _url, written, object_summary, object_stats = result()
+            except Exception as e:
+                # Reading or writing the objects failed.
+                incomplete += 1
+                print(f"{url} failed: {e!r}")
+                continue
+            summary.results.update(object_summary.results)
+            summary.reasons.update(object_summary.reasons)
+            summary.retried += object_summary.retried
+            stats.merge(object_stats)
+            if written is None:
+                incomplete += 1
+                print(f"{url}: {object_summary}, to be retried.")
+                continue
+            print(f"{url}: {object_summary}, wrote {len(written)} objects.")
+            if log is not None:
+                log.write(json.dumps({"input": url, "outputs": written}) + "\n")
+                log.flush()
+    print(
+        f"Replayed {len(pending) - incomplete} of {len(pending)} objects in "
+        f"{time.perf_counter() - started:.1f} s: {summary}, "
+        f"{stats.events_kept} of {stats.events_received} events kept."
+    )
+    return incomplete
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "inputs", nargs="+", help="local files, directories or s3:// URLs"
+    )
+    parser.add_argument("--output", required=True, help="local directory or s3:// URL")
+    parser.add_argument("--checkpoint", help="file listing the replayed objects")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--resource-id", help="resource ID of the database")
+    parser.add_argument("--region", help="region of the database")
+    parser.add_argument("--stream-arn", help="ARN of the DAS stream of the records")
+    parser.add_argument("--verbose", action="store_true", help="log every record")
+    args = parser.parse_args(argv)
+
+    if args.resource_id:
+        source = Source(args.resource_id, args.region or handler.kms_region)
+    else:
+        source = handler.source_resolver.resolve(args.stream_arn)
+    if source is None:
+        parser.error("--resource-id, --stream-arn or rds_resource_id is required")
+    inputs = list(list_inputs(args.inputs))
+    return (
+        1
+        if replay(
+            inputs,
+            args.output,
+            source,
+            args.checkpoint,
+            args.processes,
+            not args.verbose,
+        )
+        else 0
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+A configurable filter for DAS activity events.
+
+Rules are given as a JSON document that maps a lowercase ``serverType`` (eg.
+``oracle``, ``sqlserver``, ``postgresql``, ``mysql``) or ``*`` for all engines to
+a list of rules. An event is dropped by the first rule whose conditions all
+match it::
+
+    {
+        "*": [
+            {"name": "admin-users", "match": {"dbUserName": ["rdsadmin", "rdsa"]}}
+        ],
+        "sqlserver": [
+            {"name": "logins", "match": {"class": "LOGIN"}}
+        ],
+        "postgresql": [
+            {
+                "name": "pg-catalog",
+                "match": {"commandText": {"regex": "(?i)\\\\bpg_catalog\\\\."}}
+            }
+        ]
+    }
+
+A condition is either a value the field must equal, a list of values it must
+be one of, or an object with one of the operators ``equals``, ``in``,
+``prefix`` (a string or a list of strings), ``regex`` (searched anywhere in the
+value) and ``exists`` (a boolean). Conditions on a missing field never match,
+except ``{"exists": false}``.
+
+Rules are compiled into plain predicates once, when the function starts.
+"""
+
+import json
+import re
+import threading
+
+ALL_SERVER_TYPES = "*"
+
+DEFAULT_RULES = {
+    "sqlserver": [{"name": "sqlserver-logins", "match": {"class": "LOGIN"}}],
+}
+
+_MISSING = object()
+
+
+def _compile_condition(field, condition):
+    if isinstance(condition, list):
+        condition = {"in": condition}
+    elif not isinstance(condition, dict):
+        condition = {"equals": condition}
+    if len(condition) != 1:
+        raise ValueError(
+            f"Condition on '{field}' needs exactly one operator, got: {condition}"
+        )
+    ((operator, operand),) = condition.items()
+
+    if operator == "equals":
+        return lambda value: value is not _MISSING and value == operand
+    if operator == "in":
+        hashable = [o for o in operand if not isinstance(o, (dict, list))]
+        unhashable = [o for o in operand if isinstance(o, (dict, list))]
+        values = frozenset(hashable)
+
+        def is_in(value):
+            if value is _MISSING:
+                return False
+            if isinstance(value, (dict, list)):
+                return value in unhashable
+            return value in values
+
+        return is_in
+    if operator == "prefix":
+        prefixes = (operand,) if isinstance(operand, str) else tuple(operand)
+        return lambda value: isinstance(value, str) and value.startswith(prefixes)
+    if operator == "regex":
+        search = re.compile(operand).search
+        return lambda value: isinstance(value, str) and search(value) is not None
+    if operator == "exists":
+        return lambda value: (value is not _MISSING) == bool(operand)
+    raise ValueError(f"Unknown operator '{operator}' in condition on '{field}'")
+
+
+class Rule:
+    """
+    A compiled rule that counts the events it dropped.
+    """
+
+    def __init__(self, name, match):
+        if not match:
+            raise ValueError(f"Rule '{name}' has no conditions")
+        self.name = name
+        self.dropped = 0
+        conditions = [
+            (field, _compile_condition(field, condition))
+            for field, condition in match.items()
+        ]
+        if len(conditions) == 1:
+            ((field, condition),) = conditions
+            self.matches = lambda event: condition(event.get(field, _MISSING))
+        else:
+            self.matches = lambda event: all(
+                condition(event.get(field, _MISSING)) for field, condition in conditions
+            )
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, dropped={self.dropped})"
+
+
+class ServerTypeSets:
+    """
+    Compiled entries of a JSON object by lowercase ``serverType``, where the
+    entries of ``*`` apply to every engine after the engine's own. ``compile``
+    is called with each entry and its default name.
+    """
+
+    def __init__(self, config, compile):
+        self.entries = []
+        self._sets = {}
+        for server_type, entries in config.items():
+            compiled = tuple(
+                compile(entry, f"{server_type}-{index}")
+                for index, entry in enumerate(entries)
+            )
+            self.entries.extend(compiled)
+            self._sets[server_type.lower()] = compiled
+        self._common = self._sets.pop(ALL_SERVER_TYPES, ())
+        # Sets by serverType as it appears in events, to skip lower().
+        self._by_server_type = {}
+
+    def get(self, server_type):
+        entries = self._by_server_type.get(server_type)
+        if entries is None:
+            entries = self._sets.get(str(server_type).lower(), ()) + self._common
+            self._by_server_type[server_type] = entries
+        return entries
+
+
+class EventFilter:
+    """
+    Per-``serverType`` sets of compiled `Rule`s. Rules for ``*`` apply to every
+    engine, after the engine's own rules. Safe to share between threads.
+    """
+
+    def __init__(self, rules):
+        self._rules = ServerTypeSets(
+            rules, lambda entry, name: Rule(entry.get("name", name), entry.get("match"))
+        )
+        self.rules = self._rules.entries
+        # Only taken to count a drop.
+        self._lock = threading.Lock()
+
+    def allows(self, event, count=True):
+        """
+        Return False if a rule drops the event, counting the drop on that rule
+        unless ``count`` is false.
+        """
+        for rule in self._rules.get(event.get("serverType")):
+            if rule.matches(event):
+                if count:
+                    with self._lock:
+                        rule.dropped += 1
+                return False
+        return True
+
+    def stats(self):
+        """
+        Return the number of events dropped by each rule.
+        """
+        return {rule.name: rule.dropped for rule in self.rules}
+
+
+def load_document(document=None, path=None):
+    """
+    Return the JSON document given as a string or read from the JSON file at
+    ``path``, or None if there is neither.
+    """
+    if document:
+        return json.loads(document)
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def load_event_filter(rules=None, path=None):
+    """
+    Compile the rules given as a JSON document or read from the JSON file at
+    ``path``, falling back to `DEFAULT_RULES`.
+    """
+    config = load_document(rules, path)
+    if config is None:
+        config = DEFAULT_RULES
+    if not isinstance(config, dict):
+        raise ValueError("Event filter rules must be a JSON object by serverType")
+    return EventFilter(config)
@@ -0,0 +1,272 @@
+"""
+Per-statement sampling of high-frequency DAS events.
+
+Hot OLTP statements make up most of an activity stream, but their counts and a
+few examples are all that lineage and popularity need. Samplers are given as a
+JSON document that maps a lowercase ``serverType`` or ``*`` for all engines to
+a list of samplers, like the rules of `rules`. An event is sampled by the first
+sampler whose conditions match it::
+
+    {
+        "*": [
+            {"name": "hot-queries", "match": {"command": "SELECT"}, "rate": 1, "burst": 10}
+        ],
+        "postgresql": [
+            {"name": "pg-statements", "by": "command", "every": 100}
+        ]
+    }
+
+``match`` takes the conditions of `rules` and may be left out to sample every
+event. Events are grouped by ``serverType``, ``databaseName`` and, with ``by``
+set to ``fingerprint`` (the default), the `fingerprint.fingerprint` of their
+``commandText``, or with ``command`` their ``command``. ``rate`` keeps up to
+that many events per second of ``logTime`` per group, with bursts of up to
+``burst`` events (by default ``rate``), and ``every`` keeps the first and then
+every n-th event per group.
+
+Suppressed events are not lost: every record set that suppressed events ends
+with a summary event per group, of type ``suppressed``, with their count, first
+and last ``logTime`` and user names. The summaries only cover the events of
+their record set, so they hold in any processing order. Sampling state is kept
+per process, so with worker processes each process applies the rates.
+"""
+
+import calendar
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .fingerprint import FingerprintCache
+from .rules import Rule, ServerTypeSets, load_document
+
+SUPPRESSED = "suppressed"
+# User names listed per summary.
+MAX_USERS = 100
+
+_LOG_TIME = re.compile(r"(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})(\.\d+)?")
+
+
+class Sampler:
+    """
+    A compiled sampler that counts the events it suppressed.
+    """
+
+    def __init__(
+        self, name, match=None, by="fingerprint", rate=None, burst=None, every=None
+    ):
+        if (rate is None) == (every is None):
+            raise ValueError(f"Sampler '{name}' needs exactly one of rate and every")
+        if by not in ("fingerprint", "command"):
+            raise ValueError(f"Unknown grouping '{by}' of sampler '{name}'")
+        if rate is not None and not rate > 0:
+            raise ValueError(f"Invalid rate of sampler '{name}': {rate!r}")
+        if every is not None and (not isinstance(every, int) or every < 1):
+            raise ValueError(f"Invalid every of sampler '{name}': {every!r}")
+        self.name = name
+        self.matches = Rule(name, match).matches if match else lambda event: True
+        self.by = by
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate or 0, 1)
+        self.every = every
+        self.suppressed = 0
+
+    def __repr__(self):
+        return f"Sampler({self.name!r}, suppressed={self.suppressed})"
+
+
+class EventSampler:
+    """
+    Per-``serverType`` sets of `Sampler`s, applied to the kept events of a
+    record set through a `RecordSample`. The token buckets or counters of the
+    groups are kept in an LRU of ``max_groups`` entries. Safe to share between
+    threads.
+    """
+
+    def __init__(self, samplers, max_groups=4096):
+        self._samplers = ServerTypeSets(samplers, self._compile)
+        self.samplers = self._samplers.entries
+        self.max_groups = max_groups
+        self._groups = OrderedDict()
+        self._fingerprints = FingerprintCache(max_groups)
+        self._seconds = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _compile(entry, name):
+        entry = dict(entry)
+        name = entry.pop("name", name)
+        unknown = set(entry) - {"match", "by", "rate", "burst", "every"}
+        if unknown:
+            raise ValueError(f"Unknown settings of sampler '{name}': {sorted(unknown)}")
+        return Sampler(name, **entry)
+
+    def _time(self, log_time):
+        """
+        Return a ``logTime`` in seconds since the epoch, or the current time.
+        """
+        match = _LOG_TIME.match(log_time) if isinstance(log_time, str) else None
+        if match is None:
+            return time.time()
+        second = match.group(1, 2)
+        seconds = self._seconds.get(second)
+        if seconds is None:
+            seconds = calendar.timegm(
+                time.strptime(" ".join(second), "%Y-%m-%d %H:%M:%S")
+            )
+            if len(self._seconds) >= self.max_groups:
+                self._seconds.clear()
+            self._seconds[second] = seconds
+        return seconds + float(match.group(3) or 0)
+
+    def _keep(self, sampler, group, event):
+        """
+        Take a token from, or count the event in, the state of a group.
+        """
+        with self._lock:
+            state = self._groups.get(group)
+            if sampler.every is not None:
+                if state is None:
+                    state = self._groups[group] = [0]
+                keep = state[0] % sampler.every == 0
+                state[0] += 1
+            else:
+                now = self._time(event.get("logTime"))
+                if state is None:
+                    state = self._groups[group] = [sampler.burst, now]
+                # Events of other records may be older, so time never goes back.
+                tokens = state[0] + max(now - state[1], 0) * sampler.rate
+                state[0] = min(tokens, sampler.burst)
+                state[1] = max(now, state[1])
+                keep = state[0] >= 1
+                if keep:
+                    state[0] -= 1
+            self._groups.move_to_end(group)
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+            if not keep:
+                sampler.suppressed += 1
+        return keep
+
+    def match(self, event):
+        """
+        Return the sampler of the event and its group, or None if no sampler
+        matches it. Leaves the state of the groups unchanged.
+        """
+        for sampler in self._samplers.get(event.get("serverType")):
+            if sampler.matches(event):
+                break
+        else:
+            return None
+        if sampler.by == "fingerprint":
+            text = event.get("commandText")
+            statement = self._fingerprints.get(text) if isinstance(text, str) else None
+        else:
+            statement = event.get("command")
+        group = (
+            sampler.name,
+            event.get("serverType"),
+            event.get("databaseName"),
+            statement,
+        )
+        return sampler, group
+
+    def sample(self, event):
+        """
+        Return None if the event is kept, else the sampler that suppressed it
+        and the group of the event.
+        """
+        matched = self.match(event)
+        if matched is None or self._keep(*matched, event):
+            return None
+        return matched
+
+    def record(self, suppressed=None):
+        return RecordSample(self, suppressed)
+
+    def stats(self):
+        """
+        Return the number of events suppressed by each sampler.
+        """
+        return {sampler.name: sampler.suppressed for sampler in self.samplers}
+
+
+class RecordSample:
+    """
+    Samples the events of one record set and summarizes those it suppressed.
+    The indices of the suppressed events, counted over the events passed to
+    `keep`, are listed in ``suppressed``. Given those of an earlier pass over
+    the same record set, the events are suppressed again alike, without taking
+    tokens or counting them on the samplers a second time.
+    """
+
+    def __init__(self, event_sampler, suppressed=None):
+        self._sampler = event_sampler
+        self._summaries = {}
+        self._replayed = frozenset(suppressed) if suppressed is not None else None
+        self._index = 0
+        self.suppressed = []
+
+    def keep(self, event):
+        """
+        Return False if the event is suppressed, adding it to the summary of its
+        group.
+        """
+        index = self._index
+        self._index += 1
+        if self._replayed is None:
+            suppressed = self._sampler.sample(event)
+        elif index in self._replayed:
+            suppressed = self._sampler.match(event)
+        else:
+            suppressed = None
+        if suppressed is None:
+            return True
+        self.suppressed.append(index)
+        sampler, group = suppressed
+        summary = self._summaries.get(group)
+        if summary is None:
+            summary = self._summaries[group] = {
+                "type": SUPPRESSED,
+                "sampler": sampler.name,
+                "serverType": event.get("serverType"),
+                "databaseName": event.get("databaseName"),
+            }
+            if sampler.by == "fingerprint":
+                summary["commandFingerprint"] = group[3]
+            summary["command"] = event.get("command")
+            summary["suppressedCount"] = 0
+            summary["firstLogTime"] = summary["lastLogTime"] = event.get("logTime")
+            summary["dbUserNames"] = []
+        summary["suppressedCount"] += 1
+        log_time = event.get("logTime")
+        if isinstance(log_time, str):
+            # Log times of the same format and time zone sort as strings.
+            if summary["firstLogTime"] is None or log_time < summary["firstLogTime"]:
+                summary["firstLogTime"] = log_time
+            if summary["lastLogTime"] is None or log_time > summary["lastLogTime"]:
+                summary["lastLogTime"] = log_time
+        users = summary["dbUserNames"]
+        user = event.get("dbUserName")
+        if user is not None and user not in users and len(users) < MAX_USERS:
+            users.append(user)
+        return False
+
+    def summaries(self):
+        """
+        Return the summary events of the suppressed events.
+        """
+        return list(self._summaries.values())
+
+
+def load_event_sampler(samplers=None, path=None):
+    """
+    Compile the samplers given as a JSON document or read from the JSON file at
+    ``path``, or return None if there are none.
+    """
+    config = load_document(samplers, path)
+    if config is None:
+        return None
+    if not isinstance(config, dict):
+        raise ValueError("Event samplers must be a JSON object by serverType")
+    return EventSampler(config)
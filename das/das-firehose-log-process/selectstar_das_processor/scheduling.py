@@ -0,0 +1,116 @@
+"""
+Deadline-aware processing of the records of a batch.
+
+A Lambda invocation that times out returns nothing, so all records it already
+processed are lost and Firehose invokes the whole batch again. `Deadline`
+tracks the remaining time of the invocation and how long records take, so that
+records are only started while they can still be finished in time.
+"""
+
+import threading
+import time
+from concurrent.futures import wait
+
+_PENDING = object()
+
+
+class Deadline:
+    """
+    The time by which an invocation has to return, ``margin`` seconds before
+    the Lambda timeout. Without a Lambda context, the deadline never passes.
+    """
+
+    def __init__(self, context=None, margin=5.0, clock=time.monotonic):
+        self._clock = clock
+        self.at = None
+        if context is not None:
+            remaining = context.get_remaining_time_in_millis() / 1000
+            self.at = clock() + remaining - margin
+        self._lock = threading.Lock()
+        self.count = 0
+        self.slowest = 0.0
+
+    def remaining(self):
+        """
+        Return the seconds left until the deadline, or None if there is none.
+        """
+        if self.at is None:
+            return None
+        return max(0.0, self.at - self._clock())
+
+    def record(self, seconds):
+        """
+        Account for a record that took ``seconds`` to process.
+        """
+        with self._lock:
+            self.count += 1
+            self.slowest = max(self.slowest, seconds)
+
+    def allows(self, seconds=0.0):
+        """
+        Return True if a record started now, plus ``seconds`` of other work, is
+        expected to finish before the deadline. The slowest record so far is
+        taken as the estimate.
+        """
+        remaining = self.remaining()
+        return remaining is None or remaining > self.slowest + seconds
+
+    def timed(self, fn, expired):
+        """
+        Wrap ``fn`` to record its duration, calling ``expired`` with the same
+        argument instead once the deadline does not allow another record.
+        """
+
+        def run(item):
+            if not self.allows():
+                return expired(item)
+            start = self._clock()
+            try:
+                return fn(item)
+            finally:
+                self.record(self._clock() - start)
+
+        return run
+
+
+def map_before(deadline, fn, items, expired, executor=None, workers=1):
+    """
+    Apply ``fn`` to every item, on ``workers`` threads of ``executor`` if given,
+    and return the results in input order. Items that cannot be started or are
+    not finished before the deadline get the result of ``expired(item)``
+    instead.
+
+    Each worker takes the next item only while the deadline allows one more
+    record on that worker, and stops taking items once the results have been
+    returned. Threads cannot be interrupted, so a record still running at the
+    deadline finishes in the background, but no further records are started.
+    """
+    run = deadline.timed(fn, expired)
+    if executor is None or workers <= 1 or len(items) <= 1:
+        return [run(item) for item in items]
+    results = [_PENDING] * len(items)
+    indices = iter(range(len(items)))
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def work():
+        while not stopped.is_set() and deadline.allows():
+            with lock:
+                index = next(indices, None)
+            if index is None:
+                return
+            results[index] = run(items[index])
+
+    futures = [executor.submit(work) for _ in range(min(workers, len(items)))]
+    done, _pending = wait(futures, timeout=deadline.remaining())
+    stopped.set()
+    for future in futures:
+        # Still queued: never started.
+        future.cancel()
+    for future in done:
+        # Raises the error of a worker, if any.
+        future.result()
+    return [
+        expired(item) if result is _PENDING else result
+        for item, result in zip(items, results)
+    ]
@@ -0,0 +1,103 @@
+"""
+Keeping the transformation response under the Lambda payload limit.
+
+Firehose invokes the processor synchronously, so the whole ``{"records": ...}``
+response must fit into Lambda's 6 MB response payload. A response over the
+limit fails the invocation and Firehose retries the entire batch. `fit_response`
+shrinks the largest output records step by step until the response fits,
+marking records as ``ProcessingFailed`` only when nothing else helps.
+"""
+
+import json
+
+# Lambda allows 6 MB (6291456 bytes) of response; keep a margin for the
+# envelope.
+MAX_RESPONSE_BYTES = 6 * 1024 * 1024 - 64 * 1024
+
+TRUNCATED = "truncatedFields"
+
+
+def record_size(output_record):
+    """
+    Return the number of bytes an output record takes up in the response.
+    """
+    size = len(output_record["recordId"]) + len(output_record["result"]) + 40
+    if "data" in output_record:
+        size += len(output_record["data"]) + 12
+    if "metadata" in output_record:
+        size += len(json.dumps(output_record["metadata"])) + 16
+    return size
+
+
+def trim_event(event, max_text, max_params):
+    """
+    Shorten the ``commandText`` of an event to ``max_text`` characters and its
+    ``paramList`` to ``max_params`` entries, listing the shortened fields in
+    ``truncatedFields``. Returns True if the event was changed.
+    """
+    truncated = []
+    text = event.get("commandText")
+    if isinstance(text, str) and len(text) > max_text:
+        event["commandText"] = text[:max_text]
+        truncated.append("commandText")
+    params = event.get("paramList")
+    if isinstance(params, list) and len(params) > max_params:
+        event["paramList"] = params[:max_params]
+        truncated.append("paramList")
+    if truncated:
+        # Fields may have been shortened by the projection already.
+        earlier = event.get(TRUNCATED) or []
+        event[TRUNCATED] = earlier + [f for f in truncated if f not in earlier]
+        return True
+    return False
+
+
+def fit_response(output, steps, budget=MAX_RESPONSE_BYTES):
+    """
+    Shrink ``output`` in place until its records fit into ``budget`` bytes.
+
+    ``steps`` are functions that re-encode the output record at an index more
+    compactly, or return None if they cannot. Each step is applied to the
+    largest ``Ok`` records first until the response fits, before moving on to
+    the next step. If the response still does not fit, ``Ok`` records are
+    replaced by ``ProcessingFailed``, largest first. Returns the number of
+    records changed by each step, with the failed records last.
+    """
+    sizes = [record_size(output_record) for output_record in output]
+    total = sum(sizes)
+    changed = []
+    for step in steps:
+        count = 0
+        for index in sorted(range(len(output)), key=sizes.__getitem__, reverse=True):
+            if total <= budget:
+                break
+            if output[index]["result"] != "Ok":
+                continue
+            output_record = step(index)
+            if output_record is None:
+                continue
+            size = record_size(output_record)
+            if size < sizes[index]:
+                output[index] = output_record
+                total += size - sizes[index]
+                sizes[index] = size
+                count += 1
+        changed.append(count)
+
+    failed = 0
+    for index in sorted(range(len(output)), key=sizes.__getitem__, reverse=True):
+        if total <= budget:
+            break
+        if output[index]["result"] != "Ok":
+            continue
+        output_record = {
+            "recordId": output[index]["recordId"],
+            "result": "ProcessingFailed",
+        }
+        size = record_size(output_record)
+        total += size - sizes[index]
+        sizes[index] = size
+        output[index] = output_record
+        failed += 1
+    changed.append(failed)
+    return changed
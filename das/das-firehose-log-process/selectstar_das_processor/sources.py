@@ -0,0 +1,98 @@
+"""
+The RDS resources that DAS streams belong to.
+
+Decrypting the data key of a DAS record needs the resource ID of the database
+in the KMS encryption context, and a KMS client in the region of the database.
+Neither is part of the record, but every database streams into its own Kinesis
+stream named ``aws-rds-das-<resource ID>``, and Firehose and event source
+mappings pass the ARN of the stream along with each batch. A single deployment
+can so process the streams of many databases.
+
+Streams that are not named after their database can be mapped to it with a
+JSON document keyed by stream ARN or name::
+
+    {
+        "my-das-stream": "cluster-ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+        "arn:aws:kinesis:eu-west-1:123456789012:stream/other": {
+            "resourceId": "db-ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            "region": "eu-west-1"
+        }
+    }
+"""
+
+import re
+from collections import namedtuple
+
+from .rules import load_document
+
+_STREAM_NAME = re.compile(r"aws-rds-das-((?:db|cluster)-[A-Za-z0-9]+)")
+
+
+class Source(namedtuple("Source", ["resource_id", "region"])):
+    """
+    The resource ID and region of the database a stream belongs to.
+    """
+
+    __slots__ = ()
+
+    @property
+    def encryption_context(self):
+        if self.resource_id.startswith("cluster-"):
+            return {"aws:rds:dbc-id": self.resource_id}
+        return {"aws:rds:db-id": self.resource_id}
+
+
+class SourceResolver:
+    """
+    Resolves the `Source` of a stream by its ARN, from ``mapping``, from the
+    stream name, or else as ``default``.
+    """
+
+    def __init__(self, mapping=None, default=None):
+        self.mapping = {}
+        for stream, value in (mapping or {}).items():
+            if isinstance(value, str):
+                value = {"resourceId": value}
+            if not isinstance(value, dict) or "resourceId" not in value:
+                raise ValueError(f"Invalid source of stream {stream}: {value!r}")
+            self.mapping[stream] = value
+        self.default = default
+        self._resolved = {}
+
+    def resolve(self, stream_arn=None):
+        """
+        Return the `Source` of the stream with the given ARN, or None if it is
+        unknown.
+        """
+        if not stream_arn:
+            return self.default
+        source = self._resolved.get(stream_arn)
+        if source is None:
+            source = self._resolve(stream_arn)
+            self._resolved[stream_arn] = source
+        return source
+
+    def _resolve(self, stream_arn):
+        parts = stream_arn.split(":", 5)
+        region = parts[3] if len(parts) == 6 else None
+        name = parts[-1].split("/", 1)[-1]
+        value = self.mapping.get(stream_arn) or self.mapping.get(name)
+        if value is not None:
+            return Source(value["resourceId"], value.get("region", region))
+        match = _STREAM_NAME.fullmatch(name)
+        if match is not None and region is not None:
+            return Source(match.group(1), region)
+        return self.default
+
+
+def load_source_resolver(mapping=None, path=None, default=None):
+    """
+    Build a resolver from the mapping given as a JSON document or read from the
+    JSON file at ``path``.
+    """
+    config = load_document(mapping, path)
+    if config is None:
+        config = {}
+    if not isinstance(config, dict):
+        raise ValueError("DAS sources must be a JSON object by stream")
+    return SourceResolver(config, default)
@@ -0,0 +1,54 @@
+"""
+Fixtures running the processor offline, with KMS and S3 replaced by the
+in-memory stubs of `tests.stubs` and of the benchmark workload.
+"""
+
+import base64
+import json
+import os
+
+import pytest
+
+# Configures the handler before it is imported.
+from benchmarks.workload import StubKMS, encrypt_record_set
+
+from selectstar_das_processor import handler
+
+
+@pytest.fixture
+def kms(monkeypatch):
+    stub = StubKMS()
+    monkeypatch.setattr(handler, "kms", stub)
+    monkeypatch.setattr(handler, "RECORD_RETRY_DELAY", 0)
+    handler.data_key_cache.clear()
+    yield stub
+    handler.data_key_cache.clear()
+
+
+@pytest.fixture
+def record_data(kms):
+    """
+    Return a function building the base64 data of a DAS record holding
+    ``events``, encrypted with the data key of index ``key``. The wrapped data
+    keys are in ``record_data.wrapped``.
+    """
+    context = handler.source_resolver.default.encryption_context
+    keys = {}
+
+    def build(events, key=0):
+        if key not in keys:
+            data_key = os.urandom(32)
+            keys[key] = data_key, kms.wrap(data_key, context)
+        data_key, wrapped = keys[key]
+        record = {
+            "type": "DatabaseActivityMonitoringRecords",
+            "version": "1.2",
+            "databaseActivityEvents": base64.b64encode(
+                encrypt_record_set(events, data_key)
+            ).decode("ascii"),
+            "key": base64.b64encode(wrapped).decode("ascii"),
+        }
+        return base64.b64encode(json.dumps(record).encode("utf-8")).decode("ascii")
+
+    build.wrapped = lambda key=0: keys[key][1]
+    return build
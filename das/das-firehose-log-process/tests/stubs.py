@@ -0,0 +1,96 @@
+"""
+Stubs and sample data for running the processor offline. Importing this module
+configures the handler for a local database.
+"""
+
+import base64
+import gzip
+import io
+import json
+import zlib
+
+# Configures the handler like the benchmarks, whose KMS stub the tests share.
+from benchmarks.workload import client_error
+
+QUERY = {
+    "type": "record",
+    "class": "TABLE",
+    "serverType": "SQLSERVER",
+    "command": "SELECT",
+    "commandText": "select * from products",
+    "databaseName": "olist",
+    "dbUserName": "root",
+    "logTime": "2024-08-15 00:22:34.2930211+00",
+}
+LOGIN = dict(QUERY, **{"class": "LOGIN", "command": "LOGIN", "commandText": ""})
+HEARTBEAT = {"type": "heartbeat"}
+
+
+class StubBody:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+    def iter_chunks(self, chunk_size):
+        stream = io.BytesIO(self._data)
+        yield from iter(lambda: stream.read(chunk_size), b"")
+
+
+class StubPaginator:
+    def __init__(self, s3, page_size=2):
+        self._s3 = s3
+        self._page_size = page_size
+
+    def paginate(self, Bucket, Prefix=""):
+        keys = sorted(key for key in self._s3.bucket(Bucket) if key.startswith(Prefix))
+        for start in range(0, max(len(keys), 1), self._page_size):
+            page = keys[start : start + self._page_size]
+            yield {"Contents": [{"Key": key} for key in page]} if page else {}
+
+
+class StubS3:
+    """
+    Stands in for the S3 client: objects are kept in memory by bucket. Buckets
+    that were not created do not exist.
+    """
+
+    def __init__(self, *buckets):
+        self.buckets = {bucket: {} for bucket in buckets}
+
+    def bucket(self, name, operation="ListObjectsV2"):
+        if name not in self.buckets:
+            raise client_error("NoSuchBucket", operation)
+        return self.buckets[name]
+
+    def put_object(self, Bucket, Key, Body):
+        self.bucket(Bucket, "PutObject")[Key] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        objects = self.bucket(Bucket, "GetObject")
+        if Key not in objects:
+            raise client_error("NoSuchKey", "GetObject")
+        return {"Body": StubBody(objects[Key])}
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return StubPaginator(self)
+
+    def lines(self, Bucket, Key):
+        data = self.buckets[Bucket][Key]
+        if data[:2] == b"\x1f\x8b":
+            data = gzip.decompress(data)
+        return data.splitlines()
+
+
+def decode_packed(data):
+    """
+    Return the record set of an output record in the ``packed`` format.
+    """
+    packed = json.loads(data)
+    return json.loads(
+        zlib.decompress(
+            base64.b64decode(packed["databaseActivityEvents"]), zlib.MAX_WBITS + 16
+        )
+    )
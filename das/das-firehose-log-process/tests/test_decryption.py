@@ -0,0 +1,258 @@
+"""
+Conformance of `decryption` with the AWS Encryption SDK: messages of every
+AES-GCM algorithm suite must decrypt to the same plaintext, and messages the
+SDK rejects must be rejected too.
+"""
+
+import io
+import logging
+import os
+import random
+
+import aws_encryption_sdk
+import pytest
+from aws_encryption_sdk import CommitmentPolicy
+from aws_encryption_sdk.identifiers import Algorithm
+from aws_encryption_sdk.internal.formatting.deserialize import deserialize_header
+
+from selectstar_das_processor import decryption, handler
+
+# Encrypting with non-committing suites needs a client that allows it.
+legacy_client = aws_encryption_sdk.EncryptionSDKClient(
+    commitment_policy=CommitmentPolicy.FORBID_ENCRYPT_ALLOW_DECRYPT
+)
+
+# The SDK logs every failed decryption.
+logging.getLogger("aws_encryption_sdk").setLevel(logging.CRITICAL)
+
+CONTEXTS = [{}, {"aws:rds:dbc-id": "cluster-LOCAL", "purpose": "conformance"}]
+FRAME_LENGTHS = [0, 128, 256, 4096]
+SIZES = [0, 1, 255, 256, 257, 5000]
+
+COMMITTING = Algorithm.AES_256_GCM_HKDF_SHA512_COMMIT_KEY
+NON_COMMITTING = Algorithm.AES_256_GCM_IV12_TAG16_HKDF_SHA256
+SIGNING = [
+    Algorithm.AES_256_GCM_IV12_TAG16_HKDF_SHA384_ECDSA_P384,
+    Algorithm.AES_256_GCM_HKDF_SHA512_COMMIT_KEY_ECDSA_P384,
+]
+FRAME_LENGTH = 128
+PLAINTEXT = bytes(range(256)) + b"x" * 44
+# Size of the frames before the final frame.
+FRAME_SIZE = 4 + decryption.IV_LENGTH + FRAME_LENGTH + decryption.TAG_LENGTH
+
+
+class OtherProvider(handler.MyRawMasterKeyProvider):
+    provider_id = "OTHER"
+
+
+def key_provider(data_key, other_keys=()):
+    """
+    Return a provider wrapping the data key of a message with ``data_key``,
+    after data keys of providers of ``other_keys``.
+    """
+    provider = None
+    for cls, key in [*other_keys, (handler.MyRawMasterKeyProvider, data_key)]:
+        current = cls(key)
+        current.add_master_key("DataKey")
+        if provider is None:
+            provider = current
+        else:
+            provider.add_master_key_provider(current)
+    return provider
+
+
+def encrypt(
+    plaintext, data_key, algorithm, frame_length=FRAME_LENGTH, context=None, others=()
+):
+    client = handler.enc_client if algorithm.is_committing() else legacy_client
+    payload, _header = client.encrypt(
+        source=plaintext,
+        key_provider=key_provider(data_key, others),
+        algorithm=algorithm,
+        frame_length=frame_length,
+        encryption_context=context or {},
+    )
+    return payload
+
+
+def sdk_decrypt(payload, data_key):
+    """
+    Return the plaintext from the SDK, or None if it fails.
+    """
+    try:
+        return handler.enc_client.decrypt(
+            source=payload, materials_manager=handler.get_materials_manager(data_key)
+        )[0]
+    except Exception:
+        return None
+
+
+def direct_decrypt(payload, data_key, chunk_size=256):
+    """
+    Return the plaintext from `decryption`, or None if it fails.
+    """
+    try:
+        return b"".join(decryption.decrypt_stream(payload, data_key, chunk_size))
+    except decryption.DecryptionError:
+        return None
+
+
+def check(payload, data_key):
+    """
+    Check that both engines agree on ``payload`` and return the plaintext.
+    """
+    expected = sdk_decrypt(payload, data_key)
+    assert direct_decrypt(payload, data_key) == expected
+    return expected
+
+
+def header_length(payload):
+    """
+    Return the length of the authenticated header of a message, which is
+    followed by the header IV, of version 1 messages, and its tag.
+    """
+    _header, raw_header = deserialize_header(io.BytesIO(payload))
+    return len(raw_header)
+
+
+def body_offset(payload):
+    iv_length = decryption.IV_LENGTH if payload[0] == 1 else 0
+    return header_length(payload) + iv_length + decryption.TAG_LENGTH
+
+
+def flip(payload, position):
+    corrupted = bytearray(payload)
+    corrupted[position] ^= 1
+    return bytes(corrupted)
+
+
+def assert_rejected(payload, data_key, match):
+    assert sdk_decrypt(payload, data_key) is None
+    with pytest.raises(decryption.DecryptionError, match=match):
+        b"".join(decryption.decrypt_stream(payload, data_key))
+
+
+def test_every_suite_is_supported():
+    assert {algorithm.algorithm_id for algorithm in Algorithm} <= set(decryption.SUITES)
+
+
+@pytest.mark.parametrize("frame_length", FRAME_LENGTHS)
+@pytest.mark.parametrize("algorithm", list(Algorithm), ids=lambda a: a.name)
+def test_messages_decrypt_like_the_sdk(algorithm, frame_length):
+    rnd = random.Random(algorithm.algorithm_id + frame_length)
+    for index, size in enumerate(SIZES):
+        data_key = os.urandom(32)
+        plaintext = rnd.randbytes(size)
+        context = CONTEXTS[index % len(CONTEXTS)]
+        payload = encrypt(plaintext, data_key, algorithm, frame_length, context)
+
+        assert check(payload, data_key) == plaintext
+        assert check(payload, os.urandom(32)) is None
+        # The SDK ignores trailing bytes of messages without signature.
+        check(payload + b"\0", data_key)
+        assert direct_decrypt(os.urandom(32), data_key) is None
+
+
+@pytest.mark.parametrize("algorithm", list(Algorithm), ids=lambda a: a.name)
+def test_data_keys_of_other_providers_are_skipped(algorithm):
+    data_key = os.urandom(32)
+    others = [(OtherProvider, data_key)]
+    payload = encrypt(
+        PLAINTEXT, data_key, algorithm, context=CONTEXTS[1], others=others
+    )
+
+    assert check(payload, data_key) == PLAINTEXT
+
+    # The SDK tries data keys of the same provider in no fixed order, and
+    # fails if the first it tries does not unwrap.
+    others = [(handler.MyRawMasterKeyProvider, os.urandom(32))]
+    payload = encrypt(PLAINTEXT, data_key, algorithm, others=others)
+
+    assert direct_decrypt(payload, data_key) == PLAINTEXT
+
+
+@pytest.mark.parametrize("algorithm", list(Algorithm), ids=lambda a: a.name)
+def test_truncated_and_corrupted_messages_fail_like_the_sdk(algorithm):
+    rnd = random.Random(algorithm.algorithm_id)
+    data_key = os.urandom(32)
+    payload = encrypt(PLAINTEXT, data_key, algorithm, context=CONTEXTS[1])
+
+    for position in range(len(payload)):
+        check(payload[:position], data_key)
+        corrupted = bytearray(payload)
+        corrupted[position] ^= 1 << rnd.randrange(8)
+        check(bytes(corrupted), data_key)
+
+
+@pytest.mark.parametrize("algorithm", [NON_COMMITTING, COMMITTING], ids=str)
+def test_tampered_headers_are_rejected(algorithm):
+    data_key = os.urandom(32)
+    payload = encrypt(PLAINTEXT, data_key, algorithm)
+    # The frame length ends the header, before the commitment of committing
+    # suites.
+    position = header_length(payload) - 1
+    if algorithm.is_committing():
+        position -= decryption.COMMITMENT_LENGTH
+
+    assert_rejected(flip(payload, position), data_key, "Header authentication")
+
+
+@pytest.mark.parametrize("algorithm", [NON_COMMITTING, COMMITTING], ids=str)
+def test_tampered_frames_are_rejected(algorithm):
+    data_key = os.urandom(32)
+    payload = encrypt(PLAINTEXT, data_key, algorithm)
+    # A byte of the ciphertext of the second frame.
+    position = body_offset(payload) + FRAME_SIZE + 4 + decryption.IV_LENGTH
+
+    assert_rejected(flip(payload, position), data_key, "Body authentication")
+
+
+@pytest.mark.parametrize("renumber", [False, True])
+@pytest.mark.parametrize("algorithm", [NON_COMMITTING, COMMITTING], ids=str)
+def test_reordered_frames_are_rejected(algorithm, renumber):
+    data_key = os.urandom(32)
+    payload = encrypt(PLAINTEXT, data_key, algorithm)
+    start = body_offset(payload)
+    first = payload[start : start + FRAME_SIZE]
+    second = payload[start + FRAME_SIZE : start + 2 * FRAME_SIZE]
+    if renumber:
+        # Swapped frames keeping their sequence numbers in order, which are
+        # authenticated with the frames.
+        first, second = second[:4] + first[4:], first[:4] + second[4:]
+    reordered = payload[:start] + second + first + payload[start + 2 * FRAME_SIZE :]
+
+    assert_rejected(
+        reordered,
+        data_key,
+        "Body authentication" if renumber else "Frames out of order",
+    )
+
+
+@pytest.mark.parametrize("algorithm", SIGNING, ids=str)
+def test_bad_signatures_are_rejected(algorithm):
+    data_key = os.urandom(32)
+    payload = encrypt(PLAINTEXT, data_key, algorithm)
+
+    assert direct_decrypt(payload, data_key) == PLAINTEXT
+    assert_rejected(flip(payload, len(payload) - 1), data_key, "Signature")
+    # The signature of another message, signed with another key.
+    other = encrypt(PLAINTEXT, data_key, algorithm)
+    final_length = len(PLAINTEXT) % FRAME_LENGTH
+    footer = (
+        body_offset(payload)
+        + len(PLAINTEXT) // FRAME_LENGTH * FRAME_SIZE
+        + 8
+        + decryption.IV_LENGTH
+        + 4
+        + final_length
+        + decryption.TAG_LENGTH
+    )
+    assert_rejected(payload[:footer] + other[footer:], data_key, "Signature")
+
+
+def test_commitment_mismatches_are_rejected():
+    data_key = os.urandom(32)
+    payload = encrypt(PLAINTEXT, data_key, COMMITTING)
+    position = header_length(payload) - decryption.COMMITMENT_LENGTH
+
+    assert_rejected(flip(payload, position), data_key, "Key commitment")
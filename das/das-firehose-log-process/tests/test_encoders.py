@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+from selectstar_das_processor.encoders import (
+    ColumnarEncoder,
+    NdjsonEncoder,
+    read_columnar,
+)
+from selectstar_das_processor.pipeline import EVENT_LIST
+
+
+def encode(encoder_class, record_set):
+    """
+    Feed a record set to an encoder the way `filter_record_set` does, with the
+    fields and events as raw JSON text.
+    """
+    encoder = encoder_class()
+    for key, value in record_set.items():
+        if key != EVENT_LIST:
+            encoder.field(key, json.dumps(value))
+    for event in record_set[EVENT_LIST]:
+        encoder.event(json.dumps(event), event)
+    return encoder.finish()
+
+
+RECORD_SETS = {
+    "empty": {"type": "DatabaseActivityMonitoringRecords", EVENT_LIST: []},
+    "no fields": {EVENT_LIST: [{"class": "SERVER", "command": "SELECT"}]},
+    "uniform": {
+        "type": "DatabaseActivityMonitoringRecords",
+        "clusterId": "cluster-ABC",
+        "instanceId": "db-ABC",
+        EVENT_LIST: [
+            {
+                "class": "SERVER",
+                "serverHost": "10.0.0.1",
+                "dbUserName": "admin",
+                "command": "SELECT",
+                "commandText": f"select {i}",
+                "rowCount": i,
+            }
+            for i in range(5)
+        ],
+    },
+    "mixed schema": {
+        "type": "DatabaseActivityMonitoringRecords",
+        "clusterId": "",
+        EVENT_LIST: [
+            {"type": "heartbeat"},
+            {"class": "SERVER", "command": "SELECT", "exitCode": 0},
+            {"class": "SERVER", "command": "LOGIN", "paramList": ["a", 1, None]},
+            {"type": "heartbeat", "extra": {"nested": {"b": 2, "a": [1]}}},
+            {"class": "SERVER", "exitCode": None, "netProtocol": "TCP"},
+            {},
+            {"flag": True, "count": 1, "ratio": 1.0, "name": "1"},
+            {"flag": 1, "count": True, "ratio": 1, "name": 1},
+            {"paramList": [], "extra": {}},
+        ],
+    },
+}
+
+
+@pytest.mark.parametrize("name", RECORD_SETS)
+def test_columnar_round_trip(name):
+    record_set = RECORD_SETS[name]
+    data = encode(ColumnarEncoder, record_set)
+
+    decoded = read_columnar(data)
+
+    assert decoded == record_set
+    # Values that are equal in Python but not in JSON keep their types.
+    for event, expected in zip(decoded[EVENT_LIST], record_set[EVENT_LIST]):
+        assert [type(value) for value in event.values()] == [
+            type(expected[key]) for key in event
+        ]
+
+
+def test_columnar_stores_repeated_values_once():
+    data = encode(ColumnarEncoder, RECORD_SETS["uniform"])
+
+    columns = json.loads(data)["columns"]
+
+    assert columns["serverHost"] == {"values": ["10.0.0.1"], "indices": [0] * 5}
+    assert columns["rowCount"]["values"] == list(range(5))
+
+
+def test_columnar_marks_missing_fields():
+    data = encode(ColumnarEncoder, RECORD_SETS["mixed schema"])
+
+    columns = json.loads(data)["columns"]
+
+    assert columns["type"]["indices"] == [0, -1, -1, 0, -1, -1, -1, -1, -1]
+    assert columns["paramList"]["indices"] == [-1, -1, 0, -1, -1, -1, -1, -1, 1]
+
+
+def test_read_columnar_rejects_other_formats():
+    with pytest.raises(ValueError):
+        read_columnar(b'{"format": "das-columnar-0", "count": 0, "columns": {}}')
+
+
+@pytest.mark.parametrize("name", RECORD_SETS)
+def test_ndjson_lines_hold_the_fields_and_an_event(name):
+    record_set = RECORD_SETS[name]
+    fields = {
+        key: value
+        for key, value in record_set.items()
+        if key not in ("type", EVENT_LIST)
+    }
+
+    data = encode(NdjsonEncoder, record_set)
+
+    lines = [json.loads(line) for line in data.splitlines()]
+    assert lines == [dict(fields, **event) for event in record_set[EVENT_LIST]]
+    assert [list(line)[: len(fields)] for line in lines] == [list(fields)] * len(lines)
+
+
+def test_ndjson_keeps_the_raw_json_of_the_events():
+    encoder = NdjsonEncoder()
+    encoder.field("type", '"DatabaseActivityMonitoringRecords"')
+    encoder.field("clusterId", '"cluster-ABC"')
+    for raw_event in ["{ }", '{"rowCount":1.50,"text":"\\u00e9"}']:
+        encoder.event(raw_event)
+
+    assert encoder.finish().split(b"\n") == [
+        b'{"clusterId": "cluster-ABC"}',
+        b'{"clusterId": "cluster-ABC", "rowCount":1.50,"text":"\\u00e9"}',
+    ]
+    assert encoder.bytes_in == len(encoder.finish()) + 1
@@ -0,0 +1,175 @@
+import pytest
+
+from selectstar_das_processor.fingerprint import (
+    CommandTextDeduplicator,
+    fingerprint,
+    normalize,
+)
+
+TEXT = "select * from products where id = 1"
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        (
+            "SELECT *  FROM t1 WHERE id = 42 AND name = 'O''Brien'",
+            "select*from t1 where id=? and name=?",
+        ),
+        ("select * from t where id in (1, 2, 3)", "select*from t where id in(?+)"),
+        ("select * from t where id IN ($1,$2)", "select*from t where id in(?+)"),
+        (
+            "insert into t (a, b) values (1, 'x'), (2, 'y'), (3, null)",
+            "insert into t(a,b)values(?,?)",
+        ),
+        (
+            "/* app */ select a -- trailing\nfrom t where x = -1.5e3",
+            "select a from t where x=?",
+        ),
+        ("select $$it's$$, $q$body$q$ from t", "select ?,? from t"),
+        (
+            "select * from t where a = :a and b = @b and c = ?",
+            "select*from t where a=? and b=? and c=?",
+        ),
+        (
+            "update t set flag = TRUE where col_2 = 0x1F",
+            "update t set flag=? where col_2=?",
+        ),
+        ("select x.1 from t where s = e'\\n'", "select x.1 from t where s=?"),
+    ],
+)
+def test_statements_are_reduced_to_their_shape(sql, expected):
+    assert normalize(sql) == expected
+
+
+def test_statements_differing_in_literals_share_a_fingerprint():
+    assert fingerprint("SELECT * FROM t WHERE id IN (1, 2)") == fingerprint(
+        "select *\nfrom t where id in (3,4,5)"
+    )
+    assert fingerprint("select * from t1") != fingerprint("select * from t2")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def apply(dedup, *texts):
+    """
+    Apply the deduplicator to the events of a record with ``texts``, and commit
+    the record. Returns the events.
+    """
+    events = [{"commandText": text} for text in texts]
+    emitted = set()
+    for event in events:
+        dedup.apply(event, emitted)
+    dedup.commit(emitted)
+    return events
+
+
+def test_texts_are_dropped_within_a_record_and_in_later_batches():
+    dedup = CommandTextDeduplicator(clock=Clock())
+    dedup.start_batch()
+
+    first, repeat = apply(dedup, TEXT, TEXT)
+
+    assert first["commandText"] == TEXT
+    assert "commandText" not in repeat
+    assert repeat["commandTextId"] == first["commandTextId"]
+    assert repeat["commandFingerprint"] == fingerprint(TEXT)
+    # Records of the same batch may be delivered before the first one.
+    assert apply(dedup, TEXT)[0]["commandText"] == TEXT
+
+    dedup.start_batch()
+
+    (event,) = apply(dedup, TEXT)
+    assert "commandText" not in event
+    assert dedup.stats() == {
+        "size": 1,
+        "emitted": 2,
+        "deduplicated": 2,
+        "bytes_saved": 2 * len(TEXT),
+    }
+
+
+def test_texts_are_emitted_again_after_an_undelivered_batch():
+    dedup = CommandTextDeduplicator(clock=Clock())
+    dedup.start_batch()
+    apply(dedup, TEXT)
+    dedup.start_batch()
+    dedup.invalidate()
+    dedup.start_batch()
+
+    assert apply(dedup, TEXT)[0]["commandText"] == TEXT
+
+    dedup.start_batch()
+
+    assert "commandText" not in apply(dedup, TEXT)[0]
+
+
+def test_worker_processes_follow_the_batch_of_the_parent():
+    parent = CommandTextDeduplicator(clock=Clock())
+    worker = CommandTextDeduplicator(clock=Clock())
+    parent.start_batch()
+    worker.join_batch((parent.batch, parent.valid_from))
+    apply(worker, TEXT)
+    parent.start_batch()
+    worker.join_batch((parent.batch, parent.valid_from))
+
+    assert "commandText" not in apply(worker, TEXT)[0]
+
+
+def test_texts_are_refreshed_by_count_and_time():
+    clock = Clock()
+    dedup = CommandTextDeduplicator(refresh_count=2, refresh_seconds=60, clock=clock)
+    dedup.start_batch()
+    apply(dedup, TEXT)
+    dedup.start_batch()
+
+    kept = [
+        "commandText" in event
+        for event in apply(dedup, TEXT) + apply(dedup, TEXT) + apply(dedup, TEXT)
+    ]
+
+    assert kept == [False, False, True]
+
+    dedup.start_batch()
+    clock.now = 60
+
+    assert "commandText" in apply(dedup, TEXT)[0]
+
+
+def test_short_and_missing_texts_are_left_in_place():
+    dedup = CommandTextDeduplicator(min_length=32, clock=Clock())
+    dedup.start_batch()
+    emitted = set()
+    short = {"commandText": "select 1"}
+    missing = {"commandText": None}
+
+    assert dedup.apply(short, emitted)
+    assert not dedup.apply(missing, emitted)
+
+    assert short == {
+        "commandText": "select 1",
+        "commandFingerprint": fingerprint("select 1"),
+    }
+    assert missing == {"commandText": None}
+    assert emitted == set()
+
+
+def test_least_recently_emitted_texts_are_forgotten():
+    dedup = CommandTextDeduplicator(max_size=2, clock=Clock())
+    texts = [f"{TEXT} and name = '{index}'" for index in range(3)]
+    dedup.start_batch()
+    for text in texts:
+        apply(dedup, text)
+    dedup.start_batch()
+
+    assert ["commandText" in event for event in apply(dedup, *texts)] == [
+        True,
+        False,
+        False,
+    ]
@@ -0,0 +1,116 @@
+import base64
+import json
+
+import pytest
+
+from selectstar_das_processor import handler
+from selectstar_das_processor.executors import WorkerError
+from selectstar_das_processor.outcomes import MALFORMED_RECORD, WORKER_FAILED
+from selectstar_das_processor.scheduling import Deadline
+from tests.stubs import HEARTBEAT, LOGIN, QUERY, decode_packed
+
+
+class FailingPool:
+    """
+    Stands in for a `PipePool` whose workers fail after ``dispatched`` records
+    were handed to them.
+    """
+
+    def __init__(self, dispatched):
+        self.dispatched = dispatched
+
+    def starmap(self, iterable, deadline=None):
+        for _ in zip(range(self.dispatched), iterable):
+            pass
+        raise WorkerError("Worker process exited unexpectedly")
+
+
+def test_records_fail_with_the_worker_pool(kms, record_data, monkeypatch, capsys):
+    monkeypatch.setattr(handler, "WORKER_PROCESSES", 2)
+    monkeypatch.setattr(handler, "WORKER_THREADS", 1)
+    monkeypatch.setattr(handler, "get_process_pool", lambda: FailingPool(1))
+    records = [
+        {"recordId": str(index), "data": record_data([QUERY])} for index in range(3)
+    ]
+
+    source = handler.source_resolver.default
+
+    results = handler.process_batch(records, Deadline(), source)
+
+    assert [reason for _, reason, _stats in results] == [WORKER_FAILED] * 3
+    assert [output["result"] for output, _, _stats in results] == [
+        "ProcessingFailed"
+    ] * 3
+    assert "Worker pool failed for 3 records" in capsys.readouterr().out
+
+
+def test_ndjson_records_are_trimmed_to_fit(kms, record_data, monkeypatch):
+    monkeypatch.setattr(handler, "OUTPUT_FORMAT", "ndjson")
+    monkeypatch.setattr(handler, "WORKER_PROCESSES", 1)
+    long_query = dict(QUERY, commandText="x" * 20000)
+    event = {
+        "records": [
+            {"recordId": "1", "data": record_data([QUERY, HEARTBEAT, LOGIN, QUERY])},
+            {"recordId": "2", "data": record_data([long_query])},
+        ]
+    }
+    monkeypatch.setattr(handler, "MAX_RESPONSE", 20000)
+
+    first, second = handler.lambda_handler(event, None)["records"]
+
+    fields = {"clusterId": "cluster-LOCAL", "instanceId": "db-LOCAL"}
+    lines = base64.b64decode(first["data"]).splitlines()
+    assert [json.loads(line) for line in lines] == [dict(fields, **QUERY)] * 2
+    (line,) = base64.b64decode(second["data"]).splitlines()
+    trimmed = dict(long_query, commandText="x" * handler.TRIM_COMMAND_TEXT)
+    assert json.loads(line) == dict(fields, **trimmed, truncatedFields=["commandText"])
+
+
+@pytest.mark.parametrize(
+    "threads, processes", [(1, 1), (4, 1), (1, 2), (4, 2)], ids=str
+)
+def test_records_are_processed_concurrently_in_order(
+    kms, record_data, monkeypatch, threads, processes
+):
+    monkeypatch.setattr(handler, "WORKER_THREADS", threads)
+    monkeypatch.setattr(handler, "WORKER_PROCESSES", processes)
+    # Started with the settings and stubs of this test.
+    monkeypatch.setattr(handler, "_executor", None)
+    monkeypatch.setattr(handler, "_process_pool", None)
+    events = [
+        [dict(QUERY, commandText=f"select {index}"), HEARTBEAT] for index in range(8)
+    ]
+    events[5] = [LOGIN]
+    records = [
+        {"recordId": str(index), "data": record_data(record_events, key=index % 2)}
+        for index, record_events in enumerate(events)
+    ]
+    records[3]["data"] = base64.b64encode(b"garbage").decode()
+    source = handler.source_resolver.default
+
+    try:
+        results = handler.process_batch(records, Deadline(), source)
+    finally:
+        if handler._process_pool is not None:
+            handler._process_pool.close()
+        if handler._executor is not None:
+            handler._executor.shutdown()
+
+    assert [output["recordId"] for output, _, _stats in results] == [
+        record["recordId"] for record in records
+    ]
+    assert [(output["result"], reason) for output, reason, _stats in results] == [
+        ("Ok", None),
+        ("Ok", None),
+        ("Ok", None),
+        ("ProcessingFailed", MALFORMED_RECORD),
+        ("Ok", None),
+        ("Dropped", None),
+        ("Ok", None),
+        ("Ok", None),
+    ]
+    for index in (0, 1, 2, 4, 6, 7):
+        record_set = decode_packed(base64.b64decode(results[index][0]["data"]))
+        assert record_set["databaseActivityEventList"] == events[index][:1]
+    # One call per data key, however many records use it at once.
+    assert kms.calls == 2
@@ -0,0 +1,134 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from selectstar_das_processor.keycache import DataKeyCache
+
+CONTEXT = {"aws:rds:dbc-id": "cluster-ABC", "purpose": "das"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keys_are_found_by_ciphertext_and_encryption_context():
+    cache = DataKeyCache(clock=Clock())
+    cache.put(b"wrapped", CONTEXT, b"plain")
+
+    assert cache.get(b"wrapped", dict(reversed(CONTEXT.items()))) == b"plain"
+    assert cache.get(b"wrapped", {"aws:rds:dbc-id": "cluster-ABC"}) is None
+    assert cache.get(b"other", CONTEXT) is None
+    assert cache.stats() == {
+        "size": 1,
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+        "hit_rate": 1 / 3,
+    }
+
+
+def test_keys_expire_after_the_ttl():
+    clock = Clock()
+    cache = DataKeyCache(ttl=300, clock=clock)
+    cache.put(b"wrapped", CONTEXT, b"plain")
+    clock.now = 299.9
+
+    assert cache.get(b"wrapped", CONTEXT) == b"plain"
+
+    clock.now = 300
+
+    assert cache.get(b"wrapped", CONTEXT) is None
+    assert len(cache) == 0
+    assert cache.stats()["evictions"] == 1
+
+
+def test_least_recently_used_keys_are_evicted():
+    cache = DataKeyCache(max_size=2, clock=Clock())
+    cache.put(b"1", CONTEXT, b"plain 1")
+    cache.put(b"2", CONTEXT, b"plain 2")
+    cache.get(b"1", CONTEXT)
+    cache.put(b"3", CONTEXT, b"plain 3")
+
+    assert [cache.get(key, CONTEXT) for key in (b"1", b"2", b"3")] == [
+        b"plain 1",
+        None,
+        b"plain 3",
+    ]
+
+    disabled = DataKeyCache(max_size=0, clock=Clock())
+    disabled.put(b"1", CONTEXT, b"plain 1")
+
+    assert disabled.get(b"1", CONTEXT) is None
+
+
+def test_concurrent_misses_decrypt_once():
+    cache = DataKeyCache(clock=Clock())
+    calls = []
+    release = threading.Event()
+
+    def decrypt():
+        calls.append(1)
+        assert release.wait(5)
+        return b"plain"
+
+    def get(_):
+        return cache.get_or_decrypt(b"wrapped", CONTEXT, decrypt)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = executor.map(get, range(8))
+        release.set()
+        results = list(results)
+
+    assert results == [b"plain"] * 8
+    assert calls == [1]
+    assert cache.stats()["misses"] == 1
+
+
+def test_failed_decryptions_are_not_cached():
+    cache = DataKeyCache(clock=Clock())
+
+    def fail():
+        raise RuntimeError("throttled")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_decrypt(b"wrapped", CONTEXT, fail)
+
+    assert cache.get_or_decrypt(b"wrapped", CONTEXT, lambda: b"plain") == b"plain"
+    assert cache.get_or_decrypt(b"wrapped", CONTEXT, fail) == b"plain"
+
+
+def test_derived_objects_are_kept_with_their_key():
+    clock = Clock()
+    cache = DataKeyCache(max_size=1, ttl=300, clock=clock)
+    built = []
+
+    def build(plaintext):
+        built.append(plaintext)
+        return object()
+
+    cache.put(b"1", CONTEXT, b"plain 1")
+    first = cache.derive(b"plain 1", "cipher", build)
+
+    assert cache.derive(b"plain 1", "cipher", build) is first
+    assert cache.derive(b"plain 1", "manager", build) is not first
+    # Keys that are not cached get a new object on every call.
+    assert cache.derive(b"plain 2", "cipher", build) is not cache.derive(
+        b"plain 2", "cipher", build
+    )
+
+    clock.now = 300
+
+    assert cache.derive(b"plain 1", "cipher", build) is not first
+
+    cache.put(b"1", CONTEXT, b"plain 1")
+    renewed = cache.derive(b"plain 1", "cipher", build)
+    cache.put(b"2", CONTEXT, b"plain 2")
+    cache.put(b"1", CONTEXT, b"plain 1")
+
+    assert cache.derive(b"plain 1", "cipher", build) is not renewed
+    assert len(built) == 7
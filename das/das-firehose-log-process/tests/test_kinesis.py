@@ -0,0 +1,127 @@
+import base64
+import json
+
+import pytest
+
+from selectstar_das_processor import handler, kinesis
+from tests.stubs import HEARTBEAT, LOGIN, QUERY, StubS3, decode_packed
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    stub = StubS3("output")
+    monkeypatch.setattr(kinesis, "s3", stub)
+    monkeypatch.setattr(kinesis, "OUTPUT_BUCKET", "output")
+    return stub
+
+
+def kinesis_event(data):
+    return {
+        "Records": [
+            {
+                "eventID": f"shardId-000000000001:{index + 1000:020}",
+                "eventSourceARN": None,
+                "kinesis": {
+                    "data": record_data,
+                    "sequenceNumber": f"{index + 1000:020}",
+                    "partitionKey": "partition",
+                    "approximateArrivalTimestamp": 1723680000.5 + index,
+                },
+            }
+            for index, record_data in enumerate(data)
+        ]
+    }
+
+
+def failures(output):
+    return [
+        int(failure["itemIdentifier"]) - 1000 for failure in output["batchItemFailures"]
+    ]
+
+
+def test_writes_kept_record_sets_as_one_object(kms, s3, record_data):
+    data = [
+        record_data([QUERY, HEARTBEAT, dict(QUERY, commandText=f"select {i}")])
+        for i in range(3)
+    ]
+    data.insert(1, record_data([HEARTBEAT, LOGIN]))
+
+    output = kinesis.lambda_handler(kinesis_event(data), None)
+
+    assert output == {"batchItemFailures": []}
+    assert list(s3.buckets["output"]) == [
+        "processed/2024/08/15/00/shardId-000000000001-"
+        "00000000000000001000-00000000000000001003"
+    ]
+    (key,) = s3.buckets["output"]
+    record_sets = [decode_packed(line) for line in s3.lines("output", key)]
+    assert [record_set["databaseActivityEventList"] for record_set in record_sets] == [
+        [QUERY, dict(QUERY, commandText=f"select {i}")] for i in range(3)
+    ]
+    # Consecutive records share their data key.
+    assert kms.calls == 1
+
+
+def test_permanent_failures_go_to_the_error_output(kms, s3, record_data):
+    data = [
+        record_data([QUERY]),
+        base64.b64encode(b"garbage").decode(),
+        record_data([QUERY]),
+    ]
+
+    output = kinesis.lambda_handler(kinesis_event(data), None)
+
+    assert output == {"batchItemFailures": []}
+    keys = sorted(s3.buckets["output"])
+    assert [key.split("/")[0] for key in keys] == ["processed", "processing-failed"]
+    assert len(s3.lines("output", keys[0])) == 2
+    (error,) = [json.loads(line) for line in s3.lines("output", keys[1])]
+    assert error["errorCode"] == "MalformedRecord"
+    assert error["rawData"] == data[1]
+    assert error["sequenceNumber"] == f"{1001:020}"
+
+
+def test_transient_failures_are_retried(kms, s3, record_data):
+    data = [record_data([QUERY], key=0), record_data([QUERY], key=1)]
+    kms.throttled[record_data.wrapped(1)] = handler.RECORD_RETRIES
+
+    output = kinesis.lambda_handler(kinesis_event(data), None)
+
+    assert output == {"batchItemFailures": []}
+    (key,) = s3.buckets["output"]
+    assert len(s3.lines("output", key)) == 2
+
+
+def test_records_from_the_first_transient_failure_are_reported(kms, s3, record_data):
+    data = [
+        record_data([QUERY], key=0),
+        record_data([QUERY], key=0),
+        record_data([QUERY], key=1),
+        record_data([QUERY], key=0),
+        base64.b64encode(b"garbage").decode(),
+    ]
+    kms.throttled[record_data.wrapped(1)] = handler.RECORD_RETRIES + 1
+
+    output = kinesis.lambda_handler(kinesis_event(data), None)
+
+    assert failures(output) == [2, 3, 4]
+    # Only the records before the failure are written; the later ones are
+    # processed again with it.
+    assert list(s3.buckets["output"]) == [
+        "processed/2024/08/15/00/shardId-000000000001-"
+        "00000000000000001000-00000000000000001001"
+    ]
+
+
+def test_failed_writes_report_the_whole_batch(kms, s3, record_data, monkeypatch):
+    monkeypatch.setattr(kinesis, "OUTPUT_BUCKET", "missing")
+    data = [record_data([QUERY]) for _ in range(3)]
+
+    output = kinesis.lambda_handler(kinesis_event(data), None)
+
+    assert failures(output) == [0, 1, 2]
+
+
+def test_empty_batches_write_nothing(kms, s3):
+    assert kinesis.lambda_handler({"Records": []}, None) == {"batchItemFailures": []}
+    assert s3.buckets["output"] == {}
@@ -0,0 +1,104 @@
+import json
+
+from selectstar_das_processor import handler, metrics
+from selectstar_das_processor.metrics import STAGES, BatchMetrics, RecordStats
+from tests.stubs import HEARTBEAT, LOGIN, QUERY
+
+DIMENSIONS = {"ResourceId": "cluster-LOCAL"}
+
+
+def check_document(document):
+    """
+    Check that an EMF document declares every metric it holds, and return its
+    metrics as ``{name: (value, unit)}``.
+    """
+    (directive,) = document["_aws"]["CloudWatchMetrics"]
+    (dimensions,) = directive["Dimensions"]
+    assert all(isinstance(document[name], str) for name in dimensions)
+    values = {}
+    for metric in directive["Metrics"]:
+        value = document[metric["Name"]]
+        assert isinstance(value, (int, float))
+        values[metric["Name"]] = (value, metric["Unit"])
+    return values
+
+
+def test_stage_times_and_counts_are_merged():
+    stats = RecordStats()
+    assert list(stats.timed(iter("ab"), "decrypt")) == ["a", "b"]
+    other = RecordStats()
+    other.seconds["decrypt"] = 1.0
+    other.bytes_in = 10
+    other.events_kept = 2
+    other.events[("SQLSERVER", "SELECT")] = 2
+    other.suppressed = (3,)
+
+    stats.merge(other)
+    stats.merge(other)
+
+    assert 2.0 < stats.seconds["decrypt"] < 2.1
+    assert stats.bytes_in == 20
+    assert stats.events_kept == 4
+    assert stats.events == {("SQLSERVER", "SELECT"): 4}
+    assert stats.suppressed == ()
+
+
+def test_documents_hold_the_totals_and_the_events_by_command(monkeypatch):
+    monkeypatch.setattr(metrics, "_clock", lambda: 0.0)
+    lines = []
+    batch = BatchMetrics("SelectStar/DAS", DIMENSIONS, sink=lines.append)
+    stats = RecordStats()
+    stats.seconds["filter"] = 0.25
+    stats.events_received = 3
+    stats.events[("SQLSERVER", "SELECT")] = 2
+    stats.events[("SQLSERVER", None)] = 1
+    batch.add(stats)
+    batch.add(None)
+    batch.put("RecordsOk", 1)
+
+    batch.emit()
+
+    totals, *by_command = map(json.loads, lines)
+    values = check_document(totals)
+    assert totals["ResourceId"] == "cluster-LOCAL"
+    assert values["FilterTime"] == (250.0, "Milliseconds")
+    assert values["BatchTime"] == (0.0, "Milliseconds")
+    assert values["EventsReceived"] == (3, "Count")
+    assert values["RecordsOk"] == (1, "Count")
+    assert {f"{stage.capitalize()}Time" for stage in STAGES} <= set(values)
+    assert [
+        (document["ServerType"], document["Command"], check_document(document))
+        for document in by_command
+    ] == [
+        ("SQLSERVER", "SELECT", {"Events": (2, "Count")}),
+        ("SQLSERVER", "None", {"Events": (1, "Count")}),
+    ]
+
+
+def test_batches_emit_their_metrics(kms, record_data, monkeypatch, capsys):
+    monkeypatch.setattr(handler, "METRICS", True)
+    monkeypatch.setattr(handler, "WORKER_PROCESSES", 1)
+    event = {
+        "records": [
+            {"recordId": "1", "data": record_data([QUERY, HEARTBEAT, QUERY, LOGIN])},
+            {"recordId": "2", "data": record_data([LOGIN])},
+        ]
+    }
+
+    handler.lambda_handler(event, None)
+
+    documents = [
+        json.loads(line)
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith('{"_aws"')
+    ]
+    totals, by_command = documents
+    values = check_document(totals)
+    assert values["RecordsOk"][0] == 1
+    assert values["RecordsDropped"][0] == 1
+    assert values["EventsKept"][0] == 2
+    assert values["DataKeyCacheMisses"][0] == 1
+    assert values["DataKeyCacheHits"][0] == 1
+    assert values["ResponseBytes"][1] == "Bytes"
+    assert check_document(by_command) == {"Events": (2, "Count")}
+    assert (by_command["ServerType"], by_command["Command"]) == ("SQLSERVER", "SELECT")
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from selectstar_das_processor import partitioning
+from selectstar_das_processor.partitioning import (
+    MULTIPLE,
+    UNKNOWN,
+    partition_keys,
+    partition_value,
+)
+from tests.stubs import QUERY
+
+FIELDS = {"clusterId": "cluster-ABC", "instanceId": "db-ABC"}
+
+
+def test_keys_are_taken_from_the_record_set_and_its_first_event():
+    assert partition_keys(FIELDS, QUERY, "olist") == {
+        "resourceId": "cluster-ABC",
+        "serverType": "sqlserver",
+        "database": "olist",
+        "eventDate": "2024-08-15",
+        "eventHour": "00",
+    }
+
+
+@pytest.mark.parametrize(
+    "fields, resource_id, expected",
+    [
+        ({"clusterId": "", "instanceId": "db-ABC"}, "cluster-X", "db-ABC"),
+        ({}, "cluster-X", "cluster-X"),
+        ({}, None, UNKNOWN),
+    ],
+)
+def test_resource_ids_fall_back_to_the_instance_and_the_source(
+    fields, resource_id, expected
+):
+    keys = partition_keys(fields, QUERY, "olist", resource_id)
+
+    assert keys["resourceId"] == expected
+
+
+def test_events_without_a_log_time_fall_in_the_current_hour(monkeypatch):
+    gmtime = time.gmtime
+    monkeypatch.setattr(
+        partitioning.time, "gmtime", lambda secs=3600 * 25: gmtime(secs)
+    )
+
+    keys = partition_keys(FIELDS, dict(QUERY, logTime=None), MULTIPLE)
+
+    assert (keys["eventDate"], keys["eventHour"]) == ("1970-01-02", "01")
+    assert keys["database"] == MULTIPLE
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("olist", "olist"),
+        ("my db/../x", "my_db_.._x"),
+        ("Café-1", "Caf_-1"),
+        (42, "42"),
+        ("", UNKNOWN),
+        (None, UNKNOWN),
+    ],
+)
+def test_values_are_made_safe_for_s3_prefixes(value, expected):
+    assert partition_value(value) == expected
@@ -0,0 +1,47 @@
+import pytest
+
+from selectstar_das_processor.pipeline import EVENT_LIST, ParseError, RecordSetReader
+
+
+def read(*chunks):
+    return list(RecordSetReader(chunks))
+
+
+def test_reads_fields_and_events_across_chunks():
+    entries = read(b'{"type": "T", "databaseActivityEventList": [{"a"', b": 1}, 2]}")
+
+    assert entries == [
+        ("type", "T", '"T"'),
+        (EVENT_LIST, {"a": 1}, '{"a": 1}'),
+        (EVENT_LIST, 2, "2"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        [b""],
+        [b"[]"],
+        [b'{"type": "T"'],
+        [b'{"type" "T"}'],
+        [b'{"type": tru}'],
+        [b'{"\\x": 1}'],
+        [b'{"databaseActivityEventList": [{"a": 1} {"b": 2}]}'],
+        [b'{"type": "\xe9"}'],
+        [b'{"type": "\xc3', b'"}'],
+    ],
+)
+def test_malformed_record_sets_raise_parse_errors(chunks):
+    with pytest.raises(ParseError):
+        read(*chunks)
+
+
+def test_errors_of_the_chunks_are_passed_on():
+    def chunks():
+        yield b'{"type": '
+        raise ValueError("from upstream")
+
+    with pytest.raises(ValueError, match="from upstream") as raised:
+        list(RecordSetReader(chunks()))
+
+    assert not isinstance(raised.value, ParseError)
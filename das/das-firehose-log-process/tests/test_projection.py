@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from selectstar_das_processor.projection import dumps, load_projection
+from selectstar_das_processor.sizing import TRUNCATED
+from tests.stubs import QUERY
+
+EVENT = dict(
+    QUERY,
+    commandText="select * from products where name = 'café'",
+    paramList=["1", "2", "3"],
+    remotePort="52636",
+    endTime=None,
+)
+
+
+def project(projection, event=EVENT):
+    """
+    Return a projected copy of an event and the bytes it saved, checked
+    against its JSON.
+    """
+    event = dict(event)
+    before = len(dumps(event).encode("utf-8"))
+    saved = projection.apply(event)
+    if saved is not None:
+        assert saved == before - len(dumps(event).encode("utf-8"))
+    return event, saved
+
+
+def test_fields_are_excluded_shortened_and_dropped_if_null():
+    projection = load_projection(
+        json.dumps(
+            {
+                "exclude": ["remotePort", "pid"],
+                "maxLengths": {"commandText": 13, "paramList": 1, "logTime": 100},
+                "dropNulls": True,
+            }
+        )
+    )
+
+    event, saved = project(projection)
+
+    assert saved > 0
+    assert event == dict(
+        QUERY,
+        commandText="select * from",
+        paramList=["1"],
+        **{TRUNCATED: ["commandText", "paramList"]},
+    )
+
+
+def test_only_included_fields_are_kept():
+    projection = load_projection(json.dumps({"include": ["type", "commandText"]}))
+
+    event, _saved = project(projection)
+
+    assert event == {"type": "record", "commandText": EVENT["commandText"]}
+
+
+def test_unchanged_events_save_nothing():
+    projection = load_projection(json.dumps({"exclude": ["pid"], "dropNulls": True}))
+
+    assert project(projection, QUERY) == (QUERY, None)
+
+
+def test_projections_are_read_from_files(tmp_path):
+    path = tmp_path / "projection.json"
+    path.write_text(json.dumps({"exclude": ["remotePort"]}))
+
+    assert load_projection() is None
+    assert load_projection(path=str(path)).exclude == {"remotePort"}
+
+
+@pytest.mark.parametrize(
+    "config, match",
+    [
+        ({"include": ["type"], "exclude": ["pid"]}, "Only one of include and exclude"),
+        ({"maxLengths": {"commandText": -1}}, "Invalid max. length of commandText"),
+        ({"maxLengths": {"commandText": "10"}}, "Invalid max. length of commandText"),
+        ({"exlude": ["pid"]}, "Unknown event projection settings"),
+        (["pid"], "must be a JSON object"),
+    ],
+)
+def test_invalid_projections_are_rejected(config, match):
+    with pytest.raises(ValueError, match=match):
+        load_projection(json.dumps(config))
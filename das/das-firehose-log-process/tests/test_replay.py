@@ -0,0 +1,215 @@
+import base64
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from selectstar_das_processor import handler, replay
+from selectstar_das_processor.sources import Source
+from tests.stubs import HEARTBEAT, LOGIN, QUERY, StubS3, decode_packed
+
+PARTITION = (
+    "resource_id=cluster-LOCAL/server_type=sqlserver/database={}/"
+    "date=2024-08-15/hour=00/"
+)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    stub = StubS3("archive", "replayed")
+    monkeypatch.setattr(replay, "s3", stub)
+    # Restored after the test, as the replay turns partitioning on.
+    monkeypatch.setattr(handler, "PARTITION_KEYS", handler.PARTITION_KEYS)
+    return stub
+
+
+@pytest.fixture
+def source(kms):
+    return handler.source_resolver.default
+
+
+def archived(data):
+    """
+    Return a record as archived by a Firehose source record backup.
+    """
+    return base64.b64decode(data)
+
+
+def failed(data):
+    """
+    Return a record as archived in the error output of Firehose.
+    """
+    return json.dumps({"errorCode": "Lambda.Timeout", "rawData": data}).encode()
+
+
+def put(s3, key, *records):
+    s3.put_object(Bucket="archive", Key=key, Body=b"\n".join(records))
+    return f"s3://archive/{key}"
+
+
+def events(s3, key):
+    return [
+        event
+        for line in s3.lines("replayed", key)
+        for event in decode_packed(line)["databaseActivityEventList"]
+    ]
+
+
+def test_outputs_are_written_by_partition(s3, source, record_data):
+    other = dict(QUERY, databaseName="other")
+    url = put(
+        s3,
+        "backup/1",
+        archived(record_data([QUERY, HEARTBEAT])),
+        failed(record_data([LOGIN, other, other])),
+        archived(record_data([QUERY, other])),
+    )
+
+    assert replay.replay([url], "s3://replayed/out", source) == 0
+
+    olist = "out/" + PARTITION.format("olist") + "archive_backup_1"
+    other_key = "out/" + PARTITION.format("other") + "archive_backup_1"
+    several = "out/" + PARTITION.format("_multiple") + "archive_backup_1"
+    assert sorted(s3.buckets["replayed"]) == [several, olist, other_key]
+    assert events(s3, olist) == [QUERY]
+    assert events(s3, other_key) == [other, other]
+    assert events(s3, several) == [QUERY, other]
+
+
+def test_local_inputs_and_outputs(source, record_data, tmp_path, monkeypatch):
+    monkeypatch.setattr(handler, "PARTITION_KEYS", handler.PARTITION_KEYS)
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    (archive / "1.gz").write_bytes(gzip.compress(archived(record_data([QUERY]))))
+    inputs = list(replay.list_inputs([str(archive)]))
+
+    assert replay.replay(inputs, str(tmp_path / "out"), source) == 0
+
+    (path,) = (tmp_path / "out").glob("resource_id=*/*/*/*/*/*")
+    assert str(path.relative_to(tmp_path / "out")).startswith(PARTITION.format("olist"))
+    assert path.name == replay.output_name(inputs[0])
+    (line,) = path.read_bytes().splitlines()
+    assert decode_packed(line)["databaseActivityEventList"] == [QUERY]
+
+
+def test_replays_resume_after_the_checkpoint(s3, source, record_data, tmp_path):
+    checkpoint = str(tmp_path / "replay.checkpoint")
+    inputs = [put(s3, f"backup/{i}", archived(record_data([QUERY]))) for i in range(2)]
+
+    assert replay.replay(inputs, "s3://replayed/", source, checkpoint) == 0
+
+    with open(checkpoint) as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry["input"] for entry in entries] == inputs
+    assert entries[0]["outputs"] == [
+        "s3://replayed/" + PARTITION.format("olist") + "archive_backup_0"
+    ]
+
+    s3.buckets["replayed"].clear()
+    inputs.append(put(s3, "backup/2", archived(record_data([QUERY]))))
+    # A line cut off by an interrupted replay is ignored.
+    with open(checkpoint, "a") as f:
+        f.write('{"input": "s3://archive/backup/2", "outp')
+
+    assert replay.replay(inputs, "s3://replayed/", source, checkpoint) == 0
+
+    assert list(s3.buckets["replayed"]) == [
+        PARTITION.format("olist") + "archive_backup_2"
+    ]
+    assert replay.load_checkpoint(checkpoint) == set(inputs)
+
+
+def test_failed_records_are_reported(s3, source, record_data):
+    garbage = base64.b64encode(b"garbage").decode()
+    url = put(
+        s3,
+        "backup/1",
+        archived(record_data([QUERY])),
+        failed(garbage),
+        b'{"type": "DatabaseActivityMonitoringRecords", "ver',
+    )
+
+    assert replay.replay([url], "s3://replayed/", source) == 0
+
+    errors = [
+        json.loads(line)
+        for line in s3.lines("replayed", "processing-failed/archive_backup_1")
+    ]
+    assert [(error["errorCode"], error["recordIndex"]) for error in errors] == [
+        ("MalformedRecord", 1),
+        ("MalformedRecord", 2),
+    ]
+    assert errors[0]["rawData"] == garbage
+    assert errors[1]["rawData"] is None
+    assert errors[1]["errorMessage"].startswith("Malformed input")
+    assert events(s3, PARTITION.format("olist") + "archive_backup_1") == [QUERY]
+
+
+def test_objects_with_transient_failures_are_retried(
+    s3, kms, source, record_data, tmp_path
+):
+    checkpoint = str(tmp_path / "replay.checkpoint")
+    url = put(
+        s3,
+        "backup/1",
+        archived(record_data([QUERY], key=0)),
+        archived(record_data([QUERY], key=1)),
+    )
+    kms.throttled[record_data.wrapped(1)] = handler.RECORD_RETRIES + 1
+
+    assert replay.replay([url], "s3://replayed/", source, checkpoint) == 1
+
+    assert s3.buckets["replayed"] == {}
+    assert replay.load_checkpoint(checkpoint) == set()
+
+    assert replay.replay([url], "s3://replayed/", source, checkpoint) == 0
+
+    assert events(s3, PARTITION.format("olist") + "archive_backup_1") == [QUERY] * 2
+    assert replay.load_checkpoint(checkpoint) == {url}
+
+
+def test_objects_that_cannot_be_read_are_reported(s3, source, tmp_path):
+    checkpoint = str(tmp_path / "replay.checkpoint")
+
+    assert (
+        replay.replay(["s3://archive/missing"], "s3://replayed/", source, checkpoint)
+        == 1
+    )
+    assert replay.load_checkpoint(checkpoint) == set()
+
+
+def test_the_cli_runs_outside_lambda():
+    env = {
+        name: value
+        for name, value in os.environ.items()
+        if name not in ("AWS_REGION", "kms_key_arn", "rds_resource_id")
+    }
+
+    result = subprocess.run(
+        [sys.executable, "-m", "selectstar_das_processor.replay", "--help"],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "--region" in result.stdout
+
+
+def test_the_cli_replays_the_given_database(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(replay, "replay", lambda *args: calls.append(args) or 0)
+    (tmp_path / "1.json").write_bytes(b"")
+    argv = [str(tmp_path), "--output", "s3://replayed/", "--processes", "2"]
+
+    assert replay.main(argv + ["--resource-id", "db-ABC", "--region", "eu-west-1"]) == 0
+    assert replay.main(argv + ["--resource-id", "db-ABC"]) == 0
+
+    assert [args[2] for args in calls] == [
+        Source("db-ABC", "eu-west-1"),
+        Source("db-ABC", handler.kms_region),
+    ]
+    assert calls[0][:2] == ([str(tmp_path / "1.json")], "s3://replayed/")
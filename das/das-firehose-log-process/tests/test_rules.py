@@ -0,0 +1,35 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from selectstar_das_processor.rules import load_event_filter
+
+RULES = {
+    "*": [{"name": "admin", "match": {"dbUserName": ["rdsadmin", "rdsa"]}}],
+    "sqlserver": [{"name": "logins", "match": {"class": "LOGIN"}}],
+}
+
+
+def test_first_matching_rule_counts_the_drop():
+    event_filter = load_event_filter(json.dumps(RULES))
+    events = [
+        {"serverType": "SQLSERVER", "class": "LOGIN", "dbUserName": "rdsadmin"},
+        {"serverType": "SQLSERVER", "class": "SERVER", "dbUserName": "rdsa"},
+        {"serverType": "ORACLE", "class": "LOGIN", "dbUserName": "app"},
+    ]
+
+    assert [event_filter.allows(event) for event in events] == [False, False, True]
+    assert event_filter.stats() == {"admin": 1, "logins": 1}
+
+
+def test_drops_are_counted_across_threads():
+    event_filter = load_event_filter(json.dumps(RULES))
+    event = {"serverType": "SQLSERVER", "class": "LOGIN"}
+
+    def drop(count):
+        return sum(not event_filter.allows(event) for _ in range(count))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        dropped = sum(executor.map(drop, [5000] * 16))
+
+    assert dropped == 80000
+    assert event_filter.stats() == {"admin": 0, "logins": 80000}
@@ -0,0 +1,102 @@
+import base64
+import json
+import os
+
+import pytest
+
+from selectstar_das_processor import handler
+from selectstar_das_processor.rules import load_event_filter
+from selectstar_das_processor.sampling import SUPPRESSED, load_event_sampler
+from tests.stubs import LOGIN, QUERY, decode_packed
+
+# Three events, then one every 1000 seconds of logTime.
+SAMPLERS = {"*": [{"name": "hot", "by": "command", "rate": 0.001, "burst": 3}]}
+
+
+def sample(event_sampler, events, suppressed=None):
+    record = event_sampler.record(suppressed)
+    kept = [event for event in events if record.keep(event)]
+    return kept, record
+
+
+def test_rates_apply_across_record_sets():
+    event_sampler = load_event_sampler(json.dumps(SAMPLERS))
+    events = [dict(QUERY, commandText=f"select {i}") for i in range(5)]
+
+    kept, record = sample(event_sampler, events)
+    (summary,) = record.summaries()
+
+    assert kept == events[:3]
+    assert record.suppressed == [3, 4]
+    assert summary["type"] == SUPPRESSED
+    assert summary["suppressedCount"] == 2
+    assert summary["dbUserNames"] == ["root"]
+    assert sample(event_sampler, events)[0] == []
+    assert event_sampler.stats() == {"hot": 7}
+
+
+def test_earlier_passes_are_repeated_without_sampling_again():
+    event_sampler = load_event_sampler(json.dumps(SAMPLERS))
+    events = [dict(QUERY, commandText=f"select {i}") for i in range(5)]
+    _kept, first = sample(event_sampler, events)
+
+    kept, record = sample(event_sampler, events, first.suppressed)
+
+    assert kept == events[:3]
+    assert record.summaries() == first.summaries()
+    assert event_sampler.stats() == {"hot": 2}
+    # The tokens of the groups are left for the next record sets.
+    assert sample(event_sampler, events)[0] == []
+
+
+def test_unknown_settings_are_rejected():
+    with pytest.raises(ValueError, match="needs exactly one of rate and every"):
+        load_event_sampler(json.dumps({"*": [{"name": "x"}]}))
+    with pytest.raises(ValueError, match="Unknown settings"):
+        load_event_sampler(json.dumps({"*": [{"every": 2, "often": True}]}))
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_records_shrunk_to_fit_the_response_keep_their_events(
+    kms, record_data, monkeypatch, processes
+):
+    """
+    Records processed again to fit the response keep the events of their first
+    pass, and their drops and suppressed events are counted once.
+    """
+    monkeypatch.setattr(
+        handler, "event_sampler", load_event_sampler(json.dumps(SAMPLERS))
+    )
+    monkeypatch.setattr(handler, "event_filter", load_event_filter())
+    # Long texts that only fit once trimmed.
+    events = [dict(QUERY, commandText=os.urandom(10000).hex()) for _ in range(5)]
+    monkeypatch.setattr(handler, "MAX_RESPONSE", 30000)
+    monkeypatch.setattr(handler, "WORKER_PROCESSES", processes)
+    # Forked with the stubs and samplers of this test.
+    monkeypatch.setattr(handler, "_process_pool", None)
+    data = record_data([LOGIN, *events])
+    event = {
+        "records": [
+            {"recordId": "1", "data": data},
+            {"recordId": "2", "data": record_data([LOGIN])},
+        ]
+    }
+
+    try:
+        output_record, dropped = handler.lambda_handler(event, None)["records"]
+    finally:
+        if handler._process_pool is not None:
+            handler._process_pool.close()
+
+    assert output_record["result"] == "Ok"
+    record_set = decode_packed(base64.b64decode(output_record["data"]))
+    *kept, summary = record_set["databaseActivityEventList"]
+    assert [event["commandText"] for event in kept] == [
+        event["commandText"][: handler.TRIM_COMMAND_TEXT] for event in events[:3]
+    ]
+    assert summary["suppressedCount"] == 2
+    assert dropped["result"] == "Dropped"
+    if processes == 1:
+        # Worker processes count in their own samplers and rules.
+        assert handler.event_sampler.stats() == {"hot": 2}
+        assert handler.event_filter.stats() == {"sqlserver-logins": 2}
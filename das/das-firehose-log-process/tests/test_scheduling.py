@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from selectstar_das_processor.scheduling import Deadline, map_before
+
+
+class Context:
+    def __init__(self, seconds):
+        self.end = time.monotonic() + seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.end - time.monotonic()) * 1000)
+
+
+def expired(item):
+    return "expired", item
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_results_are_in_input_order(executor, workers):
+    results = map_before(
+        Deadline(), lambda item: item * 2, list(range(20)), expired, executor, workers
+    )
+
+    assert results == [item * 2 for item in range(20)]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_records_are_not_started_past_the_deadline(executor, workers):
+    def slow(item):
+        time.sleep(0.1)
+        return item
+
+    results = map_before(
+        Deadline(Context(0.35), margin=0),
+        slow,
+        list(range(20)),
+        expired,
+        executor,
+        workers,
+    )
+
+    done = [result for result in results if not isinstance(result, tuple)]
+    assert 2 * workers <= len(done) <= 3 * workers
+    assert results[len(done) :] == [expired(item) for item in range(len(done), 20)]
+
+
+def test_workers_stop_once_the_results_are_returned(executor):
+    started = []
+    release = threading.Event()
+
+    def stuck(item):
+        started.append(item)
+        release.wait(1)
+        return item
+
+    # The first records take longer than the deadline allows.
+    results = map_before(
+        Deadline(Context(0.1), margin=0), stuck, list(range(20)), expired, executor, 4
+    )
+    release.set()
+    executor.shutdown(wait=True)
+
+    assert results == [expired(item) for item in range(20)]
+    assert sorted(started) == [0, 1, 2, 3]
+
+
+def test_errors_of_workers_are_raised(executor):
+    def fail(item):
+        raise RuntimeError(item)
+
+    with pytest.raises(RuntimeError):
+        map_before(Deadline(), fail, [1, 2, 3], expired, executor, 4)
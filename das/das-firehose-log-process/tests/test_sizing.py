@@ -0,0 +1,130 @@
+import json
+
+import pytest
+
+from selectstar_das_processor.sizing import (
+    TRUNCATED,
+    fit_response,
+    record_size,
+    trim_event,
+)
+
+
+def output_record(record_id, size, result="Ok"):
+    record = {"recordId": record_id, "result": result}
+    if result != "Dropped":
+        record["data"] = "x" * size
+    return record
+
+
+def shrink_to(size):
+    """
+    Return a step re-encoding the output records with ``size`` bytes of data,
+    or failing to with ``size`` None.
+    """
+    calls = []
+
+    def step(index):
+        calls.append(index)
+        return None if size is None else output_record(str(index), size)
+
+    step.calls = calls
+    return step
+
+
+def response_size(output):
+    return len(json.dumps({"records": output}))
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        output_record("1", 0),
+        output_record("49609629375939585922", 4096),
+        output_record("1", 0, "Dropped"),
+        dict(output_record("1", 10), metadata={"partitionKeys": {"database": "é"}}),
+    ],
+)
+def test_record_sizes_cover_their_json(record):
+    assert record_size(record) >= len(json.dumps(record)) + len(", ")
+
+
+def test_responses_that_fit_are_left_alone():
+    output = [output_record(str(index), 100) for index in range(3)]
+    step = shrink_to(10)
+
+    assert fit_response(output, [step], budget=1000) == [0, 0]
+    assert step.calls == []
+
+
+def test_largest_records_are_shrunk_first_until_the_response_fits():
+    output = [
+        output_record("0", 500),
+        output_record("1", 2000),
+        output_record("2", 1000),
+        output_record("3", 3000, "ProcessingFailed"),
+    ]
+    step = shrink_to(10)
+    budget = sum(map(record_size, output)) - 2500
+
+    assert fit_response(output, [step], budget=budget) == [2, 0]
+
+    assert step.calls == [1, 2]
+    assert [len(record.get("data", "")) for record in output] == [500, 10, 10, 3000]
+    assert sum(map(record_size, output)) <= budget
+
+
+def test_steps_apply_in_order_and_only_when_they_shrink():
+    output = [output_record("0", 1000), output_record("1", 1000)]
+    budget = sum(map(record_size, output)) - 500
+    cannot = shrink_to(None)
+    larger = shrink_to(2000)
+    smaller = shrink_to(100)
+
+    changed = fit_response(output, [cannot, larger, smaller], budget=budget)
+
+    assert changed == [0, 0, 1, 0]
+    assert cannot.calls == larger.calls == [0, 1]
+    assert smaller.calls == [0]
+
+
+def test_records_fail_when_nothing_else_helps():
+    output = [
+        output_record("0", 3000),
+        output_record("1", 1000),
+        output_record("2", 0, "Dropped"),
+    ]
+    budget = 2000
+
+    assert fit_response(output, [shrink_to(2500)], budget=budget) == [1, 1]
+
+    assert output[0] == {"recordId": "0", "result": "ProcessingFailed"}
+    assert output[1:] == [output_record("1", 1000), output_record("2", 0, "Dropped")]
+    assert response_size(output) <= budget
+
+
+def test_long_texts_and_parameter_lists_are_trimmed():
+    event = {"commandText": "x" * 10, "paramList": list(range(5))}
+
+    assert trim_event(event, 4, 2)
+
+    assert event == {
+        "commandText": "xxxx",
+        "paramList": [0, 1],
+        TRUNCATED: ["commandText", "paramList"],
+    }
+
+
+def test_trimming_adds_to_fields_truncated_earlier():
+    event = {
+        "commandText": "x" * 10,
+        "paramList": None,
+        TRUNCATED: ["commandText", "remoteHost"],
+    }
+
+    assert trim_event(event, 4, 2)
+    assert event[TRUNCATED] == ["commandText", "remoteHost"]
+
+    short = {"commandText": "x", "paramList": [1]}
+    assert not trim_event(short, 4, 2)
+    assert short == {"commandText": "x", "paramList": [1]}
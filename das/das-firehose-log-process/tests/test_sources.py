@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from selectstar_das_processor.sources import Source, load_source_resolver
+
+ARN = "arn:aws:kinesis:eu-west-1:123456789012:stream/{}"
+DEFAULT = Source("cluster-DEFAULT", "us-east-1")
+
+
+def resolver(mapping=None, default=DEFAULT):
+    return load_source_resolver(json.dumps(mapping) if mapping else None, None, default)
+
+
+def test_streams_named_after_their_database_resolve_without_a_mapping():
+    sources = resolver()
+
+    assert sources.resolve(ARN.format("aws-rds-das-cluster-ABC123")) == Source(
+        "cluster-ABC123", "eu-west-1"
+    )
+    assert sources.resolve(ARN.format("aws-rds-das-db-XYZ")) == Source(
+        "db-XYZ", "eu-west-1"
+    )
+
+
+@pytest.mark.parametrize(
+    "stream_arn",
+    [
+        None,
+        "",
+        ARN.format("orders"),
+        ARN.format("aws-rds-das-cluster-ABC-copy"),
+        "aws-rds-das-cluster-ABC",
+    ],
+)
+def test_other_streams_resolve_to_the_default(stream_arn):
+    assert resolver().resolve(stream_arn) == DEFAULT
+    assert resolver(default=None).resolve(stream_arn) is None
+
+
+def test_mapped_streams_resolve_by_arn_or_name():
+    sources = resolver(
+        {
+            "orders": "db-ORDERS",
+            ARN.format("aws-rds-das-cluster-ABC"): {
+                "resourceId": "cluster-OTHER",
+                "region": "us-west-2",
+            },
+        }
+    )
+
+    assert sources.resolve(ARN.format("orders")) == Source("db-ORDERS", "eu-west-1")
+    assert sources.resolve("orders") == Source("db-ORDERS", None)
+    assert sources.resolve(ARN.format("aws-rds-das-cluster-ABC")) == Source(
+        "cluster-OTHER", "us-west-2"
+    )
+    assert sources.resolve(ARN.format("aws-rds-das-cluster-ABC")) is sources.resolve(
+        ARN.format("aws-rds-das-cluster-ABC")
+    )
+
+
+def test_encryption_contexts_name_clusters_and_instances():
+    assert Source("cluster-ABC", None).encryption_context == {
+        "aws:rds:dbc-id": "cluster-ABC"
+    }
+    assert Source("db-ABC", None).encryption_context == {"aws:rds:db-id": "db-ABC"}
+
+
+def test_mappings_are_read_from_files(tmp_path):
+    path = tmp_path / "sources.json"
+    path.write_text(json.dumps({"orders": "db-ORDERS"}))
+
+    sources = load_source_resolver(path=str(path))
+
+    assert sources.resolve(ARN.format("orders")) == Source("db-ORDERS", "eu-west-1")
+    assert load_source_resolver().resolve(ARN.format("orders")) is None
+
+
+@pytest.mark.parametrize(
+    "mapping, match",
+    [
+        ({"orders": {"region": "eu-west-1"}}, "Invalid source of stream orders"),
+        ({"orders": ["db-ORDERS"]}, "Invalid source of stream orders"),
+        (["orders"], "must be a JSON object"),
+    ],
+)
+def test_invalid_mappings_are_rejected(mapping, match):
+    with pytest.raises(ValueError, match=match):
+        load_source_resolver(json.dumps(mapping))
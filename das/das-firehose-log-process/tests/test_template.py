@@ -0,0 +1,144 @@
+"""
+Checks of the CloudFormation template of the processor, with its intrinsic
+functions resolved for given parameters.
+"""
+
+import fnmatch
+import os
+
+import pytest
+
+yaml = pytest.importorskip("yaml")
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "..", "SelectStarDAS.yaml")
+KEY_ARN = "arn:aws:kms:us-east-2:123456789012:key/f319545f-a0d4-4bfc-896f"
+ACCOUNT = "123456789012"
+
+
+@pytest.fixture(scope="module")
+def template():
+    with open(TEMPLATE) as f:
+        return yaml.safe_load(f)
+
+
+def resolve(value, template, parameters):
+    """
+    Resolve the intrinsic functions used by the template in ``value``.
+    """
+    if isinstance(value, list):
+        return [
+            item
+            for item in (resolve(item, template, parameters) for item in value)
+            if item is not None
+        ]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        ((function, argument),) = value.items()
+        if function == "Ref":
+            return {"AWS::NoValue": None}.get(argument, parameters.get(argument))
+        if function == "Fn::Sub":
+            return argument.replace("${AWS::Partition}", "aws").replace(
+                "${AWS::AccountId}", ACCOUNT
+            )
+        if function == "Fn::If":
+            condition, if_true, if_false = argument
+            chosen = template["Conditions"][condition]
+            chosen = if_true if resolve(chosen, template, parameters) else if_false
+            return resolve(chosen, template, parameters)
+        if function == "Fn::Equals":
+            first, second = resolve(argument, template, parameters)
+            return first == second
+        if function == "Fn::Not":
+            (condition,) = resolve(argument, template, parameters)
+            return not condition
+    return {
+        key: resolved
+        for key, resolved in (
+            (key, resolve(item, template, parameters)) for key, item in value.items()
+        )
+        if resolved is not None
+    }
+
+
+def allows_decrypt(statements, key_arn, context):
+    """
+    Return whether the statements allow ``kms:Decrypt`` of a data key of the
+    KMS key ``key_arn`` with the encryption context ``context``.
+    """
+    for statement in statements:
+        resources = statement["Resource"]
+        if isinstance(resources, str):
+            resources = [resources]
+        if "kms:Decrypt" not in statement["Action"] or not any(
+            fnmatch.fnmatchcase(key_arn, resource) for resource in resources
+        ):
+            continue
+        conditions = statement.get("Condition", {})
+        assert set(conditions) <= {"ForAnyValue:StringEquals"}, conditions
+        if all(
+            set(context) & set(values)
+            for key, values in conditions.get("ForAnyValue:StringEquals", {}).items()
+            if key == "kms:EncryptionContextKeys"
+        ):
+            return True
+    return False
+
+
+def decrypt_statements(template, parameters):
+    role = resolve(template["Resources"]["LambdaExecutionRole"], template, parameters)
+    (policy,) = [
+        policy
+        for policy in role["Properties"]["Policies"]
+        if policy["PolicyName"] == "decrypt"
+    ]
+    return policy["PolicyDocument"]["Statement"]
+
+
+def lambda_environment(template, parameters):
+    function = template["Resources"]["ProcessKinesisDataLambda"]
+    return resolve(function, template, parameters)["Properties"]["Environment"][
+        "Variables"
+    ]
+
+
+@pytest.mark.parametrize(
+    "context",
+    [{"aws:rds:dbc-id": "cluster-ABC"}, {"aws:rds:db-id": "db-ABC"}],
+    ids=["cluster", "instance"],
+)
+@pytest.mark.parametrize("key_arn", [KEY_ARN, ""], ids=["key", "no key"])
+def test_streams_of_clusters_and_instances_can_be_decrypted(template, key_arn, context):
+    statements = decrypt_statements(template, {"KmsKeyARN": key_arn})
+
+    assert allows_decrypt(statements, KEY_ARN, context)
+
+
+def test_a_given_key_is_the_only_one_allowed(template):
+    statements = decrypt_statements(template, {"KmsKeyARN": KEY_ARN})
+    other = KEY_ARN.replace("f319545f", "00000000")
+
+    assert not allows_decrypt(statements, other, {"aws:rds:db-id": "db-ABC"})
+
+
+def test_without_a_key_only_das_data_keys_are_allowed(template):
+    statements = decrypt_statements(template, {"KmsKeyARN": ""})
+
+    assert not allows_decrypt(statements, KEY_ARN, {})
+    assert not allows_decrypt(statements, KEY_ARN, {"purpose": "other"})
+    other_account = KEY_ARN.replace(ACCOUNT, "210987654321")
+    assert not allows_decrypt(statements, other_account, {"aws:rds:db-id": "db-ABC"})
+
+
+def test_empty_database_parameters_are_not_passed_on(template):
+    parameters = {"KmsKeyARN": "", "RdsResourceId": "", "DasSources": ""}
+    environment = lambda_environment(template, parameters)
+
+    assert "kms_key_arn" not in environment
+    assert "rds_resource_id" not in environment
+
+    parameters = {"KmsKeyARN": KEY_ARN, "RdsResourceId": "db-ABC"}
+    environment = lambda_environment(template, parameters)
+
+    assert environment["kms_key_arn"] == KEY_ARN
+    assert environment["rds_resource_id"] == "db-ABC"
@@ -2,6 +2,8 @@
 set -eux
 BUCKET="${1-cf-templates-pp3cips1o7jf-us-east-2}"
 PREFIX="${2-das}"
+# Python version of the Lambda runtime, see SelectStarDAS.yaml
+PYTHON_VERSION=3.12
 
 pip install poetry # ensure that poetry is installed
 
@@ -11,7 +13,15 @@ cat ./SelectStarDAS.yaml |  yq e -o=json > ./SelectStarDAS.json
 # Build deployment package
 pushd das-firehose-log-process
 poetry build --format wheel
-poetry run pip install --upgrade --only-binary :all: --platform manylinux2014_aarch64 --python-version 3.12 --target package --implementation cp dist/*.whl
+poetry run pip install --upgrade --no-compile --only-binary :all: --platform manylinux2014_aarch64 --python-version "$PYTHON_VERSION" --target package --implementation cp dist/*.whl
+# Drop the service models of botocore other than those of the services called:
+# KMS, and S3 for the Kinesis consumer and profile uploads
+find package/botocore/data -mindepth 1 -maxdepth 1 -type d ! -name kms ! -name s3 -exec rm -rf {} +
+# Precompile bytecode for the runtime: /var/task is read-only, so without it
+# every cold start compiles all modules again. Unchecked hashes skip comparing
+# source timestamps, which zip only keeps to the nearest two seconds.
+find package -type d -name __pycache__ -prune -exec rm -rf {} +
+"python$PYTHON_VERSION" -m compileall -q -j 0 --invalidation-mode unchecked-hash package
 (cd package; zip -X --no-dir-entries --quiet --recurse-paths ../handler.zip .)
 popd;
 
@@ -15,6 +15,7 @@ resource "aws_cloudformation_stack" "stack-master" {
     KinesisStreamARN = var.kinesis_stream_arn
     KmsKeyARN        = var.kms_key_arn
     RdsResourceId    = var.rds_resource_id
+    DasSources       = var.das_sources
     IamPrincipal     = var.iam_principal
     ExternalId       = var.external_id
   }
@@ -15,8 +15,10 @@ variable "kinesis_stream_arn" {
 variable "kms_key_arn" {
   type        = string
   nullable    = false
+  default     = ""
+  description = "The KMS key used by the Database Activity Stream. Leave empty to allow the DAS keys of all databases in the account."
   validation {
-    condition     = can(regex("^arn:aws:kms:", var.kms_key_arn))
+    condition     = var.kms_key_arn == "" || can(regex("^arn:aws:kms:", var.kms_key_arn))
     error_message = "Invalid AWS KMS key. You must enter a valid ARN. Example: arn:aws:kms:us-east-2:792169733636:key/f319545f-a0d4-4bfc-896f-5d37fe921ffb"
   }
 }
@@ -24,14 +26,21 @@ variable "kms_key_arn" {
 variable "rds_resource_id" {
   type        = string
   nullable    = false
-  description = "The RDS resource ID that you want to integrate with Select Star. It is available in the RDS console. Example: db-ZQO7M43PGGUXJEZVYSALTO76KA"
+  default     = ""
+  description = "The RDS resource ID that you want to integrate with Select Star. It is available in the RDS console. Example: db-ZQO7M43PGGUXJEZVYSALTO76KA. Leave empty when every stream is named after its database or listed in das_sources."
 
   validation {
-    condition     = can(regex("^[a-z]+\\-[A-Z0-9]+$", var.rds_resource_id))
+    condition     = var.rds_resource_id == "" || can(regex("^[a-z]+\\-[A-Z0-9]+$", var.rds_resource_id))
     error_message = "Invalid RDS resource ID. You must enter a valid resource ID. Are you sure you didn't use resource ARN? "
   }
 }
 
+variable "das_sources" {
+  type        = string
+  default     = ""
+  description = "Optional JSON mapping of Kinesis stream names or ARNs to the resource ID of their database. Streams named aws-rds-das-<resource ID> need no entry."
+}
+
 variable "iam_principal" {
   type        = string
   nullable    = false
@@ -2,15 +2,28 @@
 set -eux
 BUCKET="${1-cf-templates-pp3cips1o7jf-us-east-2}"
 PREFIX="${2-redshift}"
+# Python version of the Lambda runtime, see SelectStarRedshift.json
+PYTHON_VERSION=3.9
 
 # Build deployment package
 rm -f deployment-package.zip
-pip install --target ./package -r requirements.txt
+# Wheels for the runtime, whichever Python runs pip
+python3 -m pip install --upgrade --no-compile --only-binary :all: --platform manylinux2014_x86_64 --python-version "$PYTHON_VERSION" --target ./package --implementation cp -r requirements.txt
+# Drop the service models of botocore other than the ones called, and S3 for
+# the uploads of profile_s3_uri, if the requirements brought their own botocore
+if [ -d package/botocore/data ]; then
+    find package/botocore/data -mindepth 1 -maxdepth 1 -type d ! -name redshift ! -name redshift-data ! -name s3 -exec rm -rf {} +
+fi
+# profiling.py links to the module of the DAS processor.
+cp -L provision.py profiling.py transform.py cfnresponse.py package/
+# Precompile bytecode for the runtime, with the interpreter of its version set
+# up by the deploy workflow: /var/task is read-only, so without it every cold
+# start compiles all modules again. Unchecked hashes skip comparing source
+# timestamps, which zip only keeps to the nearest two seconds.
+find package -type d -name __pycache__ -prune -exec rm -rf {} +
+"python$PYTHON_VERSION" -m compileall -q -j 0 --invalidation-mode unchecked-hash package
 pushd package
 zip -r ../deployment-package.zip .
-zip -g ../deployment-package.zip ../provision.py
-zip -g ../deployment-package.zip ../transform.py
-zip -g ../deployment-package.zip ../cfnresponse.py
 popd;
 # Generate templates
 python update.py "$BUCKET" "$PREFIX/deployment-package.zip"
@@ -0,0 +1 @@
+../das/das-firehose-log-process/selectstar_das_processor/profiling.py
\ No newline at end of file
@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import time
@@ -5,9 +6,9 @@ import cfnresponse
 import botocore
 import boto3
 import os
-from aws_xray_sdk.core import xray_recorder
-from aws_xray_sdk.core import patch_all
-import sentry_sdk
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from profiling import load_profiler
 
 logging.basicConfig(
     format="%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s",
@@ -16,8 +17,14 @@ logging.basicConfig(
 )
 
 if "LAMBDA_TASK_ROOT" in os.environ:
+    from aws_xray_sdk.core import xray_recorder
+    from aws_xray_sdk.core import patch
+
     xray_recorder.configure(service="Select Star & AWS RDS for PostgreSQL integration")
-    patch_all()
+    # Only the libraries this function calls through. patch_all() imports and
+    # patches every supported library that happens to be installed, which adds
+    # to every cold start.
+    patch(["botocore", "httplib"])
 
 USER_ACTIVITY = "enable_user_activity_logging"
 TABLES = [
@@ -28,14 +35,56 @@ TABLES = [
     "STL_DDLTEXT",
     "STL_QUERY",
 ]
+# Databases whose grants or revokes run at the same time. The statements of a
+# database are sent as a single batch.
+GRANT_CONCURRENCY = max(1, int(os.environ.get("grant_concurrency", "8")))
+# Seconds between polls of a running statement, doubled up to the maximum.
+POLL_DELAY = 0.25
+POLL_MAX_DELAY = 2
+# Databases listed in the error reported to CloudFormation.
+MAX_REPORTED_DATABASES = 10
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-redshiftdata_client = boto3.client("redshift-data")
-redshift_client = boto3.client("redshift")
+# On-demand profiling of invocations, see `profiling`. profile lists the modes,
+# cprofile and tracemalloc running on 1 in profile_every invocations.
+profiler = load_profiler(
+    "redshift-provision",
+    os.environ.get("profile"),
+    every=int(os.environ.get("profile_every", "1")),
+    top=int(os.environ.get("profile_top", "25")),
+    path=os.environ.get("profile_path", "/tmp/profiles"),
+    s3_uri=os.environ.get("profile_s3_uri"),
+    log=logger.info,
+)
+
+
+class LazyClient:
+    """
+    A boto3 client that is created on first use rather than at import.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.client = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self.client is None:
+            # Grants of several databases may be the first use at once.
+            with self.lock:
+                if self.client is None:
+                    self.client = boto3.client(self.service)
+        return getattr(self.client, name)
+
+
+redshiftdata_client = LazyClient("redshift-data")
+redshift_client = LazyClient("redshift")
 
 if "SENTRY_DSN" in os.environ:
+    import sentry_sdk
+
     sentry_sdk.init(
         dsn=os.environ["SENTRY_DSN"],
         traces_sample_rate=0.0,
@@ -49,6 +98,7 @@ class DataException(Exception):
 
 def retry_aws(retries=8, codes=[]):
     def outer(fn):
+        @functools.wraps(fn)
         def inner(*args, **kwargs):
             error = None
             for i in range(0, retries):
@@ -70,29 +120,93 @@ def retry_aws(retries=8, codes=[]):
     return outer
 
 
+def waitForStatement(statement_id):
+    delay = POLL_DELAY
+    response = redshiftdata_client.describe_statement(Id=statement_id)
+    while response["Status"] in ["SUBMITTED", "PICKED", "STARTED"]:
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_DELAY)
+        response = redshiftdata_client.describe_statement(Id=statement_id)
+    return response
+
+
+@profiler.timed
 def execQuery(cluster, db, user, statement):
     try:
         response = redshiftdata_client.execute_statement(
             ClusterIdentifier=cluster, Database=db, DbUser=user, Sql=statement
         )
-        response = redshiftdata_client.describe_statement(Id=response["Id"])
-
-        while response["Status"] in ["SUBMITTED", "PICKED", "STARTED"]:
-            time.sleep(2)
-            response = redshiftdata_client.describe_statement(Id=response["Id"])
+        response = waitForStatement(response["Id"])
         if response["HasResultSet"]:
             response["Records"] = redshiftdata_client.get_statement_result(
                 Id=response["Id"]
             )["Records"]
-        logger.info("Finished: %s", statement)
         if response["Status"] != "FINISHED":
-            raise DataException("Failed SQL: " + str(response["Error"]))
+            raise DataException("Failed SQL: " + str(response.get("Error")))
+        logger.info("Finished: %s", statement)
         return response
     except Exception as e:
         logger.info("Failed Exec Query: %s", e)
         raise e
 
 
+@profiler.timed
+def execBatch(cluster, db, user, statements):
+    """
+    Run statements on a database as a single batch, which the Data API runs in
+    one transaction.
+    """
+    try:
+        response = redshiftdata_client.batch_execute_statement(
+            ClusterIdentifier=cluster, Database=db, DbUser=user, Sqls=statements
+        )
+        response = waitForStatement(response["Id"])
+        if response["Status"] != "FINISHED":
+            raise DataException("Failed SQL: " + str(response.get("Error")))
+        logger.info("Finished %d statements on %s", len(statements), db)
+        return response
+    except Exception as e:
+        logger.info("Failed Exec Batch on %s: %s", db, e)
+        raise e
+
+
+@profiler.timed
+def execOnDatabases(cluster, databases, user, statements):
+    """
+    Run the statements as a batch on each database, GRANT_CONCURRENCY databases
+    at a time, and return the errors by database.
+    """
+    errors = {}
+    if not databases:
+        return errors
+    workers = min(GRANT_CONCURRENCY, len(databases))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(execBatch, cluster, dbname, user, statements): dbname
+            for dbname in databases
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+    return errors
+
+
+def databaseErrors(action, errors, count):
+    """
+    Return a single message for the databases an action failed on.
+    """
+    failed = sorted(errors.items())
+    message = "; ".join(
+        f"{dbname}: {error}" for dbname, error in failed[:MAX_REPORTED_DATABASES]
+    )
+    if len(failed) > MAX_REPORTED_DATABASES:
+        message += f"; and {len(failed) - MAX_REPORTED_DATABASES} more"
+    return f"{action} failed on {len(failed)} of {count} databases ({message})"
+
+
+@profiler.timed
 def ensure_cluster_state(cluster):
     try:
         instances = redshift_client.describe_clusters(ClusterIdentifier=cluster)[
@@ -118,6 +232,7 @@ def ensure_cluster_state(cluster):
     logger.info("Publicly accessible status is '%s'. ", instance["PubliclyAccessible"])
 
 
+@profiler.timed
 def ensure_valid_cluster(cluster, ConfigureNetwork):
     try:
         instances = redshift_client.describe_clusters(ClusterIdentifier=cluster)[
@@ -145,6 +260,7 @@ def ensure_valid_cluster(cluster, ConfigureNetwork):
     return security_group_id, endpoint_port
 
 
+@profiler.timed
 @retry_aws(codes=["InvalidClusterState"])
 def ensure_iam_role(cluster, role):
     cluster_description = redshift_client.describe_clusters(ClusterIdentifier=cluster)[
@@ -166,6 +282,7 @@ def ensure_iam_role(cluster, role):
         waiter.wait(ClusterIdentifier=cluster)
 
 
+@profiler.timed
 @retry_aws(codes=["InvalidClusterState"])
 def ensure_logging_enabled(cluster, configureS3Logging, bucket):
     logging_status = redshift_client.describe_logging_status(
@@ -195,6 +312,7 @@ def ensure_logging_enabled(cluster, configureS3Logging, bucket):
     return logging_bucket
 
 
+@profiler.timed
 def create_cluster_parameter_group(parameter_group, prefix):
     suffix = ""
     for i in range(10):
@@ -219,6 +337,7 @@ def create_cluster_parameter_group(parameter_group, prefix):
     )
 
 
+@profiler.timed
 @retry_aws(codes=["InvalidClusterParameterGroupState"])
 def ensure_custom_parameter_group(cluster, configureS3Logging):
     cluster_description = redshift_client.describe_clusters(ClusterIdentifier=cluster)[
@@ -255,6 +374,7 @@ def ensure_custom_parameter_group(cluster, configureS3Logging):
         )
 
 
+@profiler.timed
 @retry_aws(codes=["InvalidClusterParameterGroupState"])
 def ensure_user_activity_enabled(cluster, configureS3Logging):
     cluster_description = redshift_client.describe_clusters(ClusterIdentifier=cluster)[
@@ -295,6 +415,7 @@ def ensure_user_activity_enabled(cluster, configureS3Logging):
         )
 
 
+@profiler.timed
 @retry_aws(codes=["InvalidClusterState"])
 def ensure_cluster_restarted(cluster, configureS3LoggingRestart):
     cluster_description = redshift_client.describe_clusters(ClusterIdentifier=cluster)[
@@ -344,6 +465,7 @@ def fetch_databases(cluster, db, dbUser):
                 yield database
 
 
+@profiler.profiled
 def handler(event, context):
     logger.info(json.dumps(event))
     try:
@@ -366,17 +488,17 @@ def handler(event, context):
 
         if event["RequestType"] == "Delete":
             try:
-                for dbname in grant:
-                    for table in TABLES:
-                        execQuery(
-                            cluster,
-                            dbname,
-                            dbUser,
-                            f"revoke all on {table} from selectstar;",
-                        )
+                errors = execOnDatabases(
+                    cluster,
+                    grant,
+                    dbUser,
+                    [f"revoke all on {table} from selectstar;" for table in TABLES],
+                )
+                if errors:
+                    raise DataException(databaseErrors("Revoke", errors, len(grant)))
                 execQuery(cluster, db, dbUser, "drop user selectstar;")
-            except Exception:
-                logger.warn("User could not be removed")
+            except Exception as e:
+                logger.warn(f"User could not be removed ({e})")
 
             try:
                 redshift_client.modify_cluster_iam_roles(
@@ -427,14 +549,14 @@ def handler(event, context):
                     )
                     pass
                     # ignore failure that user exist
-                for dbname in grant:
-                    for table in TABLES:
-                        execQuery(
-                            cluster,
-                            dbname,
-                            dbUser,
-                            f"grant select on {table} to selectstar;",
-                        )
+                errors = execOnDatabases(
+                    cluster,
+                    grant,
+                    dbUser,
+                    [f"grant select on {table} to selectstar;" for table in TABLES],
+                )
+                if errors:
+                    raise DataException(databaseErrors("Grant", errors, len(grant)))
             except DataException:
                 raise
             except Exception as e:
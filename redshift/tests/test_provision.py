@@ -0,0 +1,123 @@
+import itertools
+import logging
+import threading
+
+import pytest
+
+import provision
+
+
+class StubDataAPI:
+    """
+    Stands in for the redshift-data client: statements end with the status
+    given by database in ``statuses``, FINISHED by default, after one poll
+    while they run.
+    """
+
+    def __init__(self, statuses=None):
+        self.statuses = statuses or {}
+        self.batches = []
+        self.statements = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _submit(self, database):
+        with self._lock:
+            statement_id = str(next(self._ids))
+            self.statements[statement_id] = [database, 0]
+        return {"Id": statement_id}
+
+    def batch_execute_statement(self, ClusterIdentifier, Database, DbUser, Sqls):
+        self.batches.append((Database, list(Sqls)))
+        return self._submit(Database)
+
+    def execute_statement(self, ClusterIdentifier, Database, DbUser, Sql):
+        return self._submit(Database)
+
+    def describe_statement(self, Id):
+        database, polls = self.statements[Id]
+        self.statements[Id][1] += 1
+        if polls == 0:
+            return {"Id": Id, "Status": "STARTED"}
+        status = self.statuses.get(database, "FINISHED")
+        response = {"Id": Id, "Status": status, "HasResultSet": False}
+        if status == "FAILED":
+            response["Error"] = f"permission denied on {database}"
+        return response
+
+
+@pytest.fixture
+def data_api(monkeypatch):
+    stub = StubDataAPI()
+    monkeypatch.setattr(provision, "redshiftdata_client", stub)
+    monkeypatch.setattr(provision, "POLL_DELAY", 0)
+    return stub
+
+
+def finished_logs(caplog):
+    return [r.getMessage() for r in caplog.records if "Finished" in r.getMessage()]
+
+
+def test_finished_batches_are_logged(data_api, caplog):
+    caplog.set_level(logging.INFO, logger="provision")
+
+    response = provision.execBatch("cluster", "dev", "admin", ["grant 1", "grant 2"])
+
+    assert response["Status"] == "FINISHED"
+    assert data_api.batches == [("dev", ["grant 1", "grant 2"])]
+    assert finished_logs(caplog) == ["Finished 2 statements on dev"]
+
+
+@pytest.mark.parametrize("status", ["FAILED", "ABORTED"])
+def test_failed_batches_raise_without_being_logged_as_finished(
+    data_api, caplog, status
+):
+    caplog.set_level(logging.INFO, logger="provision")
+    data_api.statuses["dev"] = status
+
+    with pytest.raises(provision.DataException, match="Failed SQL"):
+        provision.execBatch("cluster", "dev", "admin", ["grant 1"])
+
+    assert finished_logs(caplog) == []
+
+
+@pytest.mark.parametrize("status", ["FAILED", "ABORTED"])
+def test_failed_queries_raise_without_being_logged_as_finished(
+    data_api, caplog, status
+):
+    caplog.set_level(logging.INFO, logger="provision")
+    data_api.statuses["dev"] = status
+
+    with pytest.raises(provision.DataException, match="Failed SQL"):
+        provision.execQuery("cluster", "dev", "admin", "drop user selectstar;")
+
+    assert finished_logs(caplog) == []
+
+
+def test_errors_are_collected_by_database(data_api, monkeypatch):
+    monkeypatch.setattr(provision, "GRANT_CONCURRENCY", 4)
+    databases = [f"db{index:02}" for index in range(20)]
+    data_api.statuses.update(db03="FAILED", db11="ABORTED")
+
+    errors = provision.execOnDatabases("cluster", databases, "admin", ["grant"])
+
+    assert sorted(database for database, _sql in data_api.batches) == databases
+    assert sorted(errors) == ["db03", "db11"]
+    assert all(isinstance(e, provision.DataException) for e in errors.values())
+    assert "permission denied on db03" in str(errors["db03"])
+
+
+def test_no_databases_run_nothing(data_api):
+    assert provision.execOnDatabases("cluster", [], "admin", ["grant"]) == {}
+    assert data_api.batches == []
+
+
+def test_reported_databases_are_limited(monkeypatch):
+    monkeypatch.setattr(provision, "MAX_REPORTED_DATABASES", 2)
+    errors = {f"db{index}": "denied" for index in range(4)}
+
+    message = provision.databaseErrors("Grant", errors, 10)
+
+    assert message == (
+        "Grant failed on 4 of 10 databases (db0: denied; db1: denied; and 2 more)"
+    )
@@ -2,7 +2,6 @@ import json
 import logging
 import cfnresponse
 import os
-import sentry_sdk
 
 logging.basicConfig(
     format="%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s",
@@ -14,6 +13,8 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 if "SENTRY_DSN" in os.environ:
+    import sentry_sdk
+
     sentry_sdk.init(
         dsn=os.environ["SENTRY_DSN"],
         traces_sample_rate=0.0,